@@ -12,6 +12,8 @@ __email__ = 'thomas.m.stoll@dartmouth.edu'
 
 import sys, time, os, glob, pickle, pdb
 import numpy as np
+from actionlog import *
+_log = get_logger(__name__)
 # from bregman.suite import *
 try:
 # 	from sklearn.decomposition import *
@@ -20,7 +22,7 @@ try:
 	from sklearn.cluster import Ward
 	have_sklearn = True
 except ImportError:
-	print 'WARNING: sklearn not found. PCA, KMeans + Ward (hierarchical) clustering disabled.'
+	_log.warning('sklearn not found. PCA, KMeans + Ward (hierarchical) clustering disabled.')
 	have_sklearn = False
 from scipy import sparse
 from scipy import ndimage
@@ -31,6 +33,7 @@ import matplotlib.pyplot as plt
 import pylab as P
 
 from segment import *
+from corpus import *
 
 #import color_features_lab
 #import opticalflow
@@ -82,7 +85,7 @@ class ActionData:
 			data = data.reshape(-1,dim)
 			return data
 		except IOError:
-			print "IOError: Cannot open %s for reading." %(fname)
+			_log.error("Cannot open %s for reading.", fname)
 			raise IOError
 		finally:
 			if fd:
@@ -110,11 +113,11 @@ class ActionData:
 		try:
 			pca = PCA()
 		except NameError:
-			print 'WARNING: sklearn decomposition function disabled.'
+			_log.warning('sklearn decomposition function disabled.')
 			return None
 			
 		pca.fit(raw_data)
-		if print_var: print 'explained variance: ', pca.explained_variance_
+		if print_var: _log.info('explained variance: %s', pca.explained_variance_)
 		
 		pca.n_components = np.where(pca.explained_variance_>locut)[0].shape[0]
 		return pca.fit_transform(raw_data)
@@ -127,16 +130,11 @@ class ActionData:
 		channels = raw_data.shape[1]
 		win_hops = range(0, frames, hop)
 		chunked_data = np.empty_like(raw_data)
-		print "chunked: ", chunked_data.shape
 		chunked_data[:] = raw_data
-		print "chunked: ", chunked_data.shape
-		print "rds: ", raw_data.shape
 		ndimage.uniform_filter(raw_data, (width, channels), output=chunked_data)
 		
-		print "WH: ", win_hops[-1]
-		print "hop: ", hop
+		_log.debug('sliding window: %s, last hop at %d, hop: %d', raw_data.shape, win_hops[-1], hop)
 		chunked_data = chunked_data[win_hops,:]
-		print chunked_data.shape		
 		return np.reshape(chunked_data, (-1,channels))
 
 	def revectorize_over_sliding_window(self, raw_data, width, hop, frames, dtype='float32'):
@@ -226,6 +224,17 @@ class ActionData:
 		
 		return res
 
+	def gather_corpus_feature_data(self, corpus_file, titles=None, stride=1):
+		"""
+		Same as the gather_*_feature_data functions, but from a corpus file (see the corpus module, pack_corpus): a dict of every title's records (every stride-th one), as views of the corpus file, flattened to two dimensions. All titles in the corpus if titles is None.
+		"""
+		fc = FeatureCorpus(corpus_file)
+		res = {}
+		for title in (titles if titles is not None else fc.titles):
+			X = fc.features(title, stride)
+			res[title] = X.reshape((X.shape[0], -1))
+		return res
+
 	def gather_audio_feature_data(self, titles, movie_dir, type='mfcc', stride=6, cflag=False):
 		"""
 		Assuming stride will always be 6!!!! for now...
@@ -246,7 +255,7 @@ class ActionData:
 		try:
 			ward_clusters = Ward(n_clusters=num_clusters, connectivity=cmtrx).fit(raw_data)
 		except NameError:
-			print 'WARNING: sklearn Ward clustering disabled.'
+			_log.warning('sklearn Ward clustering disabled.')
 			return None
 		return ward_clusters.labels_
 	
@@ -320,12 +329,10 @@ class ActionData:
 	
 	def interpolate_time(self, data, actual_fps):
 	# resample
-		print '================='
-		print data.shape
 		x = range(data.shape[0])
 		y = data
 		tratio = (24.0 / actual_fps)
-		print tratio
+		_log.debug('interpolate_time: %s, ratio %f', data.shape, tratio)
 		xx = np.linspace(
 			x[0],
 			int(x[-1]), # * tratio), 
@@ -334,9 +341,38 @@ class ActionData:
 		f = interpolate.interp1d(x,y,axis=0, bounds_error=False)
 		data = f(xx)
 		del x, y, xx
-		print data.shape
 		return data
 	
+	def interpolate_time_window(self, data, actual_fps, start, stop):
+		"""
+		Same result as interpolate_time(data, actual_fps)[start:stop], but only the rows of data that the window [start, stop) needs (at most one more on each side) are read and resampled, in float32. If actual_fps is 24 (no resampling), this is a zero-copy view: data[start:stop].
+		"""
+		num_in = data.shape[0]
+		num_out = int(num_in * (24.0 / actual_fps))
+		if not self.resamples(num_in, actual_fps):
+			return data[start:stop]
+		start, stop, step = slice(start, stop).indices(num_out)
+		if stop <= start or num_in == 0:
+			return np.zeros(((0,) + data.shape[1:]), dtype='float32')
+		# positions of the output rows on the input time axis (as np.linspace(0, num_in-1, num_out) in interpolate_time)
+		if num_out > 1:
+			xx = np.arange(start, stop) * ((num_in - 1) / float(num_out - 1))
+		else:
+			xx = np.zeros(1)
+		lo = int(np.floor(xx[0]))
+		hi = min(int(np.floor(xx[-1])) + 2, num_in)
+		window = np.asarray(data[lo:hi], dtype='float32')
+		idx = np.minimum(np.floor(xx).astype(int) - lo, (hi - lo) - 1)
+		frac = (xx - np.floor(xx)).astype('float32').reshape(((-1,) + ((1,) * (data.ndim - 1))))
+		nxt = np.minimum(idx + 1, (hi - lo) - 1)
+		return (window[idx] * (1.0 - frac)) + (window[nxt] * frac)
+	
+	def resamples(self, num_rows, actual_fps):
+		"""
+		True if interpolate_time (and interpolate_time_window) resample num_rows rows at actual_fps, i.e. if they do not return the rows as they are.
+		"""
+		return int(num_rows * (24.0 / actual_fps)) != num_rows
+	
 	def normalize_data(self, data):
 		the_max = np.max(data)
 		the_min = np.min(data)
@@ -395,7 +431,7 @@ class ActionView:
 		Get an idea of how segment lengths are distributed. Use ad.convert_clustered_frames_to_segs to create segments from clusterings.
 		"""
 		segs_sorted_by_length = self.ad.sort_segs_by_duration(segs)
-		print segs_sorted_by_length
+		_log.debug('segments by length: %s', segs_sorted_by_length)
 		fig = plt.figure()
 		plt.plot(np.arange(len(segs_sorted_by_length)-1), np.array(segs_sorted_by_length)[:-1,1])
 		if ttl:
@@ -467,16 +503,12 @@ class ActionView:
 		kwargs = self.check_kwargs(kwargs, DEFAULT_IMAGESC_KWARGS)
 		if newfig: mfig = P.figure()
 		a,b = shape
-		print len(data)
-		print a
-		print b
+		_log.debug('multi_imagesc2: %d plots on %d by %d', len(data), a, b)
 		for k, d in enumerate(data):
-			print "K: ", k 
 			P.subplot(a,b,k+1+offset)
 			if type(data) is dict:
 				self.imagesc2(data[k], newfig=False, str=key, ax=0, cbar=0, labels=labels, **kwargs)
 			else:
-				print data[k].shape
 				self.imagesc2(data[k], newfig=False, ax=0, cbar=0, labels=labels, **kwargs)
 			if not k%b: ylabel(rowlabel, fontsize=16)
 			if k+offset < b:
@@ -495,7 +527,7 @@ class ActionView:
 		"""
 		if self.module is None: return None
 		for seg in segments:
-			print 'seg: ', seg
+			_log.info('segment: %s', seg)
 			offset_f = seg[0] / 4.0
 			dur_f = seg[1] / 4.0
 			self.mod.playback_movie_frames(offset_f, dur_f)
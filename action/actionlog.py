@@ -0,0 +1,161 @@
+# actionlog.py - logging and rate-limited progress reports for the ACTION modules
+# Bregman:ACTION - Cinematic information retrieval toolkit
+
+"""
+Part of Bregman:ACTION - Cinematic information retrieval toolkit
+
+Overview
+========
+
+The ACTION modules report through the standard logging module instead of printing to stdout. Every module has its own logger below the 'action' logger ('action.color_features_lab', 'action.phase_correlation', ...), so levels can be set per module:
+
++---------+------------------------------------------------------------------------------------------+
+| level   | what is logged                                                                           |
++=========+==========================================================================================+
+| ERROR   | missing files, failed shards, frame (decoding) errors                                    |
++---------+------------------------------------------------------------------------------------------+
+| WARNING | missing optional packages (OpenCV, sklearn), bad parameters                              |
++---------+------------------------------------------------------------------------------------------+
+| INFO    | (configure_logging's default) start and end of analysis runs, progress reports (see      |
+|         | ProgressReporter), and the output of analyzers created with verbose=True                 |
++---------+------------------------------------------------------------------------------------------+
+| DEBUG   | frame offsets and ranges, shapes of accessed windows, per-frame values while displaying  |
++---------+------------------------------------------------------------------------------------------+
+
+Importing the ACTION modules leaves the logging setup alone: the 'action' logger only gets a NullHandler, and passes its records on to the root logger, so they go wherever the application's own logging configuration sends them. The scripts (and interactive sessions that want to see the output) call configure_logging, which by default writes INFO and above to stderr, with the process name in every line (so that the output of the worker processes of a sharded analysis can be told apart), and stops passing the records on. Use its arguments to change the level, stream or format, or to hand the records over to the application's own logging setup, and set_log_level for single modules:
+
+.. code-block:: python
+
+	configure_logging(logging.WARNING)							# quiet
+	set_log_level(logging.DEBUG, 'phase_correlation')			# ...except for one module
+	configure_logging(logging.INFO, stream=open('analysis.log', 'a'))
+	configure_logging(propagate=True, handler=None)				# leave output to the root logger
+
+Verbose output costs nothing while it is disabled: the analysis loops read the analyzers' verbose parameter once, before the loop, and unless it is True skip building their messages altogether. Messages that are built are then filtered by the logger's level as usual.
+
+Progress of long runs is reported by a ProgressReporter, at most once every interval seconds, with the throughput (frames per second) and the estimated time to completion.
+
+"""
+__version__ = '1.0'
+__author__ = 'Thomas Stoll'
+__copyright__ = "Copyright (C) 2012  Michael Casey, Thomas Stoll, Dartmouth College, All Rights Reserved"
+__license__ = "gpl 2.0 or higher"
+__email__ = 'thomas.m.stoll@dartmouth.edu'
+
+import sys, time, logging
+
+ROOT_LOGGER = 'action'
+DEFAULT_FORMAT = '%(asctime)s %(processName)s %(name)s %(levelname)s: %(message)s'
+
+_root = logging.getLogger(ROOT_LOGGER)
+_handler = None
+
+
+def configure_logging(level=logging.INFO, stream=None, fmt=DEFAULT_FORMAT, propagate=False, handler=True):
+	"""
+	Set up the 'action' logger: its level, and (unless handler is None) a handler that writes to stream (stderr by default) in the format fmt; pass a logging.Handler as handler to use that one instead. Replaces the handler installed by an earlier call. With propagate=True, records are also passed on to the root logger.
+	"""
+	global _handler
+	_root.setLevel(level)
+	_root.propagate = propagate
+	if _handler is not None:
+		_root.removeHandler(_handler)
+		_handler = None
+	if handler is True:
+		handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+		handler.setFormatter(logging.Formatter(fmt))
+	if handler is not None:
+		_handler = handler
+		_root.addHandler(_handler)
+	return _root
+
+
+def get_logger(name):
+	"""
+	The logger of an ACTION module (name without the package, e.g. 'phase_correlation').
+	"""
+	return logging.getLogger(ROOT_LOGGER + '.' + name.split('.')[-1])
+
+
+def set_log_level(level, module=None):
+	"""
+	Set the level of one module's logger (e.g. 'opticalflow'), or of the 'action' logger (and so of all modules that do not have a level of their own) if module is None.
+	"""
+	logger = _root if module is None else get_logger(module)
+	logger.setLevel(level)
+	return logger
+
+
+class ProgressReporter(object):
+	"""
+	Rate-limited progress reports for long loops. Call update(done) as often as you like (once per frame, say); a report with the count, the share of total, the throughput (units per second, since the start) and the estimated time to completion is logged at INFO level at most once every interval seconds. Between reports, update only compares two numbers, and it does not even look at the clock if INFO is disabled for the logger.
+
+	::
+
+		progress = ProgressReporter(log, total=dur_strides, label='Psycho.phasecorr', units='frames')
+		for row in range(dur_strides):
+			...
+			progress.update(row + 1)
+		progress.finish()
+
+	"""
+	def __init__(self, logger, total=0, label='', units='frames', interval=10.0, start=0):
+		self.logger = logger
+		self.total = total
+		self.label = label
+		self.units = units
+		self.interval = interval
+		self.enabled = logger.isEnabledFor(logging.INFO)
+		self.start_count = start
+		self.done = start
+		self.start_time = time.time()
+		self.next_report = self.start_time + interval
+
+	def update(self, done):
+		"""
+		Record that done units (in all) are finished; log a report if one is due.
+		"""
+		self.done = done
+		if self.enabled:
+			now = time.time()
+			if now >= self.next_report:
+				self.next_report = now + self.interval
+				self._report(now)
+
+	def finish(self):
+		"""
+		Log a final report (count, throughput and elapsed time).
+		"""
+		if self.enabled:
+			now = time.time()
+			elapsed = now - self.start_time
+			self.logger.info('%s: %d %s done in %s (%.1f %s/s)', self.label, self.done, self.units, _format_secs(elapsed), self.rate(now), self.units)
+
+	def rate(self, now=None):
+		"""
+		Units per second since the start.
+		"""
+		elapsed = (now if now is not None else time.time()) - self.start_time
+		return ((self.done - self.start_count) / elapsed) if elapsed > 0 else 0.0
+
+	def _report(self, now):
+		rate = self.rate(now)
+		if self.total > 0:
+			eta = ((self.total - self.done) / rate) if rate > 0 else float('inf')
+			self.logger.info('%s: %d / %d %s (%.1f%%), %.1f %s/s, ETA %s', self.label, self.done, self.total, self.units, (100.0 * self.done / self.total), rate, self.units, _format_secs(eta))
+		else:
+			self.logger.info('%s: %d %s, %.1f %s/s', self.label, self.done, self.units, rate, self.units)
+
+
+def _format_secs(secs):
+	"""
+	h:mm:ss
+	"""
+	if secs == float('inf'):
+		return '?'
+	secs = int(round(secs))
+	return '%d:%02d:%02d' % ((secs // 3600), ((secs // 60) % 60), (secs % 60))
+
+
+# a library does not configure logging on import (see configure_logging)
+_root.addHandler(logging.NullHandler())
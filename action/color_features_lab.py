@@ -9,6 +9,14 @@ Overview
 
 Use the color features (L*a*b*) extractor class to analyze streams of images or video files. The color features class steps through movie frames and extracts histograms for two frame types. The first is a histogram of color features for the entire image. The second is a set of sixteen histograms, each describing a region of the image. The regions are arranged in an even four-by-four non-overlapping grid, with the first region at the upper left and the last at the lower right. These values are stored in a binary file using Numpy memory-mapped arrays.
 
+The grid (grid_divs_x by grid_divs_y) and the number of bins per channel (ldims) can be changed; every analysis records the layout of its data file in the title's JSON file, for example:
+
+.. code-block:: python
+
+	"layouts": {".color_lab": {"grid_divs_x": 2, "grid_divs_y": 2, "dims": 8}}
+
+and the access functions read it from there, so cheap 2 by 2 by 8 passes and dense 8 by 8 by 32 passes (use different data extensions to keep both) can be read back with the same code. The band and quad selections scale with the grid: the middle band is made of all but the top and bottom quarter of the rows, the center quad of the cells where the middle rows and middle columns cross.
+
 In order to reduce the amount of data involved (and the processing time involved), a stride parameter is used. This number is the number of movie frames to account for in one analysis frame. The default is 6. As of version 1.0, there is no averaging or interpolation, the "skipped" frames are simply dropped.
 
 Creation and Parameters
@@ -61,6 +69,48 @@ The full list of settable parameters, with default values and explanations:
 | threshold              | 0.0             | (empirical) threshold for histogram values; set to |
 |                        |                 | a positive number to remove extremely low values   |
 +------------------------+-----------------+----------------------------------------------------+
+| frame_access           | auto            | 'sequential' (decode through, grab() between       |
+|                        |                 | strides), 'seek' (seek to every stride) or 'auto'  |
++------------------------+-----------------+----------------------------------------------------+
+| gop_size               | 12              | keyframe interval of the movie; 'auto' frame access|
+|                        |                 | seeks only when stride > gop_size                  |
++------------------------+-----------------+----------------------------------------------------+
+| prefetch               | 8               | number of frames decoded ahead in a background     |
+|                        |                 | thread; 0 decodes in the analysis thread           |
++------------------------+-----------------+----------------------------------------------------+
+| workers                | 1               | number of processes analyzing contiguous shards of |
+|                        |                 | the film (analysis without display only)           |
++------------------------+-----------------+----------------------------------------------------+
+| analysis_scale         | 1.0             | factor by which frames are downscaled (with area   |
+|                        |                 | interpolation) before they are analyzed            |
++------------------------+-----------------+----------------------------------------------------+
+| analysis_max_dim       | 0               | downscale frames further so that neither dimension |
+|                        |                 | exceeds this many pixels (0: no limit)             |
++------------------------+-----------------+----------------------------------------------------+
+| buffer_frames          | 64              | number of analysis frames buffered in RAM and      |
+|                        |                 | written to the data file in one slice              |
++------------------------+-----------------+----------------------------------------------------+
+| flush_frames           | 0               | flush the data file to disk every flush_frames     |
+|                        |                 | analysis frames (0: never)                         |
++------------------------+-----------------+----------------------------------------------------+
+| flush_secs             | 60.0            | flush the data file to disk every flush_secs       |
+|                        |                 | seconds (0: never; both 0: only at the end)        |
++------------------------+-----------------+----------------------------------------------------+
+| storage_dtype          | 'float32'       | 'float32', 'float16', 'uint16' or 'uint8': how the |
+|                        |                 | data file stores the values (see featurestore)     |
++------------------------+-----------------+----------------------------------------------------+
+| storage_range          | [0.0, 1.0]      | range of the values for uint8/uint16 storage (the  |
+|                        |                 | histograms are L2-normalized)                      |
++------------------------+-----------------+----------------------------------------------------+
+| chunk_frames           | 0               | compress the data file at the end of the analysis, |
+|                        |                 | in chunks of this many analysis frames (0: never;  |
+|                        |                 | see featurestore)                                  |
++------------------------+-----------------+----------------------------------------------------+
+| chunk_codec            | 'zlib'          | 'zlib', 'bz2', 'lzma' or 'blosc' (if installed)    |
++------------------------+-----------------+----------------------------------------------------+
+| resume                 | False           | continue an interrupted analysis after its last    |
+|                        |                 | committed stride (see featurestore)                |
++------------------------+-----------------+----------------------------------------------------+
 | verbose                | True            | useful for debugging                               |
 +------------------------+-----------------+----------------------------------------------------+
 | display                | True            | launch display screen during analysis              |
@@ -71,9 +121,9 @@ The full list of settable parameters, with default values and explanations:
 +------------------------+-----------------+----------------------------------------------------+
 | ldims                  | 16              | number of dimensions for L (luminosity)            |
 +------------------------+-----------------+----------------------------------------------------+
-| adims                  | 16              | number of dimensions for a (color)                 |
+| adims                  | 16              | number of dimensions for a (color), same as ldims  |
 +------------------------+-----------------+----------------------------------------------------+
-| bdims                  | 16              | number of dimensions for b (color)                 |
+| bdims                  | 16              | number of dimensions for b (color), same as ldims  |
 +------------------------+-----------------+----------------------------------------------------+
 | lrange                 | [0, 256]        | range to map to/from L                             |
 +------------------------+-----------------+----------------------------------------------------+
@@ -126,6 +176,20 @@ This also works, so you can define your own file locations:
 	cfl = ColorFeaturesLAB('Psycho', action_dir='~/somewhere')
 	cfl.analyze_movie()
 
+To split a long film into four contiguous shards that are analyzed in parallel processes:
+
+.. code-block:: python
+
+	cfl = ColorFeaturesLAB('Psycho')
+	cfl.analyze_movie(workers=4)
+
+To analyze 1080p sources at no more than 640 pixels in either dimension, which is several times faster; see scripts/benchmark_analysis_scale.py for how far the features drift from full resolution:
+
+.. code-block:: python
+
+	cfl = ColorFeaturesLAB('Psycho', analysis_max_dim=640)
+	cfl.analyze_movie()
+
 To screen (the video only) of your film as it is analyzed:
 
 .. code-block:: python
@@ -206,23 +270,31 @@ __email__ = 'thomas.m.stoll@dartmouth.edu'
 
 
 import sys, time, os
+from actionlog import *
+_log = get_logger(__name__)
 # import the necessary things for OpenCV
 try:
 	import cv2
 	import cv2.cv as cv
 	HAVE_CV = True
 except ImportError:
-	print 'WARNING: Access only, use of methods other than *_color_features_for_segment, etc. will cause errors! Install OpenCV to perform analysis and display movies/data.'
+	_log.warning('Access only, use of methods other than *_color_features_for_segment, etc. will cause errors! Install OpenCV to perform analysis and display movies/data.')
 	HAVE_CV = False
 import numpy as np
 import json
 from segment import *
 from actiondata import *
+from framesource import *
+from featurestore import *
+from metadata import *
+from featurecache import *
+from regions import *
 ad = ActionData()
+
 av = ActionView()
 
 
-class ColorFeaturesLAB:
+class ColorFeaturesLAB(object):
 	"""
 	Color analysis of frame and 4-by-4 grid of subframes in L*a*b* colorspace.
 	
@@ -246,33 +318,60 @@ class ColorFeaturesLAB:
 		ap = self.analysis_params
 		
 		if filename is None:
-			print 'File name missing!'
+			_log.error('File name missing!')
 			return
 		else:
 			self.movie_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + ap['movie_extension']))
 			self.data_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + ap['data_extension']))
 			self.json_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + '.json'))
-			print self.json_path
+			_log.debug('JSON file: %s', self.json_path)
 			self.filename = filename
 		
- 		if os.path.exists(self.json_path) is False:
- 			self._write_metadata_to_json()
-		ap['afps'] = self._read_json_value('fps')
-		
-		# try to naively get some data and store in a class var
-		if os.path.exists(self.data_path):
-			self.default_color_features_for_segment()
+		# metadata and default features are loaded lazily (see _load_metadata and X)
+		self._afps = None
+		self._X = None
+	
+	def _load_metadata(self):
+		"""
+		Set the access frame rate (afps) from the title's metadata (see metadata). Done on first use, and not at construction time, since the metadata may have to be read from the movie; later calls only check that the JSON file has not changed. If neither the JSON file nor the movie is there, but the data file is, afps comes from the data file's header instead (and stays at the afps parameter for a headerless file), so that the features can be read without the movie.
+		"""
+		if os.path.exists(self.json_path) or (os.path.exists(self.movie_path) and HAVE_CV) or not os.path.exists(self.data_path):
+			self._afps = self.metadata().fps
 		else:
-			self.X = None
+			header = read_feature_header(self.data_path)
+			if header is None or header.fps <= 0:
+				return
+			self._afps = header.fps
+		self.analysis_params['afps'] = self._afps
+	
+	def _get_X(self):
+		if self._X is None and os.path.exists(self.data_path):
+			self.default_color_features_for_segment()
+		return self._X
+	
+	def _set_X(self, X):
+		self._X = X
+	
+	def _del_X(self):
+		self._X = None
+	
+	X = property(_get_X, _set_X, _del_X, doc="Default features of the title (see default_color_features_for_segment), loaded from the data file on first access and cached. Accessor functions replace them with the features they return; del cfl.X releases them.")
 	
 	def _check_cflab_params(self, analysis_params=None):
 		"""
-		Simple mechanism to read in default parameters while substituting custom parameters.
+		Simple mechanism to read in default parameters while substituting custom parameters. The custom parameters are merged into the current ones (those passed to the constructor and to earlier calls), so that a call like analyze_movie only overrides the parameters it passes; missing ones are filled in from the defaults.
 		"""
-		self.analysis_params = analysis_params if analysis_params is not None else self.analysis_params
+		if not hasattr(self, 'analysis_params'):
+			self.analysis_params = {}
+		if analysis_params is not None:
+			self.analysis_params.update(analysis_params)
 		dcfp = self.default_cflab_params()
 		for k in dcfp.keys():
 			self.analysis_params[k] = self.analysis_params.get(k, dcfp[k])
+		# the records hold the same number of bins for all three channels
+		if (self.analysis_params['adims'] != self.analysis_params['ldims']) or (self.analysis_params['bdims'] != self.analysis_params['ldims']):
+			_log.warning('adims and bdims have to be equal to ldims; using %s bins for all channels.', self.analysis_params['ldims'])
+			self.analysis_params['adims'] = self.analysis_params['bdims'] = self.analysis_params['ldims']
 		return self.analysis_params
 
 	@staticmethod
@@ -297,6 +396,20 @@ class ColorFeaturesLAB:
 			'duration' : -1,			# time duration in seconds, -1 (default) maps to full duration of media
 			'stride' : 6,				# number of frames to that comprise one analysis point, skips stride - 1 frames
 			'threshold' : 0.0,			# (empirical) threshold for histogram; set to a positive number to remove extremely low values
+			'frame_access' : 'auto',	# 'auto', 'sequential' (decode straight through, grab() between strides) or 'seek' (seek every stride)
+			'gop_size' : 12,			# keyframe interval of the movie files, used by 'auto' frame access (1 for intra-only codecs)
+			'prefetch' : 8,				# number of frames to decode ahead in a background thread, 0 to decode in the analysis thread
+			'workers' : 1,				# number of processes (contiguous shards of the film) for analysis without display
+			'analysis_scale' : 1.0,		# downscale frames by this factor (area interpolation) before analysis
+			'analysis_max_dim' : 0,		# downscale frames so that neither dimension exceeds this (0: no limit)
+			'buffer_frames' : 64,		# number of analysis frames buffered in RAM before they are written to the data file
+			'flush_frames' : 0,			# flush the data file every flush_frames analysis frames (0: never)
+			'flush_secs' : 60.0,		# flush the data file every flush_secs seconds (0: never; with both 0, only at the end)
+			'storage_dtype' : 'float32',	# 'float32', 'float16', 'uint16' or 'uint8' (see featurestore)
+			'storage_range' : [0.0, 1.0],	# [low, high] of the values, for uint16 and uint8 storage
+			'chunk_frames' : 0,			# compress the data file in chunks of this many analysis frames when the analysis is complete (0: never)
+			'chunk_codec' : 'zlib',		# 'zlib', 'bz2', 'lzma' or 'blosc' (if installed)
+			'resume' : False,			# continue an interrupted analysis run from its progress record
 			'verbose' : True,					# useful for debugging
 			'display' : True,					# Launch display screen
 			'hist_shrink_factor' : 0.5,			# (adjustable) ratio for size of histogram window
@@ -307,40 +420,67 @@ class ColorFeaturesLAB:
 		}
 		return analysis_params
 	
+	def metadata(self):
+		"""
+		The title's MovieMetadata (fps, frames, width, height, aspect, length and data layouts; see the metadata module). Read from the title's JSON file once and shared with the other analyzers of the title; the movie is only opened if the JSON file does not exist yet.
+		"""
+		return movie_metadata(self.json_path, self.movie_path, self.filename)
+	
 	def _write_metadata_to_json(self):
 		"""
+		(Re)write the title's JSON file from the movie, keeping the data layouts recorded there.
 		"""
-		title = self.filename
-		capture = cv2.VideoCapture(self.movie_path)
-		
-		fps = capture.get(cv.CV_CAP_PROP_FPS)
-		w = float(cv.CV_CAP_PROP_FRAME_WIDTH)
-		h = float(cv.CV_CAP_PROP_FRAME_HEIGHT)
-		print 'w: ', w
-		print 'h: ', h
-		aspect = w / h
-		frames = capture.get(cv.CV_CAP_PROP_FRAME_COUNT)
-		length = float(frames) / float(fps)
-		
-		
-		movdict = {'title':title, 'fps':fps, 'aspect': aspect,'frames': frames, 'length':length}
-		fp = file(self.json_path, 'w')
-		fp.write(json.dumps(movdict))
-		fp.close()
-		del capture
+		write_movie_metadata(self.json_path, self.movie_path, self.filename)
 		return 1
 	
 	def _read_json_value(self, key='fps'):
-# 		fp = file(self.json_path, 'r')
-		jsonfile = open(self.json_path)
-		jsondata = json.load(jsonfile)
-		return jsondata[key]
+		return self.metadata()[key]
+	
+	def _write_layout_to_json(self):
+		"""
+		Record the layout (grid divisions, bins per channel and stride) of the data file that is being written in the title's JSON file, under 'layouts' and the data extension, so that the accessors do not need to know the analysis parameters.
+		"""
+		ap = self.analysis_params
+		record_layout(self.json_path, ap['data_extension'], {'grid_divs_x' : ap['grid_divs_x'], 'grid_divs_y' : ap['grid_divs_y'], 'dims' : ap['ldims'], 'stride' : ap['stride']})
+	
+	def data_layout(self):
+		"""
+		Layout of the data file: a dict with grid_divs_x, grid_divs_y and dims (bins per channel), and the stride it was analyzed at if that was recorded. Read from the title's metadata if the analyzer recorded it there; files analyzed before layouts were recorded use the analysis parameters (by default, 4 by 4 cells of 16 bins).
+		"""
+		ap = self.analysis_params
+		layout = {'grid_divs_x' : ap['grid_divs_x'], 'grid_divs_y' : ap['grid_divs_y'], 'dims' : ap['ldims']}
+		if os.path.exists(self.json_path):
+			layout.update(self.metadata().layout(ap['data_extension']))
+		return layout
+	
+	def _record_shape(self, layout=None):
+		"""
+		Shape of one analysis frame's record: (cells + 1, 3, dims).
+		"""
+		layout = layout or self.data_layout()
+		return (((layout['grid_divs_x'] * layout['grid_divs_y']) + 1), 3, layout['dims'])
+	
+	def _use_data_layout(self):
+		"""
+		For playback: set the grid and bin parameters to the ones the data file was written with.
+		"""
+		layout = self.data_layout()
+		ap = self.analysis_params
+		ap['grid_divs_x'], ap['grid_divs_y'] = layout['grid_divs_x'], layout['grid_divs_y']
+		ap['ldims'], ap['adims'], ap['bdims'] = layout['dims'], layout['dims'], layout['dims']
+	
+	def _region_selector(self, name, layout=None):
+		"""
+		The named region selector (see regions) compiled for the grid of the data file.
+		"""
+		layout = layout or self.data_layout()
+		return region_selector(name, layout['grid_divs_x'], layout['grid_divs_y'])
 	
 	def all_color_features_for_segment(self, segment=Segment(0, -1)):
 		"""
 		This will be the interface for grabbing analysis data for segments of the whole film. Uses Segment objects from Bregman/ACTION!
 		Takes a file name or complete path of a data file and a Segment object that describes the desired timespan.
-		Returns a tuple of memory-mapped arrays corresponding to the full-frame color features followed by the 4 by 4 grid of color histograms: ([NUMBER OF FRAMES, NUMBER OF COLUMNS (3) * NUMBER OF BINS (16) (= 48)], [NUMBER OF FRAMES, NUMBER OF GRID-SQUARES(16) * NUMBER OF COLUMNS (3) * NUMBER OF BINS (16) (=768)])
+		Returns a tuple of memory-mapped arrays corresponding to the full-frame color features followed by the grid of color histograms: ([NUMBER OF FRAMES, NUMBER OF COLUMNS (3) * NUMBER OF BINS (16) (= 48)], [NUMBER OF FRAMES, NUMBER OF GRID-SQUARES(16) * NUMBER OF COLUMNS (3) * NUMBER OF BINS (16) (=768)]). The sizes given are for the default layout (4 by 4 cells of 16 bins); the layout of the data file is read from the title's JSON file (see data_layout).
 		::
 			
 			seg = Segment(360, 720) # which is the same as seg = Segment(360, duration=360)
@@ -352,7 +492,7 @@ class ColorFeaturesLAB:
 
 		"""
 		res = self._color_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)
-		return (res[0].reshape(-1, 48), res[1].reshape(-1, 768))
+		return (res[0].reshape(res[0].shape[0], -1), res[1].reshape(res[1].shape[0], -1))
 	
 	def full_color_features_for_segment(self, segment=Segment(0, -1)):
 		"""
@@ -362,7 +502,7 @@ class ColorFeaturesLAB:
 			all_color_features_for_segment(...)[0].reshape((segment.time_span.duration*4), -1)		
 
 		"""
-		self.X = self._color_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[0].reshape(-1, 48)
+		self.X = self._cached_segment_features('full', segment.time_span.start_time, segment.time_span.duration, lambda res: res[0].reshape(res[0].shape[0], -1))
 		return self.X
 	
 	def gridded_color_features_for_segment(self, segment=Segment(0, -1)):
@@ -381,7 +521,8 @@ class ColorFeaturesLAB:
 			all_color_features_for_segment(...)[1].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._color_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1].reshape(-1, 768)
+		selector = self._region_selector('gridded')
+		self.X = self._cached_segment_features('gridded', int(segment.time_span.start_time), int(segment.time_span.duration), lambda res: selector.select(res[1]))
 		return self.X
 
 	def center_quad_color_features_for_segment(self, segment=Segment(0, -1)):
@@ -400,7 +541,8 @@ class ColorFeaturesLAB:
 			all_color_features_for_segment(...)[1][:,[5,6,9,10],...].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._color_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1][:,[5,6,9,10],...].reshape(-1, 192)
+		selector = self._region_selector('center_quad')
+		self.X = self._cached_segment_features('center_quad', int(segment.time_span.start_time), int(segment.time_span.duration), lambda res: selector.select(res[1]))
 		return self.X
 
 	def middle_band_color_features_for_segment(self, segment=Segment(0, -1)):
@@ -419,7 +561,8 @@ class ColorFeaturesLAB:
 			all_color_features_for_segment(...)[1][:,4:12,...].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._color_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1][:,4:12,...].reshape(-1, 384)
+		selector = self._region_selector('middle_band')
+		self.X = self._cached_segment_features('middle_band', int(segment.time_span.start_time), int(segment.time_span.duration), lambda res: selector.select(res[1]))
 		return self.X
 	
 	def plus_band_color_features_for_segment(self, segment=Segment(0, -1)):
@@ -438,8 +581,8 @@ class ColorFeaturesLAB:
 				all_color_features_for_segment(...)[1][:,[1,2,4,5,6,7,8,9,10,11,13,14],...].reshape(-1, 576)
 		
 		"""
-		
-		self.X = self._color_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1][:,4:12,...].reshape(-1, 576)
+		selector = self._region_selector('plus_band')
+		self.X = self._cached_segment_features('plus_band', int(segment.time_span.start_time), int(segment.time_span.duration), lambda res: selector.select(res[1]))
 		return self.X
 	
 	def default_color_features_for_segment(self, func='middle_band_color_features_for_segment', segment=Segment(0, -1)):
@@ -448,38 +591,54 @@ class ColorFeaturesLAB:
 		"""
 		return getattr(self,func)(segment)
 
+	def _segment_frames(self, onset_s=0, duration_s=60):
+		"""
+		Onset and duration of a segment (in seconds; a negative duration means the whole movie) in analysis frames at 24 frames per second, as used by _color_features_for_segment_from_onset_with_duration.
+		"""
+		self._load_metadata()
+		ap = self.analysis_params
+		frames_per_astride = (24.0 / ap['stride']) # 24.0
+		onset_frame = int(onset_s * frames_per_astride)
+		if duration_s < 0:
+			dur_frames = int(int(self.determine_movie_length()) * frames_per_astride * (ap['afps'] / ap['fps'])) # convert back to aframes
+		else:
+			dur_frames = int(duration_s * frames_per_astride * (ap['afps'] / ap['fps']))
+		return onset_frame, dur_frames
+	
+	def _cached_segment_features(self, selector, onset_s, duration_s, select):
+		"""
+		Apply select to the (full-frame, grid) tuple that _color_features_for_segment_from_onset_with_duration returns for the segment; the result is served from the feature cache (see featurecache) when it is enabled, keyed by the title's data file, the selector name and the stride.
+		"""
+		load = lambda: select(self._color_features_for_segment_from_onset_with_duration(onset_s, duration_s))
+		if feature_cache() is None:
+			return load()
+		onset_frame, dur_frames = self._segment_frames(onset_s, duration_s)
+		key = (data_file_key(self.data_path), selector, self.analysis_params['stride'])
+		return cached_features(key, onset_frame, (onset_frame + dur_frames), 1, load)
+
 	def _color_features_for_segment_from_onset_with_duration(self, onset_s=0, duration_s=60):
 		"""
 		This will be the interface for grabbing analysis data based on onsets and durations, translating seconds into frames.
 		Takes a file name or complete path of a data file, an onset time in seconds, and a duration in seconds.
-		Returns a tuple of memory-mapped arrays corresponding to the full-frame histogram followed by the 4 by 4 grid of histograms: ([NUMBER OF FRAMES, 1, NUMBER OF COLUMNS (3), NUMBER OF BINS (16)], [NUMBER OF FRAMES, 16, NUMBER OF COLUMNS (3), NUMBER OF BINS (16)])
+		Returns a tuple of memory-mapped arrays corresponding to the full-frame histogram followed by the grid of histograms: ([NUMBER OF FRAMES, NUMBER OF COLUMNS (3), NUMBER OF BINS (16)], [NUMBER OF FRAMES, NUMBER OF GRID-SQUARES (16), NUMBER OF COLUMNS (3), NUMBER OF BINS (16)]), with the number of grid squares and bins taken from the data layout (see data_layout).
 		::
 		
 			raw_hist_data = cflab_for_segment('Psycho.hist', onset_time=360, duration=360)
 		
 		"""
 		ap = self.analysis_params
-		frames_per_astride = (24.0 / ap['stride']) # 24.0
+		onset_frame, dur_frames = self._segment_frames(onset_s, duration_s)
 		
-		print ap['fps']
-		print ap['stride']
-		print duration_s
-
-		onset_frame = int(onset_s * frames_per_astride)
-		if duration_s < 0:
-			dur_frames = int(int(self.determine_movie_length()) * frames_per_astride * (ap['afps'] / ap['fps'])) # convert back to aframes
-		else:
-			dur_frames = int(duration_s * frames_per_astride * (ap['afps'] / ap['fps']))
-		
-		print 'df: ', dur_frames
+		_log.debug('df: %s', dur_frames)
 		# memmap
 		
-		mapped = np.memmap(self.data_path, dtype='float32', mode='r') #, offset=onset_frame, shape=(dur_frames,17,3,16))
-		mapped = mapped.reshape((-1,17,3,16))
-		self.before = mapped.reshape((-1, (17*3*16)))
-		mapped = ad.interpolate_time(mapped, ap['afps'])
+		record_shape = self._record_shape()
+		mapped = map_feature_file(self.data_path, record_shape)
+		self.before = mapped.reshape((-1, int(np.prod(record_shape))))
+		# slice first, then resample only the requested window (a view of the memmap if afps == 24)
+		mapped = ad.interpolate_time_window(mapped, ap['afps'], onset_frame, (onset_frame+dur_frames))
 
-		return (mapped[onset_frame:(onset_frame+dur_frames),0,:,:], mapped[onset_frame:(onset_frame+dur_frames),1:,:,:])
+		return (mapped[:,0,:,:], mapped[:,1:,:,:])
 
 	def convert_lab_to_l(self, data):
 		"""
@@ -524,41 +683,35 @@ class ColorFeaturesLAB:
 		ap = self.analysis_params
 		strides_per_second = float(ap['fps'] / ap['stride']) # 24 / 6 = 4
 	
-		if os.path.exists(self.movie_path) and HAVE_CV:
-			dsize = os.path.getsize(self.data_path)
-			print "dsize: ", dsize
-			# since we are reading raw color analysis data that always has the same size on disc
-			dur_total_aframes = dsize / float(((ap['grid_divs_x'] * ap['grid_divs_y'])+1) * 3 * ap['ldims'] * 4) # REGIONS * CHANNELS * BINS * BYTES
-			print 'dtaf: ', dur_total_aframes
-			dur_total_seconds = (dur_total_aframes / strides_per_second) * (ap['fps'] / ap['afps'])
-			print "total secs: ", dur_total_seconds
-			##################################
-			self.capture = cv2.VideoCapture(self.movie_path)
-			dur_total_seconds = self.capture.get(cv.CV_CAP_PROP_FRAME_COUNT) / ap['afps']
-			print "mov total secs: ", dur_total_seconds
+		if os.path.exists(self.json_path) or (os.path.exists(self.movie_path) and HAVE_CV):
+			# the frame count comes from the title's metadata; the movie is only opened if the JSON file is missing
+			self._load_metadata()
+			dur_total_seconds = self.metadata().frames / ap['afps']
+			_log.debug('mov total secs: %s', dur_total_seconds)
 		elif os.path.exists(self.data_path):
-			dsize = os.path.getsize(self.data_path)
-			print "dsize: ", dsize
-			# since we are reading raw color analysis data that always has the same size on disc
-			dur_total_aframes = dsize / float(((ap['grid_divs_x'] * ap['grid_divs_y'])+1) * 3 * ap['ldims'] * 4) # REGIONS * CHANNELS * BINS * BYTES
-			print 'dtaf: ', dur_total_aframes
+			self._load_metadata()	# afps from the data file's header (see _load_metadata)
+			dur_total_aframes = data_file_shape(self.data_path, self._record_shape())[0]
+			_log.debug('dtaf: %s', dur_total_aframes)
 			dur_total_seconds = (dur_total_aframes / strides_per_second) * (ap['fps'] / ap['afps'])
-			print "total secs: ", dur_total_seconds
+			_log.debug('total secs: %s', dur_total_seconds)
 		else:
 			dur_total_seconds = -1
-			print "Cannot determine movie duration. Both the movie and data files are missing!"
+			_log.error('Cannot determine movie duration. Both the movie and data files are missing!')
 		self.analysis_params['duration'] = dur_total_seconds
 		return dur_total_seconds
 	
-	def analyze_movie(self):
+	def analyze_movie(self, workers=1, resume=False):
 		"""
 		Analyze the movie without displaying on screen. Equivalent to:
 		::
 		
-			_process_movie(mode='analyze', display=False)
+			_process_movie(mode='analyze', display=False, workers=1, resume=False)
 		
+		With workers > 1, the film is split into that many contiguous shards of strides, which are analyzed in parallel processes, each writing its own slice of the data file.
+		
+		With resume=True, an interrupted run (see featurestore.ProgressRecord) is continued after its last committed stride, provided that it was made with the same parameters from the same movie file; otherwise the analysis starts over.
 		"""
-		self._process_movie(mode='analyze', display=False)
+		self._process_movie(mode='analyze', display=False, workers=workers, resume=resume)
 
 	def analyze_movie_with_display(self):
 		"""
@@ -578,25 +731,30 @@ class ColorFeaturesLAB:
 			return
 		
 		if (self.movie_path is None) or (self.data_path is None):
-			print "Must supply both a movie and a data path!"
+			_log.error('Must supply both a movie and a data path!')
 			return
 		
 		ap = self._check_cflab_params(kwargs)
+		self._load_metadata()
 		verbose = ap['verbose']
+		if ap['mode'] == 'playback':
+			self._use_data_layout()
 		
-		print ap
+		_log.debug('parameters: %s', ap)
 		# ap = self.analysis_params
 				
 		self.capture = cv2.VideoCapture(self.movie_path)
 		
-		self._write_metadata_to_json()
-		# probably should generate and check for errors
+		# make sure the title's JSON file exists (and has the frame size)
+		self.metadata()
 		
 		fps = ap['fps']
 		grid_x_divs = ap['grid_divs_x']
 		grid_y_divs = ap['grid_divs_y']
 		frame_width = int(self.capture.get(cv.CV_CAP_PROP_FRAME_WIDTH))
 		frame_height = int(self.capture.get(cv.CV_CAP_PROP_FRAME_HEIGHT))
+		# frames are downscaled once, as they are decoded, to the analysis frame size
+		frame_width, frame_height = analysis_frame_size(frame_width, frame_height, ap['analysis_scale'], ap['analysis_max_dim'])
 		frame_size = (frame_width, frame_height)
 		hist_width = int(frame_width * ap['hist_width_ratio'])
 		hist_height = int(frame_height * ap['hist_height_ratio'])
@@ -607,35 +765,20 @@ class ColorFeaturesLAB:
 
 		
 		if verbose:
-			print ap['lrange'][0], ' | ', ap['arange'][0], ' | ', ap['brange'][0], ' | ', ap['lrange'][1], ' | ', ap['arange'][1], ' | ', ap['brange'][1]
-			print fps, ' | ', hist_size, ' | ', grid_size
-		
-		grid_l_star = np.zeros((16,1), dtype=np.float32)
-		grid_a_star = np.zeros((16,1), dtype=np.float32)
-		grid_b_star = np.zeros((16,1), dtype=np.float32)
+			_log.info('L*a*b* ranges: %s | %s | %s | %s | %s | %s', ap['lrange'][0], ap['arange'][0], ap['brange'][0], ap['lrange'][1], ap['arange'][1], ap['brange'][1])
+			_log.info('fps, histogram size, grid size: %s | %s | %s', fps, hist_size, grid_size)
 		
-		grid_mask = np.zeros(grid_size, dtype=np.float32)
-		grid_lab = np.zeros((grid_size[0], grid_size[1], 3), dtype=np.float32)
-	
-		l_star = np.zeros((16,1), dtype=np.float32)
-		a_star = np.zeros((16,1), dtype=np.float32)
-		b_star = np.zeros((16,1), dtype=np.float32)
-		
-		mask = np.zeros((frame_size[0], frame_size[1], 3), dtype=np.float32)
-		lab = np.zeros((frame_size[0], frame_size[1], 3), dtype=np.float32)
-
 		dims = ap['ldims']
 		
 		lab_min = (ap['lrange'][0], ap['arange'][0], ap['brange'][0])
 		lab_max = (ap['lrange'][1], ap['arange'][1], ap['brange'][1])
 		bin_w = int((hist_width * ap['hist_width_ratio']) / (ap['ldims'] * grid_x_divs))
 		third_bin_w = int(bin_w/3)
-	
-		l_histo = np.arange(ap['lrange'][0], ap['lrange'][1], ap['ldims']).reshape((ap['ldims'],1))
-		a_histo = np.arange(ap['arange'][0], ap['arange'][1], ap['adims']).reshape((ap['adims'],1))
-		b_histo = np.arange(ap['brange'][0], ap['brange'][1], ap['bdims']).reshape((ap['bdims'],1))
 		
-		if ap['verbose']: print third_bin_w
+		# lookup table and region keys for the batched histogram kernel, computed once per film
+		bin_lut, region_keys = self._kernel_tables(frame_width, frame_height)
+		
+		if ap['verbose']: _log.info('third bin width: %s', third_bin_w)
 				
 		histimg = np.zeros((int(hist_height*1.25), int(hist_width), 3), np.uint8)
 		
@@ -646,22 +789,21 @@ class ColorFeaturesLAB:
 		else:
 			offset_secs = 0
 		
-		print ap['duration']
+		_log.debug('duration: %s', ap['duration'])
 		
 		if ap['duration'] > 0:
 			dur_secs = ap['duration']
 		elif ap['duration'] < 0:
 			ap['duration'] = self.determine_movie_length()
 		else:
-			print "Duration cannot be 0."
+			_log.error('Duration cannot be 0.')
 			return
 		dur_secs = ap['duration']
 		
 		stride_frames = ap['stride']
 		stride_hop = stride_frames - 1
 
-		print ap['duration']
-		print dur_secs
+		_log.debug('duration (seconds): %s', dur_secs)
 		
 		# check offset first, then compress duration, if needed
 		offset_secs = min(max(offset_secs, 0), ap['duration'])
@@ -672,23 +814,46 @@ class ColorFeaturesLAB:
 		dur_frames = dur_strides * stride_frames
 		
 		if verbose:
-			print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
-			print 'FRAMES: ', int(self.capture.get(cv.CV_CAP_PROP_FRAME_COUNT))
-			print 'DUR TOTAL: ', ap['duration']
-			print "OFFSET (SECONDS): ", offset_secs
-			print "OFFSET (STRIDES): ", offset_strides
-			print "OFFSET (FRAMES): ", offset_frames
-			print "DUR (SECONDS): ", dur_secs
-			print 'DUR (STRIDES): ', dur_strides
-			print 'DUR (FRAMES): ', dur_frames
-			print "FPS: ", fps
-			print "stride_frames: ", stride_frames
-		
-		# set up memmap
+			_log.info('FRAMES: %s', int(self.capture.get(cv.CV_CAP_PROP_FRAME_COUNT)))
+			_log.info('DUR TOTAL: %s', ap['duration'])
+			_log.info('OFFSET (SECONDS): %s', offset_secs)
+			_log.info('OFFSET (STRIDES): %s', offset_strides)
+			_log.info('OFFSET (FRAMES): %s', offset_frames)
+			_log.info('DUR (SECONDS): %s', dur_secs)
+			_log.info('DUR (STRIDES): %s', dur_strides)
+			_log.info('DUR (FRAMES): %s', dur_frames)
+			_log.info('FPS: %s', fps)
+			_log.info('stride_frames: %s', stride_frames)
+		
+		# set up memmap (and, for analysis, the progress record)
+		start_stride = 0
 		if ap['mode'] == 'playback' and ap['display'] == True:
-			 fp = np.memmap(self.data_path, dtype='float32', mode='r', shape=((offset_strides + dur_strides),(ap['grid_divs_x']*ap['grid_divs_y'])+1,3,ap['ldims']))
+			fp = map_feature_file(self.data_path, self._record_shape())
 		else:
-			fp = np.memmap(self.data_path, dtype='float32', mode='w+', shape=(dur_strides, (ap['grid_divs_x']*ap['grid_divs_x'])+1,3,ap['ldims']))
+			shape = ((dur_strides,) + self._record_shape(layout={'grid_divs_x' : ap['grid_divs_x'], 'grid_divs_y' : ap['grid_divs_y'], 'dims' : ap['ldims']}))
+			progress = ProgressRecord(progress_path(self.data_path), ap, self.movie_path, shape)
+			fp, start_stride = open_feature_file(self.data_path, shape, progress, resume=ap['resume'], header=feature_header(shape, ap, self.metadata()))
+			if progress.complete:
+				_log.info('Analysis already complete: %s', self.data_path)
+				return
+			if verbose and start_stride > 0: _log.info('resuming at stride: %s', start_stride)
+			self._write_layout_to_json()
+		
+		# temporal sharding: hand the (preallocated) data file over to worker processes
+		if ap['mode'] == 'analyze' and ap['workers'] > 1 and not ap['display']:
+			del fp
+			self.capture.release()
+			shards = split_frame_range(offset_frames, offset_frames + dur_frames, stride_frames, ap['workers'])
+			if verbose: _log.info('shards: %s', shards)
+			failed = run_shards(self._analyze_shard, [(k, start, end, offset_strides, shape, frame_size, bin_lut, region_keys) for k, (start, end) in enumerate(shards)])
+			if len(failed) > 0:
+				_log.error('Shard error! Failed shards: %s', [shards[n] for n in failed])
+			else:
+				progress.save(dur_strides, complete=True)
+				for k in range(len(shards)):
+					os.remove(progress_path(self.data_path, k))
+				finish_feature_file(self.data_path, ap)
+			return
 		
 		# set some drawing constants
 		vert_offset = int(frame_height*ap['hist_vert_offset_ratio'])
@@ -711,68 +876,52 @@ class ColorFeaturesLAB:
 				lcolors[d] = cv.Scalar(255., gray_val, gray_val)
 				acolors[d] = cv.Scalar(gray_val, 128., 128.)
 				bcolors[d] = cv.Scalar(gray_val, gray_val, gray_val)
-			six_points = self.build_bars(grid_width, grid_height, bin_w, third_bin_w, grid_x_divs, grid_y_divs, 16) # 16: number of bins
-			self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, offset_frames)
+			six_points = self.build_bars(grid_width, grid_height, bin_w, third_bin_w, grid_x_divs, grid_y_divs, dims) # dims: number of bins
+
+		frames = open_frame_source(self.capture, offset_frames + (start_stride * stride_frames), end_frame, stride_frames, ap['frame_access'], ap['gop_size'], ap['prefetch'], frame_size)
+		if verbose: _log.info('frame access: %s', frames.access)
+		if ap['mode'] == 'analyze':
+			writer = feature_writer(fp, ap, progress)
+		reporter = ProgressReporter(_log, dur_strides, os.path.basename(self.data_path), 'strides', start=start_stride)
+		aborted = False
 
-		while self.frame_idx < end_frame:
+		for self.frame_idx, frame in frames:
 			
-			if verbose:
-				print('fr. idx: %6i || %.4f (/%i) [ %i | %i ]' % (self.frame_idx, ((self.frame_idx - offset_frames) / float(dur_frames)), dur_frames, offset_frames, end_frame))
-
-			if (self.frame_idx%stride_frames) == 0:
-
-				# frame grab
-				ret, frame = self.capture.read()
-				curr_stride_frame = self.frame_idx/stride_frames
-				# reality check
-				if frame is None: 
-					print 'Frame error! Exiting...'
-					break # no image captured... end the processing
-				
-				# access stage (full)
-				if ap['mode'] == 'playback':
-					lbins, abins, bbins = fp[curr_stride_frame][0][0], fp[curr_stride_frame][0][1], fp[curr_stride_frame][0][2]
-					# if verbose: print (np.sum(lbins), np.sum(abins), np.sum(bbins))
-				else:
-					lbins, abins, bbins = self._analyze_image(frame, fp, curr_stride_frame, lab, lab_min, lab_max, l_star, a_star, b_star, mask, l_histo, a_histo, b_histo, 0, 0, 0, 1., thresh=ap['threshold'])
-
-				# display stage (full)
-				if ap['display']:
-					histimg[:] = 0
-					for d in range(dims):
-						# for all the bins, get the value, and scale to the size of the grid
-						lval, aval, bval = int(lbins[d]*255.), int(abins[d]*255.), int(bbins[d]*255.)
-						#draw the rectangle in the wanted color
-						self.make_rectangles(cv.fromarray(histimg), six_points, 6, 0, 0, d, [lval, aval, bval], grid_height_ratio, [lcolors, acolors, bcolors], voffset=hist_height)
-				
-				# access stage (gridded)
+			curr_stride_frame = self.frame_idx/stride_frames
+			reporter.update(curr_stride_frame - offset_strides + 1)
+			
+			# access stage (full + gridded, in one pass)
+			if ap['mode'] == 'playback':
+				record = fp[curr_stride_frame]
+			else:
+				record = self._analyze_frame(frame, bin_lut, region_keys, thresh=ap['threshold'])
+				writer.write(curr_stride_frame - offset_strides, record)
+			lbins, abins, bbins = record[0][0], record[0][1], record[0][2]
+
+			# display stage (full)
+			if ap['display']:
+				histimg[:] = 0
+				for d in range(dims):
+					# for all the bins, get the value, and scale to the size of the grid
+					lval, aval, bval = int(lbins[d]*255.), int(abins[d]*255.), int(bbins[d]*255.)
+					#draw the rectangle in the wanted color
+					self.make_rectangles(cv.fromarray(histimg), six_points, 6, 0, 0, d, [lval, aval, bval], grid_height_ratio, [lcolors, acolors, bcolors], voffset=hist_height)
+			
+			# display stage (gridded); the gridded histograms are already in the record (row by row)
+			if ap['display']:
 				for i in range(grid_x_divs):
 					for j in range(grid_y_divs):
-						if ap['mode'] == 'playback':
-							lbins, abins, bbins = fp[(curr_stride_frame)][(j*grid_x_divs)+i+1][0], fp[curr_stride_frame][(j*grid_x_divs)+i+1][1], fp[curr_stride_frame][(j*grid_x_divs)+i+1][2]
-						else:
-							sub = frame[(i*grid_width):((i+1)*grid_width),(j*grid_height):((j+1)*grid_height)]
-							lbins, abins, bbins = self._analyze_image(sub, fp, (self.frame_idx/stride_frames), grid_lab, lab_min, lab_max, grid_l_star, grid_a_star, grid_b_star, grid_mask, l_histo, a_histo, b_histo, i, j, 1, 1., thresh=ap['threshold'])
-
-						# display stage (gridded)
-						if ap['display']:
-							for  d in range (dims):
-								# for all the bins, get the value, and scale to the size of the grid
-								lval, aval, bval = int(lbins[d]*255.), int(abins[d]*255.), int(bbins[d]*255.)
-								#draw the rectangle in the wanted color
-								self.make_rectangles(cv.fromarray(histimg), six_points, 6, i, j, d, [lval, aval, bval], grid_height_ratio, [lcolors, acolors, bcolors], voffset=0)
-				
-				#### SHOW
-				if ap['display']:
-					cv.ShowImage('Image', cv.fromarray(frame))
-					cv.ShowImage('Histogram', cv.fromarray(histimg))
-				fp.flush()
-				self.frame_idx += 1
-				
-			elif (self.frame_idx%stride_frames) == 1:
-				self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, int((self.frame_idx / stride_frames) + 1) * stride_frames)
-				self.frame_idx += stride_hop # stride_hop = 5 = stride - 1
-				
+						lbins, abins, bbins = record[(j*grid_x_divs)+i+1][0], record[(j*grid_x_divs)+i+1][1], record[(j*grid_x_divs)+i+1][2]
+						for  d in range (dims):
+							# for all the bins, get the value, and scale to the size of the grid
+							lval, aval, bval = int(lbins[d]*255.), int(abins[d]*255.), int(bbins[d]*255.)
+							#draw the rectangle in the wanted color
+							self.make_rectangles(cv.fromarray(histimg), six_points, 6, i, j, d, [lval, aval, bval], grid_height_ratio, [lcolors, acolors, bcolors], voffset=0)
+			
+			#### SHOW
+			if ap['display']:
+				cv.ShowImage('Image', cv.fromarray(frame))
+				cv.ShowImage('Histogram', cv.fromarray(histimg))
 			
 			# no need to waitkey if we are not displaying:
 			if ap['display']:
@@ -780,13 +929,49 @@ class ColorFeaturesLAB:
 				k = cv.WaitKey (int(1000 / ap['afps']))
 				if k % 0x100 == 27:
 					# user has press the ESC key, so exit
-						break
-			
+					aborted = True
+					break
+		
+		if frames.frame_error:
+			_log.error('Frame error! Exiting...')
+		
+		if ap['mode'] == 'analyze':
+			writer.close(complete=(not aborted and not frames.frame_error))
+		reporter.finish()
 		del fp
+		if ap['mode'] == 'analyze' and not aborted and not frames.frame_error:
+			finish_feature_file(self.data_path, ap)
 		if ap['display']:
 			cv.DestroyWindow('Image')
 			cv.DestroyWindow('Histogram')	
 	
+	def _analyze_shard(self, shard, start_frame, end_frame, offset_strides, shape, frame_size, bin_lut, region_keys):
+		"""
+		Worker function for sharded analysis (see analyze_movie). Opens its own capture, seeks once to start_frame (or, when resuming, to the first stride the shard has not committed yet), and writes the analysis frames in [start_frame, end_frame), scaled to frame_size (the analysis frame size of the parent, which bin_lut and region_keys are made for), to their rows of the data file. Keeps its own progress record. Exits with status 1 after a frame error (the shard is then incomplete).
+		"""
+		ap = self.analysis_params
+		stride_frames = ap['stride']
+		progress = ProgressRecord(progress_path(self.data_path, shard), dict(ap, shard=[start_frame, end_frame]), self.movie_path, shape)
+		if ap['resume'] and progress.load():
+			if progress.complete:
+				return
+			start_frame = max(start_frame, (offset_strides + progress.committed_strides) * stride_frames)
+		else:
+			progress.save(0)
+		capture = cv2.VideoCapture(self.movie_path)
+		fp = map_feature_file(self.data_path, shape[1:], mode='r+')
+		writer = feature_writer(fp, ap, progress)
+		frames = open_frame_source(capture, start_frame, end_frame, stride_frames, ap['frame_access'], ap['gop_size'], ap['prefetch'], frame_size)
+		for frame_idx, frame in frames:
+			writer.write((frame_idx / stride_frames) - offset_strides, self._analyze_frame(frame, bin_lut, region_keys, thresh=ap['threshold']))
+		writer.close(complete=(not frames.frame_error))
+		del fp
+		capture.release()
+		if frames.frame_error:
+			# a non-zero exit code makes run_shards report the shard as failed (it can be resumed)
+			_log.error('Frame error! Exiting shard %s', (start_frame, end_frame))
+			sys.exit(1)
+	
 	def _display_movie_frame_by_frame(self, **kwargs):
 		"""
 		Same as _process function's playback capabilities, but with interactive keyboard control.
@@ -805,23 +990,25 @@ class ColorFeaturesLAB:
 		
 		"""
 		if not HAVE_CV:
-			print "WARNING: You must install OpenCV in order to analyze or view!"
+			_log.warning('You must install OpenCV in order to analyze or view!')
 			return
 		
 		if (self.movie_path is None) and (self.data_path is None):
-			print "Both movie path and data path are missing! Please supply at least one."
+			_log.error('Both movie path and data path are missing! Please supply at least one.')
 			return None
 		
 		have_mov = os.path.exists(self.movie_path)
 		have_data = os.path.exists(self.data_path)
 		
 		if (have_mov is False) and (have_data is False):
-			print "Both movie file and data file are missing! Please supply at least one."
+			_log.error('Both movie file and data file are missing! Please supply at least one.')
 			return None
 		
  		ap = self._check_cflab_params(kwargs)
+		self._load_metadata()
 		ap = self.analysis_params
 		verbose = ap['verbose']
+		self._use_data_layout()
 		
 		if have_mov is True:
 	 		self.capture = cv2.VideoCapture(self.movie_path)
@@ -829,7 +1016,7 @@ class ColorFeaturesLAB:
 			frame_height = int(self.capture.get(cv.CV_CAP_PROP_FRAME_HEIGHT))
 		else:
 			frame_width = 800
-			frame_height = (self._read_json_value('aspect') * frame_width)
+			frame_height = int(frame_width / self.metadata().aspect)
 		
 		fps = ap['fps']
 		grid_x_divs = ap['grid_divs_x']
@@ -843,7 +1030,7 @@ class ColorFeaturesLAB:
 		grid_size = (grid_width, grid_height)
 		
 		if verbose:
-			print ap['lrange'][0], ' | ', ap['arange'][0], ' | ', ap['brange'][0], ' | ', ap['lrange'][1], ' | ', ap['arange'][1], ' | ', ap['brange'][1], '\n', fps, ' | ', hist_size, ' | ', grid_size
+			_log.info('L*a*b* ranges: %s | %s | %s | %s | %s | %s, fps, histogram size, grid size: %s | %s | %s', ap['lrange'][0], ap['arange'][0], ap['brange'][0], ap['lrange'][1], ap['arange'][1], ap['brange'][1], fps, hist_size, grid_size)
 				
 		dims = ap['ldims']
 		bin_w = int((hist_width * ap['hist_width_ratio']) / (ap['ldims'] * grid_x_divs))
@@ -864,21 +1051,20 @@ class ColorFeaturesLAB:
 		dur_frames = dur_strides * stride_frames
 				
 		if verbose:
-			print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
-			print 'DUR TOTAL: ', dur_total_secs
-			print "OFFSET (SECONDS): ", offset_secs
-			print "OFFSET (STRIDES): ", offset_strides
-			print "OFFSET (FRAMES): ", offset_frames
-			print "DUR (SECONDS): ", dur_secs
-			print 'DUR (STRIDES): ', dur_strides
-			print 'DUR (FRAMES): ', dur_frames
-			print "FPS: ", fps
-			print "stride_frames: ", stride_frames
+			_log.info('DUR TOTAL: %s', dur_total_secs)
+			_log.info('OFFSET (SECONDS): %s', offset_secs)
+			_log.info('OFFSET (STRIDES): %s', offset_strides)
+			_log.info('OFFSET (FRAMES): %s', offset_frames)
+			_log.info('DUR (SECONDS): %s', dur_secs)
+			_log.info('DUR (STRIDES): %s', dur_strides)
+			_log.info('DUR (FRAMES): %s', dur_frames)
+			_log.info('FPS: %s', fps)
+			_log.info('stride_frames: %s', stride_frames)
 		
 		# set up memmap
 		# mode should always be playback and dislay should always be true!!!
 		if ap['mode'] == 'playback' and ap['display'] == True and have_data:
-			fp = np.memmap(self.data_path, dtype='float32', mode='r', shape=((offset_strides + dur_strides),17,3,16))
+			fp = map_feature_file(self.data_path, self._record_shape())
 					
 			# set some drawing constants
 			vert_offset = int(frame_height*ap['hist_vert_offset_ratio'])
@@ -890,13 +1076,13 @@ class ColorFeaturesLAB:
 			cv2.resizeWindow('Histogram', int(hist_width*ap['hist_width_ratio']*1.0), int(hist_height*ap['hist_height_ratio']*1.275))
 			cv2.moveWindow('Histogram', int(frame_width*ap['hist_horiz_offset_ratio']), vert_offset)
 			
-			lcolors, acolors, bcolors= range(16), range(16), range(16)
+			lcolors, acolors, bcolors= range(dims), range(dims), range(dims)
 			for d in range (dims):
 				gray_val = (d * 192. / dims) + 32
 				lcolors[d] = cv.Scalar(255., gray_val, gray_val)
 				acolors[d] = cv.Scalar(gray_val, 128., 128.)
 				bcolors[d] = cv.Scalar(gray_val, gray_val, gray_val)
-			six_points = self.build_bars(grid_width, grid_height, bin_w, third_bin_w, grid_x_divs, grid_y_divs, 16) # 16: number of bins
+			six_points = self.build_bars(grid_width, grid_height, bin_w, third_bin_w, grid_x_divs, grid_y_divs, dims) # dims: number of bins
 			if have_mov:
 				self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, offset_frames)
 		
@@ -912,7 +1098,7 @@ class ColorFeaturesLAB:
 					if have_mov:
 						ret, frame = self.capture.read()		
 						if frame is None: 
-							print 'Frame error! Exiting...'
+							_log.error('Frame error! Exiting...')
 							break # no image captured... end the processing
 		
 					trio = fp[curr_stride_frame]
@@ -929,7 +1115,7 @@ class ColorFeaturesLAB:
 					# display stage (gridded)
 					for i in range(grid_x_divs):
 						for j in range(grid_y_divs):
-							lbins, abins, bbins = trio[(j*4)+i+1][0], trio[(j*4)+i+1][1], trio[(j*4)+i+1][2]
+							lbins, abins, bbins = trio[(j*grid_x_divs)+i+1][0], trio[(j*grid_x_divs)+i+1][1], trio[(j*grid_x_divs)+i+1][2]
 							# if verbose: print (np.sum(lbins), np.sum(abins), np.sum(bbins))
 							# display stage (grid)
 							for  d in range (dims):
@@ -942,9 +1128,8 @@ class ColorFeaturesLAB:
 					if have_mov:
 						cv.ShowImage('Image', cv.fromarray(frame))
 					cv.ShowImage('Histogram', cv.fromarray(histimg))
-					fp.flush()
 		
-					print self.frame_idx, ':: ', (float(self.frame_idx - offset_frames) / dur_frames)
+					_log.debug('frame %s :: %s', self.frame_idx, (float(self.frame_idx - offset_frames) / dur_frames))
 					
 				# check p_state				
 				if p_state == 1: # rew. 10 sec.
@@ -967,9 +1152,7 @@ class ColorFeaturesLAB:
 				# handle key events
 				k = cv.WaitKey (int(1000 / ap['afps']))
 				if verbose is True:
-					print '>>>>>>>>>>>>>>>>>>'
-					print k % 0x100
-					print p_state
+					_log.info('key: %s, state: %s', (k % 0x100), p_state)
 				
 				if k % 0x100 == 27:
 					# user has press the ESC key, so exit
@@ -998,59 +1181,91 @@ class ColorFeaturesLAB:
 					cv.DestroyWindow('Image')
 				cv.DestroyWindow('Histogram')	
 
-	def _analyze_image(self, img, mfp, fpindex, lab, lab_min, lab_max, l_star, a_star, b_star, mask, l_histo, a_histo, b_histo, i, j, grid_flag, grid_height=1, thresh=0.):
+	def _kernel_tables(self, frame_width, frame_height):
 		"""
-		Image analysis kernel function that is called to analyze each frame image. Look at the main process function to get an idea of how you would call this to return analysis data for a single image. Todo: wrap such a call into a simple one-off function call.
+		The bin lookup table and the region keys that _analyze_frame needs for frames of the given (analysis) size.
 		"""
-		# ap = self._check_cflab_params(None)
 		ap = self.analysis_params
-		grid_divs_x = ap['grid_divs_x']
-		lab = cv2.cvtColor(img, cv.CV_BGR2Lab)
-		
-		item = cv2.calcHist([lab],[0],None,[16],[0,255])
-		cv2.normalize(np.where(item>thresh,item,0),l_star,alpha=1.0,norm_type=cv2.NORM_L2)
-		item = cv2.calcHist([lab],[1],None,[16],[0,255])
-		cv2.normalize(np.where(item>thresh,item,0),a_star,alpha=1.0,norm_type=cv2.NORM_L2)
-		item = cv2.calcHist([lab],[2],None,[16],[0,255])
-		cv2.normalize(np.where(item>thresh,item,0),b_star,alpha=1.0,norm_type=cv2.NORM_L2)
-				
-		mfp[fpindex][ ((grid_divs_x*i)+j)+grid_flag ][0] = np.reshape(l_star[:], (16))
-		mfp[fpindex][ ((grid_divs_x*i)+j)+grid_flag ][1] = np.reshape(a_star[:], (16))
-		mfp[fpindex][ ((grid_divs_x*i)+j)+grid_flag ][2] = np.reshape(b_star[:], (16))
+		lab_min = (ap['lrange'][0], ap['arange'][0], ap['brange'][0])
+		lab_max = (ap['lrange'][1], ap['arange'][1], ap['brange'][1])
+		return self._build_bin_lut(ap['ldims'], lab_min, lab_max), self._grid_region_keys(frame_width, frame_height)
+	
+	def _build_bin_lut(self, dims, lab_min, lab_max):
+		"""
+		Build the (3, 256) lookup table used by the batched kernel. Each 8-bit L*a*b* value maps to its histogram key within a grid cell (channel * dims + bin). Values outside of a channel's range map to a key past the end of the last cell so that they are dropped.
+		"""
+		ap = self.analysis_params
+		num_cells = ap['grid_divs_x'] * ap['grid_divs_y']
+		vals = np.arange(256)
+		bin_lut = np.empty((3, 256), dtype=np.int32)
+		for c in range(3):
+			bins = ((vals - lab_min[c]) * dims) // (lab_max[c] - lab_min[c])
+			in_range = (vals >= lab_min[c]) & (vals < lab_max[c])
+			bin_lut[c] = np.where(in_range, (c * dims) + bins, num_cells * 3 * dims)
+		return bin_lut
+	
+	def _grid_region_labels(self, frame_width, frame_height):
+		"""
+		Region-label map: the grid cell of every pixel of a (frame_height, frame_width) frame, computed once per film. Cells are numbered row by row (cell = (row * grid_divs_x) + col, the same order as the records in the data file) and cover the whole frame: column x falls in cell column (x * grid_divs_x) // frame_width, row y in cell row (y * grid_divs_y) // frame_height, so that cell sizes differ by at most one pixel for any number of divisions.
+		"""
+		ap = self.analysis_params
+		cols = (np.arange(frame_width) * ap['grid_divs_x']) // frame_width
+		rows = (np.arange(frame_height) * ap['grid_divs_y']) // frame_height
+		return ((rows[:, np.newaxis] * ap['grid_divs_x']) + cols[np.newaxis, :]).astype(np.int32)
+	
+	def _grid_region_keys(self, frame_width, frame_height):
+		"""
+		Key offset (cell * 3 * dims) of every pixel, from the region-label map.
+		"""
+		return self._grid_region_labels(frame_width, frame_height) * (3 * self.analysis_params['ldims'])
+	
+	def _analyze_frame(self, frame, bin_lut, region_keys, thresh=0.):
+		"""
+		Batched image analysis kernel that is called to analyze each frame image. The frame is converted to L*a*b* once, and the histograms of all grid cells are counted in a single labelled reduction (one np.bincount over cell-offset keys). Since the cells cover the frame, the full-frame histogram is the sum of the cell histograms. Thresholding and L2 normalization are then applied to every histogram at once.
 		
-		return l_star[:], a_star[:], b_star[:]
+		Returns a (cells + 1, 3, dims) float32 record (full frame first, then the cells row by row), ready to be written to the memory-mapped file in one assignment.
+		"""
+		ap = self.analysis_params
+		dims = ap['ldims']
+		num_keys = (ap['grid_divs_x'] * ap['grid_divs_y']) * 3 * dims
+		
+		lab = cv2.cvtColor(frame, cv.CV_BGR2Lab)
+		keys = bin_lut[np.arange(3), lab] + region_keys[:, :, np.newaxis]
+		cell_counts = np.bincount(keys.ravel(), minlength=num_keys)[:num_keys].reshape((-1, 3, dims))
+		counts = np.concatenate((cell_counts.sum(axis=0)[np.newaxis], cell_counts))
+		
+		record = np.where(counts > thresh, counts, 0).astype(np.float32)
+		norms = np.sqrt(np.sum(record * record, axis=2))[:, :, np.newaxis]
+		return np.divide(record, norms, out=np.zeros_like(record), where=(norms > 0))
 	
 	# GUI helper functions
 	def build_bars(self, gw, gh, bw, tbw, xdivs, ydivs, numbins):
 		"""
-		Display helper function. Build list of points for the trios of histogram bars.
+		Display helper function. Build list of points for the trios of histogram bars: [numbins, xdivs * ydivs, 6, 2], with the cells row by row (cell (row * xdivs) + col, as in the records).
 		"""
-		# ap = self._check_cflab_params(None)
-		ap = self.analysis_params
-		six_points = np.ndarray((16,16,6,2), dtype=int)
-		for i in range(xdivs):
-			for j in range(ydivs):
+		six_points = np.zeros((numbins, (xdivs * ydivs), 6, 2), dtype=int)
+		for row in range(ydivs):
+			for col in range(xdivs):
 				for h in range(numbins):
-					foo = six_points[h][(i*xdivs)+j]
-					foo[0] = [(j*gw)+(h * bw), (i+1)*gh]
-					foo[1] = [(j*gw)+((h+1) * bw)-(2*tbw), ((i+1)*gh)]
-					foo[2] = [(j*gw)+(h * bw)+(tbw), (i+1)*gh]
-					foo[3] = [(j*gw)+((h+1) * bw)-(tbw), ((i+1)*gh)]
-					foo[4] = [(j*gw)+(h * bw)+(2*tbw), (i+1)*gh]
-					foo[5] = [(j*gw)+((h+1) * bw), ((i+1)*gh)]
+					foo = six_points[h][(row*xdivs)+col]
+					foo[0] = [(col*gw)+(h * bw), (row+1)*gh]
+					foo[1] = [(col*gw)+((h+1) * bw)-(2*tbw), ((row+1)*gh)]
+					foo[2] = [(col*gw)+(h * bw)+(tbw), (row+1)*gh]
+					foo[3] = [(col*gw)+((h+1) * bw)-(tbw), ((row+1)*gh)]
+					foo[4] = [(col*gw)+(h * bw)+(2*tbw), (row+1)*gh]
+					foo[5] = [(col*gw)+((h+1) * bw), ((row+1)*gh)]
 		return six_points
 	
 	def make_rectangles(self, h_img, pts, num_pts, i, j, h, vals, grid_height_ratio, colors, hoffset=0, voffset=0):
 		"""
-		Display helper function. Make a bank of three bars for the histogram. (16 in total.)
+		Display helper function. Make a bank of three bars for bin h of the histogram of the cell in column i and row j (see build_bars).
 		"""
 		# ap = self._check_cflab_params(None)
 		ap = self.analysis_params
-		grid_divs_x = ap['grid_divs_x']
-		grid_divs_y = ap['grid_divs_y']
+		cell = (j*ap['grid_divs_x'])+i
 		# the 0.95 scalar is there so that there are gaps between the histograms in the grid view!
 		for n in range(int(num_pts/2)):
 			cv.Rectangle (h_img,
-							((pts[h][(i*grid_divs_x)+j][2*n][0] + hoffset),   (pts[h][(i*grid_divs_x)+j][2*n][1] + int(voffset))),
-							((pts[h][(i*grid_divs_x)+j][2*n+1][0] + hoffset), (pts[h][(i*grid_divs_x)+j][2*n+1][1] + int(voffset) - int(vals[n]*grid_height_ratio*0.95))), 
+							((pts[h][cell][2*n][0] + hoffset),   (pts[h][cell][2*n][1] + int(voffset))),
+							((pts[h][cell][2*n+1][0] + hoffset), (pts[h][cell][2*n+1][1] + int(voffset) - int(vals[n]*grid_height_ratio*0.95))), 
 							colors[n][h], -1, 8, 0)
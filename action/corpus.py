@@ -0,0 +1,208 @@
+# corpus.py - consolidated corpus feature files (one file per feature type, all titles)
+# Bregman:ACTION - Cinematic information retrieval toolkit
+
+"""
+Part of Bregman:ACTION - Cinematic information retrieval toolkit
+
+Overview
+========
+
+Corpus-wide work (gather_color_feature_data, the MDS and director-prediction examples, clustering across films) opens every title's directory and maps every title's data file, one after the other. A corpus file holds the features of one type (one data extension) for a whole set of titles instead: the records of all titles, one title after the other, in a single data file (with the usual header, see featurestore), plus a JSON table next to it (corpus.opticalflow24.json) that lists, for every title, the first row and the number of rows it occupies, and the frame rate and analysis stride it was analyzed at:
+
++-----------+-----------------------------------------------------------------------------------+
+| key       | contents                                                                          |
++===========+===================================================================================+
+| title     | the title (name of its directory)                                                 |
++-----------+-----------------------------------------------------------------------------------+
+| start_row | first row of the title's records in the corpus file                               |
++-----------+-----------------------------------------------------------------------------------+
+| rows      | number of records (analysis frames) of the title                                  |
++-----------+-----------------------------------------------------------------------------------+
+| fps       | frame rate of the title's movie                                                   |
++-----------+-----------------------------------------------------------------------------------+
+| stride    | analysis stride of the title's data file                                          |
++-----------+-----------------------------------------------------------------------------------+
+
+pack_corpus writes a corpus file from the titles' data files, in blocks of rows (so memory use does not depend on the size of the corpus). If all data files store their values the same way (dtype, and scale and offset for quantized files; see featurestore), the stored values are copied as they are; otherwise, and for chunk-compressed and sparse data files, they are converted to float32. A FeatureCorpus reads the corpus file: features returns the (memory-mapped, zero-copy) records of one title, stacked returns the records of several titles as one matrix, with a vector of title labels:
+
+.. code-block:: python
+
+	fc = pack_corpus('/Volumes/ACTION', ['Psycho', 'Vertigo', 'Rope'], '.color_lab')
+	X = fc.features('Vertigo')						# [ROWS, 17, 3, 16], a view of the corpus file
+	X, labels = fc.stacked(flat=True)				# all titles: [ROWS, 816] and [ROWS] (index into fc.titles)
+	fc = FeatureCorpus('/Volumes/ACTION/corpus.color_lab')	# later, or in another process
+
+stacked returns a view of the corpus file (no copy) whenever the requested titles are next to each other in the corpus, in order (all titles, in particular); otherwise their records are gathered into a new array. (Half-precision and quantized corpus files are converted to float32 as they are read, see QuantizedFeatures.)
+
+"""
+__version__ = '1.0'
+__author__ = 'Thomas Stoll'
+__copyright__ = "Copyright (C) 2012  Michael Casey, Thomas Stoll, Dartmouth College, All Rights Reserved"
+__license__ = "gpl 2.0 or higher"
+__email__ = 'thomas.m.stoll@dartmouth.edu'
+
+import os, json
+import numpy as np
+from actionlog import *
+from featurestore import *
+from metadata import *
+_log = get_logger(__name__)
+
+# number of records copied at a time by pack_corpus
+PACK_BLOCK_ROWS = 4096
+
+
+class FeatureCorpus(object):
+	"""
+	Reader for a corpus file (see pack_corpus). The titles attribute lists the titles in the order of their records; table maps every title to its entry in the offset table (start_row, rows, fps, stride); data is the map of the whole corpus file (see map_feature_file) and labels the title index of every row.
+	"""
+	def __init__(self, corpus_path):
+		self.corpus_path = corpus_path
+		with open(corpus_table_path(corpus_path), 'r') as f:
+			record = json.load(f)
+		self.data_extension = record.get('data_extension')
+		self.titles = [entry['title'] for entry in record['titles']]
+		self.table = dict((entry['title'], entry) for entry in record['titles'])
+		self.data = map_feature_file(corpus_path)
+		self.starts = np.array([self.table[title]['start_row'] for title in self.titles] + [len(self.data)], dtype=np.int64)
+		self._labels = None
+
+	def __len__(self):
+		return len(self.data)
+
+	def __contains__(self, title):
+		return title in self.table
+
+	@property
+	def labels(self):
+		"""
+		Title index (into titles) of every row of the corpus; computed on first use.
+		"""
+		if self._labels is None:
+			self._labels = np.repeat(np.arange(len(self.titles), dtype=np.int32), np.diff(self.starts))
+		return self._labels
+
+	def rows(self, title):
+		"""
+		(start_row, stop_row) of a title's records.
+		"""
+		entry = self.table[title]
+		return entry['start_row'], (entry['start_row'] + entry['rows'])
+
+	def features(self, title, access_stride=1):
+		"""
+		The records of one title (every access_stride-th one): a view of the corpus file, [ROWS] + record shape.
+		"""
+		start, stop = self.rows(title)
+		return self.data[start:stop:max(int(access_stride), 1)]
+
+	def stacked(self, titles=None, flat=False):
+		"""
+		The records of titles (all titles if None), one title after the other, and the title index (into titles) of every row: (X, labels). X is a view of the corpus file if the titles are next to each other in the corpus, in this order; otherwise the records are copied. With flat=True, X has two dimensions, [ROWS, values per record].
+		"""
+		if titles is None:
+			titles = self.titles
+		indices = [self.titles.index(title) for title in titles]
+		if len(indices) > 0 and indices == range(indices[0], (indices[-1] + 1)):
+			start, stop = self.starts[indices[0]], self.starts[indices[-1] + 1]
+			X, labels = self.data[start:stop], (self.labels[start:stop] - indices[0])
+		elif len(indices) > 0:
+			X = np.concatenate([self.data[self.starts[i]:self.starts[i + 1]] for i in indices])
+			labels = np.repeat(np.arange(len(indices), dtype=np.int32), [(self.starts[i + 1] - self.starts[i]) for i in indices])
+		else:
+			X, labels = self.data[0:0], np.zeros(0, dtype=np.int32)
+		if flat:
+			X = X.reshape((X.shape[0], -1))
+		return X, labels
+
+	def title_of_row(self, row):
+		"""
+		The title a row of the corpus belongs to.
+		"""
+		return self.titles[int(np.searchsorted(self.starts, row, side='right')) - 1]
+
+	def fps(self, title):
+		return self.table[title]['fps']
+
+	def stride(self, title):
+		return self.table[title]['stride']
+
+
+def corpus_path(action_dir, data_extension):
+	"""
+	Default path of the corpus file for a data extension: action_dir/corpus<data_extension>.
+	"""
+	return os.path.join(action_dir, ('corpus' + data_extension))
+
+
+def corpus_table_path(corpus_path):
+	"""
+	Path of the offset table (JSON) of a corpus file.
+	"""
+	return corpus_path + '.json'
+
+
+def pack_corpus(action_dir, titles, data_extension, corpus_file=None, record_shape=None):
+	"""
+	Concatenate the data files (action_dir/TITLE/TITLE<data_extension>) of titles into one corpus file (corpus_file, by default action_dir/corpus<data_extension>) and write its offset table. Titles without a data file are skipped (with a warning). record_shape is only needed for headerless data files. The frame rate and stride of every title come from the data file's header or, for headerless files, from the title's JSON file. Returns the FeatureCorpus. Raises a ValueError if the data files do not all have the same record shape.
+	"""
+	if corpus_file is None:
+		corpus_file = corpus_path(action_dir, data_extension)
+	sources = []
+	for title in titles:
+		data_path = os.path.join(action_dir, title, (title + data_extension))
+		if not os.path.exists(data_path):
+			_log.warning('No %s data file for %s, skipped.', data_extension, title)
+			continue
+		header = read_feature_header(data_path)
+		data = map_feature_file(data_path, (None if header is not None else record_shape))
+		fps, stride = _title_rate(action_dir, title, data_extension, header)
+		sources.append((title, data_path, header, data, fps, stride))
+	if len(sources) == 0:
+		raise ValueError("No %s data files to pack in %s." % (data_extension, action_dir))
+	shapes = set(data.shape[1:] for title, data_path, header, data, fps, stride in sources)
+	if len(shapes) > 1:
+		raise ValueError("The %s data files have different record shapes: %s" % (data_extension, sorted(shapes)))
+
+	# copy the stored values if they are all stored alike (and contiguous), otherwise convert to float32
+	formats = set(((header.dtype.str, header.scale, header.offset) if header is not None else (np.dtype('float32').str, 0., 0.)) for title, data_path, header, data, fps, stride in sources)
+	raw = len(formats) == 1 and all((header is None or (header.chunk_rows == 0 and not header.sparse)) for title, data_path, header, data, fps, stride in sources)
+	dtype, scale, offset = formats.pop() if raw else ('float32', 0., 0.)
+	strides = set(stride for title, data_path, header, data, fps, stride in sources)
+
+	rows = sum(len(data) for title, data_path, header, data, fps, stride in sources)
+	header = FeatureHeader(shapes.pop(), rows, dtype, (strides.pop() if len(strides) == 1 else 0), scale=scale, offset=offset)
+	tmp_path = corpus_file + '.tmp'
+	fp = create_feature_file(tmp_path, header)
+	table = []
+	start_row = 0
+	for title, data_path, title_header, data, fps, stride in sources:
+		if raw and isinstance(data, QuantizedFeatures):
+			data = data.raw
+		for block in range(0, len(data), PACK_BLOCK_ROWS):
+			block_rows = data[block:(block + PACK_BLOCK_ROWS)]
+			fp[(start_row + block):(start_row + block + len(block_rows))] = block_rows
+		table.append({'title' : title, 'start_row' : start_row, 'rows' : len(data), 'fps' : fps, 'stride' : stride})
+		_log.info('%s: %d rows at row %d', title, len(data), start_row)
+		start_row += len(data)
+	fp.flush()
+	del fp
+	os.rename(tmp_path, corpus_file)
+	table_path = corpus_table_path(corpus_file)
+	with open(table_path + '.tmp', 'w') as f:
+		json.dump({'data_extension' : data_extension, 'titles' : table}, f)
+	os.rename(table_path + '.tmp', table_path)
+	return FeatureCorpus(corpus_file)
+
+
+def _title_rate(action_dir, title, data_extension, header):
+	"""
+	(fps, stride) of a title's data file: from its header, or else from the title's JSON file (None where unknown).
+	"""
+	if header is not None and header.fps > 0:
+		return header.fps, header.stride
+	try:
+		meta = movie_metadata(os.path.join(action_dir, title, (title + '.json')))
+	except IOError:
+		return None, (header.stride if header is not None else None)
+	return meta.fps, (header.stride if header is not None else meta.analyzed_stride(data_extension))
@@ -7,6 +7,8 @@ __email__ = 'mcasey@dartmouth.edu'
 
 import numpy as N
 import pdb
+from actionlog import *
+_log = get_logger(__name__)
 
 def euc(A,B, old_algorithm=False):
     """ 
@@ -191,7 +193,7 @@ def mds(D, n=0, tol=0.9):
     A = -0.5 * D * D
     H = N.lib.twodim_base.eye(m) - 1./m; # idempotent H*H=H
     B = N.dot(N.dot(H, A), H)
-    print B
+    _log.debug('B: %s', B)
     # this should be a diagonal decomposition because B is symmetric 
     S, U = N.linalg.linalg.eig(B)
     idx = N.argsort(S)[::-1]
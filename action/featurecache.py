@@ -0,0 +1,172 @@
+# featurecache.py - process-wide LRU cache of feature windows for segments
+# Bregman:ACTION - Cinematic information retrieval toolkit
+
+"""
+Part of Bregman:ACTION - Cinematic information retrieval toolkit
+
+Overview
+========
+
+Analysis notebooks and the segmentation examples tend to ask for the same (or overlapping) segments of a title over and over again. Every call to one of the accessors (middle_band_color_features_for_segment, center_quad_phasecorr_features_for_segment, ...) maps the data file, resamples the window to 24 frames per second and applies the region selector again.
+
+With the feature cache enabled, the accessors of ColorFeaturesLAB, PhaseCorrelation, OpticalFlow and OpticalFlowTVL1 keep the arrays they return in a process-wide cache, keyed by title and feature type (the data file), region selector (the accessor), analysis stride and access stride, plus the onset and duration of the segment (as a range of analysis frames). A request that falls inside a window that is already cached is served by slicing that window; nothing is read from disk. The cache holds at most max_bytes of feature data; the least recently used windows are evicted first. The cache is off by default:
+
+.. code-block:: python
+
+	enable_feature_cache(max_bytes=(512 * 2**20))
+	cfl = ColorFeaturesLAB('Psycho')
+	X = cfl.middle_band_color_features_for_segment(Segment(0, 600))
+	X = cfl.middle_band_color_features_for_segment(Segment(60, 120)) # sliced from the first window
+	print feature_cache().stats()
+
+Arrays served from the cache are read-only (as are the memory-mapped arrays the accessors return without it); copy them before changing them in place. The cache notices when a data file is rewritten (its modification time or size changes) and stops serving the old windows, which are evicted in due course.
+
+"""
+__version__ = '1.0'
+__author__ = 'Thomas Stoll'
+__copyright__ = "Copyright (C) 2012  Michael Casey, Thomas Stoll, Dartmouth College, All Rights Reserved"
+__license__ = "gpl 2.0 or higher"
+__email__ = 'thomas.m.stoll@dartmouth.edu'
+
+import os, threading
+from collections import OrderedDict
+import numpy as np
+
+DEFAULT_CACHE_BYTES = 256 * 2**20
+_cache = None
+
+
+class FeatureCache(object):
+	"""
+	LRU cache of feature windows with a byte budget. An entry is an array whose rows are the analysis frames range(start, stop, step) of the features identified by key (any hashable). get() returns the rows range(start, stop, step) for a key from the smallest cached window with the same key and step that contains them (and starts on the same step grid), or loads and stores them on a miss.
+
+	The hits, misses and evictions attributes count lookups served from the cache, lookups that were not, and windows dropped to stay within max_bytes; nbytes is the size of the cached data.
+	"""
+	def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+		self.max_bytes = int(max_bytes)
+		self.entries = OrderedDict()
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._lock = threading.RLock()
+
+	def get(self, key, start, stop, step, load):
+		"""
+		Rows range(start, stop, step) of the features identified by key: from the cache if possible, otherwise load() is called (it has to return exactly those rows) and the result is stored.
+		"""
+		value = self.lookup(key, start, stop, step)
+		if value is None:
+			value = load()
+			if value is not None:
+				value = self.store(key, start, stop, step, value)
+		return value
+
+	def lookup(self, key, start, stop, step=1):
+		"""
+		Rows range(start, stop, step) for key, sliced from a cached window that contains them, or None.
+		"""
+		with self._lock:
+			best = None
+			for entry in self.entries:
+				e_key, e_start, e_stop, e_step = entry
+				if e_key == key and e_step == step and e_start <= start and stop <= e_stop and ((start - e_start) % step) == 0:
+					if best is None or (e_stop - e_start) < (best[2] - best[1]):
+						best = entry
+			if best is None:
+				self.misses += 1
+				return None
+			self.hits += 1
+			value = self.entries.pop(best)
+			self.entries[best] = value
+			first = (start - best[1]) // step
+			return value[first:(first + len(xrange(start, stop, step)))]
+
+	def store(self, key, start, stop, step, value):
+		"""
+		Cache a window (a read-only copy of value, which is returned) and evict least recently used windows until the cache fits into max_bytes again. Windows that the new one contains are dropped. Values larger than max_bytes are returned as they are, without being cached.
+		"""
+		if np.asarray(value).nbytes > self.max_bytes:
+			return value
+		value = np.array(value)
+		value.flags.writeable = False
+		with self._lock:
+			for entry in list(self.entries):
+				e_key, e_start, e_stop, e_step = entry
+				if e_key == key and e_step == step and start <= e_start and e_stop <= stop and ((e_start - start) % step) == 0:
+					self._drop(entry)
+			self.entries[(key, start, stop, step)] = value
+			self.nbytes += value.nbytes
+			while self.nbytes > self.max_bytes:
+				self._drop(next(iter(self.entries)))
+				self.evictions += 1
+		return value
+
+	def clear(self):
+		with self._lock:
+			self.entries.clear()
+			self.nbytes = 0
+
+	def stats(self):
+		"""
+		Counters and size of the cache, as a dict.
+		"""
+		with self._lock:
+			return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions, 'entries' : len(self.entries), 'nbytes' : self.nbytes, 'max_bytes' : self.max_bytes}
+
+	def _drop(self, entry):
+		self.nbytes -= self.entries.pop(entry).nbytes
+
+
+def enable_feature_cache(max_bytes=DEFAULT_CACHE_BYTES):
+	"""
+	Turn on the process-wide feature cache (or change its byte budget, keeping what is cached). Returns the FeatureCache.
+	"""
+	global _cache
+	if _cache is None:
+		_cache = FeatureCache(max_bytes)
+	else:
+		with _cache._lock:
+			_cache.max_bytes = int(max_bytes)
+			while _cache.nbytes > _cache.max_bytes:
+				_cache._drop(next(iter(_cache.entries)))
+				_cache.evictions += 1
+	return _cache
+
+
+def disable_feature_cache():
+	"""
+	Turn off the process-wide feature cache and release what it holds.
+	"""
+	global _cache
+	if _cache is not None:
+		_cache.clear()
+	_cache = None
+
+
+def feature_cache():
+	"""
+	The process-wide FeatureCache, or None if it is not enabled.
+	"""
+	return _cache
+
+
+def cached_features(key, start, stop, step, load):
+	"""
+	Rows range(start, stop, step) of the features identified by key, served by the process-wide feature cache if it is enabled; otherwise just load().
+	"""
+	cache = _cache
+	if cache is None:
+		return load()
+	return cache.get(key, start, stop, step, load)
+
+
+def data_file_key(data_path):
+	"""
+	Identity of a data file's current contents for cache keys: its path, modification time and size.
+	"""
+	try:
+		stat = os.stat(data_path)
+	except OSError:
+		return (data_path, None, None)
+	return (data_path, stat.st_mtime, stat.st_size)
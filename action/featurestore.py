@@ -0,0 +1,939 @@
+# featurestore.py - buffered writing of analysis frames to memory-mapped feature files
+# Bregman:ACTION - Cinematic information retrieval toolkit
+
+"""
+Part of Bregman:ACTION - Cinematic information retrieval toolkit
+
+Overview
+========
+
+The ACTION analyzers store their features in memory-mapped float32 files, one row per analysis frame (stride). Writing every row straight into the memmap, and flushing it after each frame, dirties a few pages and costs an msync per frame; on a network or USB volume this dominates the analysis time.
+
+A BufferedFeatureWriter collects the rows of an analysis run in an in-RAM ring buffer and commits them to the memmap in one slice assignment per run of contiguous rows. The memmap is flushed according to a flush policy:
+
++--------------+------------+--------------------------------------------------------------------+
+| parameter    | default    | explanation                                                        |
++==============+============+====================================================================+
+| buffer_frames| 64         | number of analysis frames held in RAM before they are committed    |
+|              |            | to the memmap in one slice                                         |
++--------------+------------+--------------------------------------------------------------------+
+| flush_frames | 0          | flush the memmap to disk every flush_frames analysis frames        |
+|              |            | (0: never)                                                         |
++--------------+------------+--------------------------------------------------------------------+
+| flush_secs   | 60.0       | flush the memmap to disk every flush_secs seconds (0: never)       |
++--------------+------------+--------------------------------------------------------------------+
+
+With flush_frames and flush_secs both set to 0, the data is only flushed when the writer is closed.
+
+.. code-block:: python
+
+	fp = np.memmap('Psycho.color_lab', dtype='float32', mode='w+', shape=(dur_strides, 17, 3, 16))
+	writer = BufferedFeatureWriter(fp, buffer_frames=64, flush_secs=60.0)
+	for row in range(dur_strides):
+		writer.write(row, record)
+	writer.close()
+
+Analysis runs can be checkpointed and resumed. A ProgressRecord is a small JSON sidecar next to the data file (Psycho.color_lab.progress) that records how many analysis frames (strides) have been committed and flushed, the analysis parameters, the size and modification time of the movie file, and whether the run is complete. The writer updates it every time it flushes the data file. If a run dies, an analyzer called with resume=True reopens the data file in place and continues after the last committed stride, as long as the record still matches the parameters and the movie:
+
+.. code-block:: python
+
+	cfl = ColorFeaturesLAB('Psycho')
+	cfl.analyze_movie(resume=True)
+
+Sharded runs keep one record per shard (Psycho.color_lab.progress.0, ...), which are removed once all shards are done.
+
+File format
+===========
+
+Data files start with a fixed-size header (HEADER_BYTES, one page), followed by the records, row by row. The header holds:
+
++--------------+-----------------------------------------------------------------------------------+
+| field        | contents                                                                          |
++==============+===================================================================================+
+| magic        | FEATURE_MAGIC, the first eight bytes of every data file with a header             |
++--------------+-----------------------------------------------------------------------------------+
+| version      | version of the file format (FORMAT_VERSION)                                       |
++--------------+-----------------------------------------------------------------------------------+
+| dtype        | dtype of the stored values: '<f4' (float32), '<f2' (float16), '|u1' (uint8) or     |
+|              | '<u2' (uint16)                                                                    |
++--------------+-----------------------------------------------------------------------------------+
+| record_shape | shape of one record (analysis frame), up to six dimensions: (17, 3, 16) for       |
+|              | ColorFeaturesLAB, (65, 3) for PhaseCorrelation, (512,) for OpticalFlow            |
++--------------+-----------------------------------------------------------------------------------+
+| rows         | number of records                                                                 |
++--------------+-----------------------------------------------------------------------------------+
+| stride       | analysis stride (in movie frames)                                                 |
++--------------+-----------------------------------------------------------------------------------+
+| fps          | frame rate of the source movie                                                    |
++--------------+-----------------------------------------------------------------------------------+
+| frames       | frame count of the source movie                                                   |
++--------------+-----------------------------------------------------------------------------------+
+| params_hash  | SHA-1 of the analysis parameters that determine the data (see params_hash)        |
++--------------+-----------------------------------------------------------------------------------+
+| data_offset  | byte offset of the first record                                                   |
++--------------+-----------------------------------------------------------------------------------+
+| scale,       | for quantized (integer) values: value = (stored * scale) + offset; a scale of 0   |
+| offset       | means that the stored values are the values                                       |
++--------------+-----------------------------------------------------------------------------------+
+
+The analyzers write the header when they create a data file (see open_feature_file). Readers go through map_feature_file, which reads and checks the header (magic, version, and that the file size matches the rows it announces; an O(1) check, whatever the size of the file) and maps the records with the data offset, so that access stays zero-copy. Files written by earlier versions of ACTION have no header; they are recognized by the missing magic and mapped from the start, as headerless float32 files with the record shape the caller expects:
+
+.. code-block:: python
+
+	header = read_feature_header('Psycho.phasecorr')	# None for a headerless file
+	print header.rows, header.record_shape, header.stride, header.fps
+	fp = map_feature_file('Psycho.phasecorr', (65, 3))	# [rows, 65, 3], read-only
+
+Storage
+=======
+
+The analyzers store their records as float32 by default. To shrink the data files (and the working set of scans over many titles), they can store them in half precision or quantized to 8 or 16 bits instead, set by two analysis parameters:
+
++---------------+------------+-------------------------------------------------------------------+
+| parameter     | default    | explanation                                                       |
++===============+============+===================================================================+
+| storage_dtype | 'float32'  | 'float32', 'float16' (half the size; about three significant      |
+|               |            | digits) or 'uint16', 'uint8' (a half or a quarter of the size;    |
+|               |            | 65535 or 255 steps across storage_range)                          |
++---------------+------------+-------------------------------------------------------------------+
+| storage_range | (analyzer) | [low, high]: the range of the values, for the integer types;      |
+|               |            | values outside of it are clipped                                  |
++---------------+------------+-------------------------------------------------------------------+
+
+The writer quantizes the records when it commits them; scale and offset go into the header. Read-only maps of half-precision or quantized files (map_feature_file) are QuantizedFeatures: they look like the memmap (shape, indexing, slicing, reshape), but return float32 arrays, converting only the rows that are asked for, so an accessor that reads a segment converts only that segment:
+
+.. code-block:: python
+
+	cfl = ColorFeaturesLAB('Psycho', storage_dtype='uint8')	# color histograms are in [0, 1]
+	cfl.analyze_movie()											# Psycho.color_lab: a quarter of the size
+
+Compression
+===========
+
+A finished data file can also be compressed in chunks of a fixed number of analysis frames, each chunk on its own, with an index of the chunk offsets at the end of the file (format version 2; see compress_feature_file). Reading a segment then decompresses only the chunks it covers. The analyzers compress their data file at the end of a complete run if asked to:
+
++---------------+------------+-------------------------------------------------------------------+
+| parameter     | default    | explanation                                                       |
++===============+============+===================================================================+
+| chunk_frames  | 0          | analysis frames per compressed chunk (0: leave the data file      |
+|               |            | uncompressed)                                                     |
++---------------+------------+-------------------------------------------------------------------+
+| chunk_codec   | 'zlib'     | 'zlib' or 'bz2', 'lzma' (if the lzma module, or backports.lzma,   |
+|               |            | is installed) or 'blosc' (if blosc is installed); see CODECS      |
++---------------+------------+-------------------------------------------------------------------+
+
+The chunks hold the stored values (quantized, if storage_dtype says so). Chunk-compressed files are read-only: map_feature_file returns them as ChunkedFeatures, which look like a read-only memmap (shape, indexing, slicing, reshape) and return float32 arrays. The most recently used chunk is kept, so that reading a file frame by frame (playback) decompresses every chunk once. Sparse data (optical flow) compresses best:
+
+.. code-block:: python
+
+	oflow = OpticalFlow('Psycho', chunk_frames=256, chunk_codec='zlib')
+	oflow.analyze_movie()
+	compress_feature_file('Vertigo/Vertigo.opticalflow24', chunk_rows=256)	# an existing data file, in place
+
+Sparse storage
+==============
+
+Records that are mostly zeros (the optical flow histograms: only the bins of the grid cells with moving corners are filled, and frames without tracks are all zeros) can also be stored sparse, row by row in compressed sparse row (CSR) form, so that the size of the data file, and the bytes read for a segment, depend on the amount of motion rather than on the length of the film. An analyzer writes a sparse data file if its sparse_storage parameter is True (format version 3):
+
++--------------+-----------------------------------------------------------------------------------+
+| section      | contents                                                                          |
++==============+===================================================================================+
+| header       | as above, with the codec SPARSE_LAYOUT ('csr'); index_offset is the offset of the |
+|              | row pointers, data_offset that of the entries                                     |
++--------------+-----------------------------------------------------------------------------------+
+| row pointers | rows + 1 int64: the entries of row r are entries[indptr[r]:indptr[r + 1]]         |
++--------------+-----------------------------------------------------------------------------------+
+| entries      | one (index, value) pair per non-zero value, row after row: the index (uint32) of  |
+|              | the value in the flattened record, and the value (storage_dtype, quantized with   |
+|              | storage_range as above)                                                           |
++--------------+-----------------------------------------------------------------------------------+
+
+The row pointers have a fixed size and come before the entries, so the writer appends the entries of every committed run of rows at the end of the file and updates the row pointers in place; rows that have not been written (yet) are empty. A sparse data file is therefore valid at every flush, and an interrupted run can be resumed like any other. Sparse data files are not chunk-compressed (chunk_frames is ignored for them). map_feature_file returns them as SparseFeatures, which look like a memmap (shape, indexing, slicing, reshape) and return float32 arrays, densifying only the rows that are asked for; csr returns a window as a scipy.sparse CSR matrix instead, without densifying it at all:
+
+.. code-block:: python
+
+	oflow = OpticalFlow('Psycho', sparse_storage=True)
+	oflow.analyze_movie()
+	fp = map_feature_file('Psycho/Psycho.opticalflow24')
+	X = fp.csr(1440, 2880)						# the second minute: a [1440, 512] scipy.sparse.csr_matrix
+	x = fp[1440:2880]							# the same, as a dense float32 array
+
+"""
+__version__ = '1.0'
+__author__ = 'Thomas Stoll'
+__copyright__ = "Copyright (C) 2012  Michael Casey, Thomas Stoll, Dartmouth College, All Rights Reserved"
+__license__ = "gpl 2.0 or higher"
+__email__ = 'thomas.m.stoll@dartmouth.edu'
+
+import os, time, json, struct, hashlib, zlib, bz2, copy
+import numpy as np
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+try:
+	import blosc
+except ImportError:
+	blosc = None
+from scipy import sparse
+
+# parameters that change how a run is carried out, but not the data it produces
+RUNTIME_PARAMS = ['verbose', 'display', 'mode', 'resume', 'workers', 'frame_access', 'gop_size', 'prefetch', 'buffer_frames', 'flush_frames', 'flush_secs', 'chunk_frames', 'chunk_codec']
+
+FEATURE_MAGIC = '\x93ACTFEAT'
+# version 1: records stored contiguously, version 2: chunk-compressed records, version 3: sparse (CSR) records,
+# with the row pointers before the entries (see Sparse storage); unpack reads all versions up to FORMAT_VERSION
+FORMAT_VERSION = 3
+HEADER_BYTES = 4096
+MAX_RECORD_DIMS = 6
+# magic, version, number of record dimensions, dtype, record shape, rows, stride, fps, frames, params hash, data offset, scale, offset, chunk rows, codec, index offset (little-endian, no padding)
+_HEADER_STRUCT = struct.Struct('<8sHH8s%dIQIdQ20sQddI8sQ' % MAX_RECORD_DIMS)
+STORAGE_DTYPES = ['float32', 'float16', 'uint16', 'uint8']
+
+# codec name -> (compress(bytes, itemsize), decompress(bytes)), for the codecs that are available
+CODECS = {
+	'zlib' : (lambda data, itemsize: zlib.compress(data, 6), zlib.decompress),
+	'bz2' : (lambda data, itemsize: bz2.compress(data, 9), bz2.decompress)
+}
+if lzma is not None:
+	CODECS['lzma'] = (lambda data, itemsize: lzma.compress(data), lzma.decompress)
+if blosc is not None:
+	CODECS['blosc'] = (lambda data, itemsize: blosc.compress(data, typesize=itemsize), blosc.decompress)
+# codec of sparse (CSR) data files
+SPARSE_LAYOUT = 'csr'
+
+
+class BufferedFeatureWriter(object):
+	"""
+	Write-behind buffer in front of a memory-mapped feature file (any array that supports slice assignment and, optionally, flush()). Rows are written with write(row, record); a run of contiguous rows is committed to the memmap in a single slice assignment when the buffer fills up, when a non-contiguous row is written, when the flush policy is due, or when the writer is closed.
+
+	The committed_rows attribute counts the rows that have been handed over to the memmap so far; flushed_rows counts the ones that have also been flushed to disk. If a ProgressRecord is given, it is updated (with the end of the highest row written) every time the memmap is flushed.
+
+	If the memmap stores float16 or (with a scale) integers, the buffer holds float32 records, which are converted (quantized with scale and offset, see quantize) as they are committed.
+	"""
+	def __init__(self, fp, buffer_frames=64, flush_frames=0, flush_secs=60.0, progress=None, scale=0., offset=0.):
+		self.fp = fp
+		self.scale = float(scale)
+		self.offset = float(offset)
+		self.buffer = np.zeros(((max(int(buffer_frames), 1),) + fp.shape[1:]), dtype=('float32' if self._converted() else fp.dtype))
+		self.flush_frames = max(int(flush_frames), 0)
+		self.flush_secs = max(float(flush_secs), 0.)
+		self.start_row = 0
+		self.num_rows = 0
+		self.committed_rows = 0
+		self.flushed_rows = 0
+		self.last_flush_time = time.time()
+		self.progress = progress
+		if progress is not None:
+			self.end_row = progress.committed_strides
+		else:
+			self.end_row = 0
+
+	def write(self, row, record):
+		"""
+		Buffer a record for the given row of the memmap.
+		"""
+		if self.num_rows > 0 and row != (self.start_row + self.num_rows):
+			self.commit()
+		if self.num_rows == 0:
+			self.start_row = row
+		self.buffer[self.num_rows] = record
+		self.num_rows += 1
+		if self.num_rows == self.buffer.shape[0]:
+			self.commit()
+		if self._flush_due():
+			self.flush()
+
+	def __getitem__(self, row):
+		"""
+		Read a row back, whether it is still in the buffer or already committed.
+		"""
+		if self.start_row <= row < (self.start_row + self.num_rows):
+			return self.buffer[row - self.start_row]
+		if self._converted():
+			return dequantize(self.fp[row], self.scale, self.offset)
+		return self.fp[row]
+
+	def commit(self):
+		"""
+		Copy the buffered rows into the memmap (one slice assignment), without flushing.
+		"""
+		if self.num_rows > 0:
+			rows = self.buffer[:self.num_rows]
+			if self._converted():
+				rows = quantize(rows, self.fp.dtype, self.scale, self.offset)
+			self.fp[self.start_row:(self.start_row + self.num_rows)] = rows
+			self.committed_rows += self.num_rows
+			self.end_row = max(self.end_row, (self.start_row + self.num_rows))
+			self.num_rows = 0
+
+	def flush(self):
+		"""
+		Commit the buffered rows and flush the memmap to disk.
+		"""
+		self.commit()
+		if hasattr(self.fp, 'flush'):
+			self.fp.flush()
+		self.flushed_rows = self.committed_rows
+		self.last_flush_time = time.time()
+		if self.progress is not None:
+			self.progress.save(self.end_row)
+
+	def close(self, complete=False):
+		"""
+		Commit and flush whatever is left, and mark the progress record (if any) as complete if the run got to the end. The memmap itself is left open.
+		"""
+		self.flush()
+		if self.progress is not None and complete:
+			self.progress.save(self.end_row, complete=True)
+
+	def _converted(self):
+		return np.dtype(self.fp.dtype) != np.dtype('float32')
+
+	def _flush_due(self):
+		pending = (self.committed_rows + self.num_rows) - self.flushed_rows
+		if self.flush_frames > 0 and pending >= self.flush_frames:
+			return True
+		if self.flush_secs > 0 and pending > 0 and (time.time() - self.last_flush_time) >= self.flush_secs:
+			return True
+		return False
+
+
+def feature_writer(fp, params, progress=None):
+	"""
+	Return a BufferedFeatureWriter for the memmap, configured from an analyzer's analysis_params (buffer_frames, flush_frames and flush_secs; storage_dtype and storage_range for quantized memmaps).
+	"""
+	dtype, scale, offset = storage_format(params)
+	if np.dtype(fp.dtype) != dtype:
+		scale, offset = 0., 0.
+	return BufferedFeatureWriter(fp, params.get('buffer_frames', 64), params.get('flush_frames', 0), params.get('flush_secs', 60.0), progress, scale, offset)
+
+
+def storage_format(params):
+	"""
+	The dtype, scale and offset that the data is stored with, from an analyzer's analysis_params (storage_dtype and storage_range, see Storage). Scale and offset are 0 for the float types. Raises a ValueError for an unknown storage_dtype, or an integer one without a storage_range.
+	"""
+	name = params.get('storage_dtype', 'float32')
+	if name not in STORAGE_DTYPES:
+		raise ValueError("Unknown storage_dtype: %s (choose from %s)" % (name, ', '.join(STORAGE_DTYPES)))
+	dtype = np.dtype(name)
+	if dtype.kind == 'f':
+		return dtype, 0., 0.
+	value_range = params.get('storage_range')
+	if value_range is None or float(value_range[1]) <= float(value_range[0]):
+		raise ValueError("Quantized storage (%s) needs a storage_range [low, high]." % name)
+	return dtype, ((float(value_range[1]) - float(value_range[0])) / np.iinfo(dtype).max), float(value_range[0])
+
+
+def quantize(values, dtype, scale, offset):
+	"""
+	Convert float values for storage as dtype: rounded to the nearest multiple of scale above offset and clipped to the range of dtype (integer dtypes), or just cast (float dtypes, or a scale of 0). NaNs are stored as offset.
+	"""
+	dtype = np.dtype(dtype)
+	if scale == 0 or dtype.kind == 'f':
+		return np.asarray(values).astype(dtype)
+	q = np.rint((np.asarray(values, dtype='float32') - np.float32(offset)) / np.float32(scale))
+	q[np.isnan(q)] = 0
+	return np.clip(q, 0, np.iinfo(dtype).max).astype(dtype)
+
+
+def dequantize(values, scale, offset):
+	"""
+	Stored values back to float32: (values * scale) + offset, or just the cast if scale is 0.
+	"""
+	values = np.asarray(values, dtype='float32')
+	if scale == 0:
+		return values
+	return (values * np.float32(scale)) + np.float32(offset)
+
+
+class QuantizedFeatures(object):
+	"""
+	Read-only view of the records of a half-precision or quantized data file (see Storage), as float32. Looks like the underlying memmap (shape, ndim, len, indexing and slicing, reshape), but an index or slice returns a float32 array, and only the selected values are read and converted. The stored values are in the raw attribute.
+	"""
+	def __init__(self, raw, scale=0., offset=0.):
+		self.raw = raw
+		self.scale = float(scale)
+		self.offset = float(offset)
+		self.dtype = np.dtype('float32')
+
+	@property
+	def shape(self):
+		return self.raw.shape
+
+	@property
+	def ndim(self):
+		return self.raw.ndim
+
+	def __len__(self):
+		return len(self.raw)
+
+	def __getitem__(self, key):
+		return dequantize(self.raw[key], self.scale, self.offset)
+
+	def __array__(self, dtype=None):
+		values = self[:]
+		return values if dtype is None else values.astype(dtype)
+
+	def reshape(self, *shape):
+		return QuantizedFeatures(self.raw.reshape(*shape), self.scale, self.offset)
+
+
+class ProgressRecord(object):
+	"""
+	Checkpoint sidecar (JSON) for one analysis run: the number of analysis frames committed (committed_strides), whether the run is complete, the shape of the data file, the analysis parameters that determine the data, and the size and modification time of the movie file.
+
+	load() reads an existing record and returns True only if it belongs to the same run (same parameters, shape and movie file); save() rewrites it atomically.
+	"""
+	def __init__(self, path, params, movie_path, shape):
+		self.path = path
+		self.params = _normalize_params(params)
+		self.shape = [int(dim) for dim in shape]
+		self.movie_size, self.movie_mtime = None, None
+		if movie_path is not None and os.path.exists(movie_path):
+			stat = os.stat(movie_path)
+			self.movie_size, self.movie_mtime = stat.st_size, int(stat.st_mtime)
+		self.committed_strides = 0
+		self.complete = False
+
+	def load(self):
+		if not os.path.exists(self.path):
+			return False
+		try:
+			with open(self.path, 'r') as f:
+				record = json.load(f)
+		except ValueError:
+			return False
+		if (record.get('params') != self.params) or (record.get('shape') != self.shape) or (record.get('movie_size') != self.movie_size) or (record.get('movie_mtime') != self.movie_mtime):
+			return False
+		self.committed_strides = min(int(record.get('committed_strides', 0)), self.shape[0])
+		self.complete = bool(record.get('complete', False))
+		return True
+
+	def save(self, committed_strides=None, complete=False):
+		if committed_strides is not None:
+			self.committed_strides = int(committed_strides)
+		self.complete = complete
+		record = {
+			'committed_strides' : self.committed_strides,
+			'complete' : self.complete,
+			'shape' : self.shape,
+			'params' : self.params,
+			'movie_size' : self.movie_size,
+			'movie_mtime' : self.movie_mtime
+		}
+		tmp_path = self.path + '.tmp'
+		with open(tmp_path, 'w') as f:
+			json.dump(record, f, sort_keys=True)
+		os.rename(tmp_path, self.path)
+
+	def remove(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+
+def _normalize_params(params):
+	"""
+	The analysis parameters (without the runtime-only ones) as they come back from JSON, so that stored and current parameters compare equal.
+	"""
+	return json.loads(json.dumps(dict((k, v) for k, v in params.items() if k not in RUNTIME_PARAMS), sort_keys=True, default=str))
+
+
+class FeatureHeader(object):
+	"""
+	Header of a data file (see File format, above): version, dtype (a numpy dtype), record_shape (tuple), rows, stride, fps, frames, params_hash (hex string), data_offset, scale and offset of quantized values, and for chunk-compressed files chunk_rows (0 otherwise), codec and index_offset. Sparse files have the codec SPARSE_LAYOUT, and their row pointers at index_offset (see Sparse storage). The shape attribute is (rows,) + record_shape; nbytes is the size of the file that the header announces (for sparse files, up to the first entry). The version is 3 for sparse files, 2 for chunk-compressed files and 1 otherwise, unless given.
+	"""
+	def __init__(self, record_shape, rows, dtype='float32', stride=0, fps=0., frames=0, params_hash='', data_offset=HEADER_BYTES, version=None, scale=0., offset=0., chunk_rows=0, codec='', index_offset=0):
+		self.chunk_rows = int(chunk_rows)
+		self.codec = codec
+		self.index_offset = int(index_offset)
+		self.version = int(version) if version else (3 if codec == SPARSE_LAYOUT else (2 if self.chunk_rows > 0 else 1))
+		self.dtype = np.dtype(dtype)
+		self.record_shape = tuple(int(dim) for dim in record_shape)
+		self.rows = int(rows)
+		self.stride = int(stride)
+		self.fps = float(fps)
+		self.frames = int(frames)
+		self.params_hash = params_hash
+		self.data_offset = int(data_offset)
+		self.scale = float(scale)
+		self.offset = float(offset)
+		if len(self.record_shape) > MAX_RECORD_DIMS:
+			raise ValueError("Records can have at most %i dimensions: %s" % (MAX_RECORD_DIMS, self.record_shape))
+
+	@property
+	def shape(self):
+		return (self.rows,) + self.record_shape
+
+	@property
+	def converted(self):
+		"""
+		True if the stored values are not float32 (see QuantizedFeatures).
+		"""
+		return self.dtype != np.dtype('float32') or self.scale != 0
+
+	@property
+	def sparse(self):
+		"""
+		True for sparse (CSR) data files (see SparseFeatures).
+		"""
+		return self.codec == SPARSE_LAYOUT
+
+	@property
+	def chunks(self):
+		"""
+		Number of compressed chunks (0 for contiguous files).
+		"""
+		if self.chunk_rows <= 0:
+			return 0
+		return (self.rows + self.chunk_rows - 1) // self.chunk_rows
+
+	@property
+	def nbytes(self):
+		if self.chunk_rows > 0:
+			return self.index_offset + ((self.chunks + 1) * 8)
+		if self.sparse:
+			return self.data_offset
+		return self.data_offset + (self.rows * int(np.prod(self.record_shape)) * self.dtype.itemsize)
+
+	def pack(self):
+		"""
+		The header as HEADER_BYTES bytes (zero-padded).
+		"""
+		dims = list(self.record_shape) + ([0] * (MAX_RECORD_DIMS - len(self.record_shape)))
+		packed = _HEADER_STRUCT.pack(FEATURE_MAGIC, self.version, len(self.record_shape), self.dtype.str, *(dims + [self.rows, self.stride, self.fps, self.frames, self.params_hash.decode('hex'), self.data_offset, self.scale, self.offset, self.chunk_rows, self.codec, self.index_offset]))
+		return packed + ('\0' * (HEADER_BYTES - len(packed)))
+
+	@classmethod
+	def unpack(cls, buf):
+		"""
+		Parse a header from the first bytes of a data file. Returns None if they do not start with FEATURE_MAGIC (a headerless file); raises a ValueError if the header is truncated or of a later version.
+		"""
+		if not buf.startswith(FEATURE_MAGIC):
+			return None
+		if len(buf) < _HEADER_STRUCT.size:
+			raise ValueError("Truncated feature file header.")
+		fields = _HEADER_STRUCT.unpack(buf[:_HEADER_STRUCT.size])
+		version, ndim, dtype = fields[1], fields[2], fields[3].rstrip('\0')
+		if version > FORMAT_VERSION:
+			raise ValueError("Feature file format version %i is not supported (up to %i)." % (version, FORMAT_VERSION))
+		if ndim > MAX_RECORD_DIMS:
+			raise ValueError("Corrupt feature file header: %i record dimensions." % ndim)
+		rows, stride, fps, frames, digest, data_offset, scale, offset, chunk_rows, codec, index_offset = fields[(4 + MAX_RECORD_DIMS):]
+		if version < 2:
+			chunk_rows, codec, index_offset = 0, '', 0
+		return cls(fields[4:(4 + ndim)], rows, dtype, stride, fps, frames, (digest.encode('hex') if digest.strip('\0') else ''), data_offset, version, scale, offset, chunk_rows, codec.rstrip('\0'), index_offset)
+
+
+def params_hash(params):
+	"""
+	SHA-1 (hex) of the analysis parameters that determine the data, i.e. without the runtime-only ones (RUNTIME_PARAMS).
+	"""
+	return hashlib.sha1(json.dumps(_normalize_params(params), sort_keys=True)).hexdigest()
+
+
+def feature_header(shape, params, meta=None):
+	"""
+	Header for a new data file of the given shape (rows by record shape), with the stride, the storage format (see storage_format), the layout (sparse if sparse_storage is True, see Sparse storage) and the parameter hash taken from an analyzer's analysis_params, and the frame rate and frame count from the title's MovieMetadata (if given). Raises a ValueError for a bad storage format, or if chunk_frames asks for compression with a codec that is not available (so that the run fails before it starts, rather than when finish_feature_file compresses its data file).
+	"""
+	fps, frames = (meta.fps, meta.frames) if meta is not None else (0., 0)
+	dtype, scale, offset = storage_format(params)
+	if params.get('chunk_frames', 0) > 0 and params.get('chunk_codec', 'zlib') not in CODECS:
+		raise ValueError("Unknown or unavailable codec: %s (available: %s)" % (params.get('chunk_codec'), ', '.join(sorted(CODECS))))
+	if params.get('sparse_storage', False):
+		return FeatureHeader(shape[1:], shape[0], dtype, params.get('stride', 0), (fps or 0.), (frames or 0), params_hash(params), data_offset=(HEADER_BYTES + ((shape[0] + 1) * 8)), scale=scale, offset=offset, codec=SPARSE_LAYOUT, index_offset=HEADER_BYTES)
+	return FeatureHeader(shape[1:], shape[0], dtype, params.get('stride', 0), (fps or 0.), (frames or 0), params_hash(params), scale=scale, offset=offset)
+
+
+def read_feature_header(data_path):
+	"""
+	The FeatureHeader of a data file, or None if the file has no header (written by an earlier version of ACTION). Reads only the header; raises a ValueError if the header is corrupt or the file is shorter than the header says (an interrupted copy, say).
+	"""
+	with open(data_path, 'rb') as f:
+		header = FeatureHeader.unpack(f.read(_HEADER_STRUCT.size))
+	if header is not None and os.path.getsize(data_path) < header.nbytes:
+		raise ValueError("Truncated feature file: %s (%i bytes, header says %i)." % (data_path, os.path.getsize(data_path), header.nbytes))
+	return header
+
+
+def map_feature_file(data_path, record_shape=None, mode='r'):
+	"""
+	Memory-map the records of a data file: [rows] + record_shape. The record shape and number of rows come from the header; if record_shape is given as well, it has to match (a ValueError otherwise). Read-only maps of half-precision or quantized files are wrapped in QuantizedFeatures, which converts to float32 on access; writable ones (mode 'r+') are the raw memmap. Chunk-compressed files are returned as ChunkedFeatures (read-only; a ValueError for other modes), sparse files as SparseFeatures (writable with mode 'r+'). Headerless files are mapped as float32 from their first byte, with the given record_shape (required for them) and as many rows as fit. Raises an IOError if the file does not exist.
+	"""
+	header = read_feature_header(data_path)
+	if header is None:
+		if record_shape is None:
+			raise ValueError("Headerless feature file, record shape needed: %s" % data_path)
+		record_shape = tuple(int(dim) for dim in record_shape)
+		rows = os.path.getsize(data_path) // (int(np.prod(record_shape)) * np.dtype('float32').itemsize)
+		return np.memmap(data_path, dtype='float32', mode=mode, shape=((rows,) + record_shape))
+	if record_shape is not None and tuple(int(dim) for dim in record_shape) != header.record_shape:
+		raise ValueError("Record shape of %s is %s, not %s." % (data_path, header.record_shape, tuple(record_shape)))
+	if header.chunk_rows > 0:
+		if mode != 'r':
+			raise ValueError("Chunk-compressed feature files are read-only: %s" % data_path)
+		return ChunkedFeatures(data_path, header)
+	if header.sparse:
+		return SparseFeatures(data_path, header, mode)
+	fp = np.memmap(data_path, dtype=header.dtype, mode=mode, offset=header.data_offset, shape=header.shape)
+	if mode == 'r' and header.converted:
+		return QuantizedFeatures(fp, header.scale, header.offset)
+	return fp
+
+
+def create_feature_file(data_path, header):
+	"""
+	Create a data file (zeroed, sparse where the file system allows it) with the given header, and map its records for writing (r+). For a sparse header, the file has only empty rows, and the map is a writable SparseFeatures.
+	"""
+	with open(data_path, 'wb') as f:
+		f.write(header.pack())
+		f.truncate(header.nbytes)
+	if header.sparse:
+		return SparseFeatures(data_path, header, mode='r+')
+	return np.memmap(data_path, dtype=header.dtype, mode='r+', offset=header.data_offset, shape=header.shape)
+
+
+def open_feature_file(data_path, shape, progress, resume=False, header=None):
+	"""
+	Set up the memmap for an analysis run. If resume is True and the progress record matches this run (and the data file has the expected header and size), the data file is reopened in place (r+); otherwise a new data file is created and the progress record is reset. The new file gets the given header (see feature_header), or none at all if header is None. Returns the memmap and the first row that still has to be analyzed (progress.committed_strides). A complete run whose data file has been compressed in the meantime is left alone; the memmap is None then.
+	"""
+	if header is None:
+		nbytes = int(np.prod(shape)) * np.dtype('float32').itemsize
+		if resume and progress.load() and os.path.exists(data_path) and os.path.getsize(data_path) == nbytes:
+			return np.memmap(data_path, dtype='float32', mode='r+', shape=shape), progress.committed_strides
+		fp = np.memmap(data_path, dtype='float32', mode='w+', shape=shape)
+		progress.save(0)
+		return fp, 0
+	if resume and progress.load() and os.path.exists(data_path):
+		found = _header_or_none(data_path)
+		if _same_layout(found, header) and found.chunk_rows > 0 and progress.complete:
+			return None, progress.committed_strides
+		if _same_layout(found, header) and found.sparse:
+			return map_feature_file(data_path, header.record_shape, mode='r+'), progress.committed_strides
+		if _same_layout(found, header) and found.chunk_rows == 0 and os.path.getsize(data_path) == header.nbytes:
+			return map_feature_file(data_path, header.record_shape, mode='r+'), progress.committed_strides
+	fp = create_feature_file(data_path, header)
+	progress.save(0)
+	return fp, 0
+
+
+def _header_or_none(data_path):
+	try:
+		return read_feature_header(data_path)
+	except ValueError:
+		return None
+
+
+def _same_layout(found, expected):
+	"""
+	True if a data file's header describes the data of the expected one (same dtype, shape and parameters).
+	"""
+	return (found is not None) and (found.dtype == expected.dtype) and (found.shape == expected.shape) and (found.params_hash == expected.params_hash) and (found.data_offset == expected.data_offset) and (found.scale == expected.scale) and (found.offset == expected.offset) and (found.sparse == expected.sparse)
+
+
+def progress_path(data_path, shard=None):
+	"""
+	Path of the progress record of a data file (or of one of its shards).
+	"""
+	if shard is None:
+		return data_path + '.progress'
+	return data_path + ('.progress.%i' % shard)
+
+
+def analysis_incomplete(data_path):
+	"""
+	True if the data file has a progress record that is not marked complete, i.e. its run was interrupted and can be resumed. Data files without a progress record are considered complete.
+	"""
+	path = progress_path(data_path)
+	if not os.path.exists(path):
+		return False
+	try:
+		with open(path, 'r') as f:
+			return not json.load(f).get('complete', False)
+	except ValueError:
+		return True
+
+
+def compress_feature_file(data_path, chunk_rows=256, codec='zlib'):
+	"""
+	Rewrite a (contiguous) data file in place as a chunk-compressed one: chunks of chunk_rows records, each compressed on its own with codec (see CODECS), followed by the chunk index. Returns the new FeatureHeader. Files that are already chunk-compressed, and sparse files, are left alone. Raises a ValueError for headerless files and unavailable codecs.
+	"""
+	if codec not in CODECS:
+		raise ValueError("Unknown or unavailable codec: %s (available: %s)" % (codec, ', '.join(sorted(CODECS))))
+	header = read_feature_header(data_path)
+	if header is None:
+		raise ValueError("Only data files with a header can be compressed: %s" % data_path)
+	if header.chunk_rows > 0 or header.sparse:
+		return header
+	compress = CODECS[codec][0]
+	raw = np.memmap(data_path, dtype=header.dtype, mode='r', offset=header.data_offset, shape=header.shape)
+	chunked = copy.copy(header)
+	chunked.chunk_rows, chunked.codec, chunked.version, chunked.data_offset = int(chunk_rows), codec, 2, HEADER_BYTES
+	tmp_path = data_path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(chunked.pack())
+		offsets = [HEADER_BYTES]
+		for start in range(0, header.rows, chunked.chunk_rows):
+			f.write(compress(np.ascontiguousarray(raw[start:(start + chunked.chunk_rows)]).tobytes(), header.dtype.itemsize))
+			offsets.append(f.tell())
+		chunked.index_offset = f.tell()
+		f.write(np.array(offsets, dtype='<u8').tobytes())
+		f.seek(0)
+		f.write(chunked.pack())
+	del raw
+	os.rename(tmp_path, data_path)
+	return chunked
+
+
+def finish_feature_file(data_path, params):
+	"""
+	Called by the analyzers at the end of a complete run: compress the data file if the analysis parameters ask for it (chunk_frames > 0, with chunk_codec; see Compression) and it is not sparse.
+	"""
+	if params.get('chunk_frames', 0) > 0:
+		return compress_feature_file(data_path, params['chunk_frames'], params.get('chunk_codec', 'zlib'))
+	return None
+
+
+class ChunkedFeatures(object):
+	"""
+	Read-only view of the records of a chunk-compressed data file, as float32 (see Compression). Looks like a read-only memmap (shape, ndim, len, indexing and slicing, reshape); an index or slice decompresses only the chunks that hold the selected rows. The chunk index is read once, when the view is created; the last decompressed chunk is kept.
+	"""
+	def __init__(self, data_path, header):
+		self.data_path = data_path
+		self.header = header
+		self.record_shape = header.record_shape
+		self.dtype = np.dtype('float32')
+		self.decompress = CODECS[header.codec][1] if header.codec in CODECS else None
+		if self.decompress is None:
+			raise ValueError("Codec %s of %s is not available." % (header.codec, data_path))
+		with open(data_path, 'rb') as f:
+			f.seek(header.index_offset)
+			self.offsets = np.frombuffer(f.read((header.chunks + 1) * 8), dtype='<u8')
+		self._last = (None, None)
+
+	@property
+	def shape(self):
+		return (self.header.rows,) + self.record_shape
+
+	@property
+	def ndim(self):
+		return len(self.shape)
+
+	def __len__(self):
+		return self.header.rows
+
+	def __getitem__(self, key):
+		rest = ()
+		if isinstance(key, tuple):
+			key, rest = key[0], key[1:]
+		if isinstance(key, (int, long, np.integer)):
+			row = int(key) + (self.header.rows if key < 0 else 0)
+			if not (0 <= row < self.header.rows):
+				raise IndexError("Row %i out of range (%i rows)." % (key, self.header.rows))
+			values = self.rows(row, (row + 1))[0]
+		else:
+			index = np.arange(self.header.rows)[key]
+			if len(index) == 0:
+				values = np.zeros(((0,) + self.record_shape), dtype=self.header.dtype)
+			else:
+				lo = int(index.min())
+				values = self.rows(lo, (int(index.max()) + 1))[index - lo]
+			rest = (slice(None),) + rest if len(rest) > 0 else rest
+		if len(rest) > 0:
+			values = values[rest]
+		return dequantize(values, self.header.scale, self.header.offset)
+
+	def __array__(self, dtype=None):
+		values = self[:]
+		return values if dtype is None else values.astype(dtype)
+
+	def reshape(self, *shape):
+		"""
+		A view with another record shape (the number of rows, the first dimension, stays the same).
+		"""
+		if len(shape) == 1 and isinstance(shape[0], tuple):
+			shape = shape[0]
+		if shape[0] not in (-1, self.header.rows) or int(np.prod(shape[1:])) != int(np.prod(self.record_shape)):
+			raise ValueError("Cannot reshape %s to %s." % (self.shape, shape))
+		view = copy.copy(self)
+		view.record_shape = tuple(int(dim) for dim in shape[1:])
+		view._last = (None, None)
+		return view
+
+	def rows(self, start, stop):
+		"""
+		The stored (not dequantized) records start to stop, decompressing the chunks that hold them.
+		"""
+		chunk_rows = self.header.chunk_rows
+		first, last = (start // chunk_rows), ((stop - 1) // chunk_rows)
+		values = [self.chunk(c) for c in range(first, (last + 1))]
+		values = values[0] if len(values) == 1 else np.concatenate(values)
+		return values[(start - (first * chunk_rows)):(stop - (first * chunk_rows))]
+
+	def chunk(self, c):
+		"""
+		The stored records of chunk c.
+		"""
+		last = self._last
+		if last[0] == c:
+			return last[1]
+		with open(self.data_path, 'rb') as f:
+			f.seek(int(self.offsets[c]))
+			data = f.read(int(self.offsets[c + 1] - self.offsets[c]))
+		values = np.frombuffer(self.decompress(data), dtype=self.header.dtype).reshape(((-1,) + self.record_shape))
+		self._last = (c, values)
+		return values
+
+
+class SparseFeatures(object):
+	"""
+	The records of a sparse (CSR) data file, as float32 (see Sparse storage). Looks like a memmap (shape, ndim, len, indexing and slicing, reshape); an index or slice reads only the entries of the selected rows and densifies them, and csr returns a window as a scipy.sparse CSR matrix without densifying it. The row pointers are memory-mapped. Opened with mode 'r+', it also takes runs of rows by slice assignment (see __setitem__), so that a BufferedFeatureWriter writes to it as it would to a memmap.
+	"""
+	def __init__(self, data_path, header, mode='r'):
+		if mode not in ('r', 'r+'):
+			raise ValueError("Sparse feature files can only be opened with mode 'r' or 'r+': %s" % data_path)
+		self.data_path = data_path
+		self.header = header
+		self.record_shape = header.record_shape
+		self.width = int(np.prod(header.record_shape))
+		self.dtype = np.dtype('float32')
+		self.entry_dtype = np.dtype([('index', '<u4'), ('value', header.dtype)])
+		self.indptr = np.memmap(data_path, dtype='<i8', mode=mode, offset=header.index_offset, shape=((header.rows + 1),))
+		expected = header.data_offset + (self.nnz * self.entry_dtype.itemsize)
+		if os.path.getsize(data_path) < expected:
+			raise ValueError("Truncated feature file: %s (%i bytes, row pointers say %i)." % (data_path, os.path.getsize(data_path), expected))
+		self._file = open(data_path, 'r+b') if mode == 'r+' else None
+
+	@property
+	def shape(self):
+		return (self.header.rows,) + self.record_shape
+
+	@property
+	def ndim(self):
+		return len(self.shape)
+
+	@property
+	def nnz(self):
+		"""
+		Number of stored (non-zero) values.
+		"""
+		return int(self.indptr[-1])
+
+	def __len__(self):
+		return self.header.rows
+
+	def __getitem__(self, key):
+		rest = ()
+		if isinstance(key, tuple):
+			key, rest = key[0], key[1:]
+		if isinstance(key, (int, long, np.integer)):
+			row = int(key) + (self.header.rows if key < 0 else 0)
+			if not (0 <= row < self.header.rows):
+				raise IndexError("Row %i out of range (%i rows)." % (key, self.header.rows))
+			values = self.window(row, (row + 1))[0]
+		else:
+			index = np.arange(self.header.rows)[key]
+			if len(index) == 0:
+				values = np.zeros(((0,) + self.record_shape), dtype='float32')
+			else:
+				lo = int(index.min())
+				values = self.window(lo, (int(index.max()) + 1))[index - lo]
+			rest = (slice(None),) + rest if len(rest) > 0 else rest
+		if len(rest) > 0:
+			values = values[rest]
+		return values
+
+	def __setitem__(self, key, records):
+		"""
+		Write the records of the rows key.start to key.stop (mode 'r+' only): their non-zero values are appended to the entries of the rows before key.start, and the row pointers are updated. Rows are written in order: rows from key.start on that were written before are replaced (as when an interrupted run is resumed), and rows skipped since the last write stay empty.
+		"""
+		if self._file is None:
+			raise ValueError("Sparse feature file opened read-only: %s" % self.data_path)
+		if isinstance(key, (int, long, np.integer)):
+			key = slice(int(key), (int(key) + 1))
+		start, stop, step = key.indices(self.header.rows)
+		if step != 1:
+			raise ValueError("Sparse feature files are written in runs of contiguous rows.")
+		records = np.asarray(records, dtype='float32').reshape(((stop - start), self.width))
+		rows, cols = np.nonzero(records)
+		entries = np.zeros(len(rows), dtype=self.entry_dtype)
+		entries['index'] = cols
+		entries['value'] = quantize(records[rows, cols], self.header.dtype, self.header.scale, self.header.offset)
+		first, written = int(self.indptr[start]), self.nnz
+		self._file.seek(self.header.data_offset + (first * self.entry_dtype.itemsize))
+		self._file.write(entries.tobytes())
+		end = first + len(entries)
+		if written > first:
+			self._file.truncate(self.header.data_offset + (end * self.entry_dtype.itemsize))
+		# the entries reach the file before the row pointers that refer to them
+		self._file.flush()
+		self.indptr[(start + 1):(stop + 1)] = first + np.cumsum(np.bincount(rows, minlength=(stop - start)))
+		self.indptr[(stop + 1):] = end
+
+	def __array__(self, dtype=None):
+		values = self[:]
+		return values if dtype is None else values.astype(dtype)
+
+	def flush(self):
+		"""
+		Write the appended entries, and then the row pointers, to disk.
+		"""
+		if self._file is not None:
+			self._file.flush()
+			os.fsync(self._file.fileno())
+		self.indptr.flush()
+
+	def reshape(self, *shape):
+		"""
+		A view with another record shape (the number of rows, the first dimension, stays the same).
+		"""
+		if len(shape) == 1 and isinstance(shape[0], tuple):
+			shape = shape[0]
+		if shape[0] not in (-1, self.header.rows) or int(np.prod(shape[1:])) != self.width:
+			raise ValueError("Cannot reshape %s to %s." % (self.shape, shape))
+		view = copy.copy(self)
+		view.record_shape = tuple(int(dim) for dim in shape[1:])
+		return view
+
+	def window(self, start, stop):
+		"""
+		The records start to stop (clipped to the file), densified: a float32 array, [ROWS] + record shape.
+		"""
+		start, stop = self._clip(start, stop)
+		entries, counts = self._entries(start, stop)
+		values = np.zeros(((stop - start), self.width), dtype='float32')
+		if len(entries) > 0:
+			values[np.repeat(np.arange(stop - start), counts), entries['index']] = dequantize(entries['value'], self.header.scale, self.header.offset)
+		return values.reshape(((stop - start),) + self.record_shape)
+
+	def csr(self, start=0, stop=None):
+		"""
+		The records start to stop (all of them by default; clipped to the file) as a float32 scipy.sparse.csr_matrix, [ROWS, values per record]. Only the entries of these rows are read.
+		"""
+		start, stop = self._clip(start, stop)
+		entries, counts = self._entries(start, stop)
+		indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+		return sparse.csr_matrix((dequantize(entries['value'], self.header.scale, self.header.offset), entries['index'].astype(np.int32), indptr), shape=((stop - start), self.width))
+
+	def _clip(self, start, stop):
+		start, stop, step = slice(start, stop).indices(self.header.rows)
+		return start, max(stop, start)
+
+	def _entries(self, start, stop):
+		"""
+		The entries of the records start to stop, and the number of entries of each of them.
+		"""
+		pointers = np.array(self.indptr[start:(stop + 1)])
+		counts = np.diff(pointers)
+		n = int(pointers[-1] - pointers[0])
+		if n == 0:
+			return np.zeros(0, dtype=self.entry_dtype), counts
+		if self._file is not None:
+			self._file.flush()
+		with open(self.data_path, 'rb') as f:
+			f.seek(self.header.data_offset + (int(pointers[0]) * self.entry_dtype.itemsize))
+			entries = np.frombuffer(f.read(n * self.entry_dtype.itemsize), dtype=self.entry_dtype)
+		return entries, counts
@@ -0,0 +1,277 @@
+# framesource.py - frame acquisition strategies for video analysis
+# Bregman:ACTION - Cinematic information retrieval toolkit
+
+"""
+Part of Bregman:ACTION - Cinematic information retrieval toolkit
+
+Overview
+========
+
+Use a FrameSource to step through the frames of a movie at a given stride. All of the ACTION analyzers (ColorFeaturesLAB, PhaseCorrelation, OpticalFlow) read their frames through this class.
+
+There are two ways to acquire one frame out of every stride frames:
+
++------------+------------------------------------------------------------------------------+
+| access     | explanation                                                                  |
++============+==============================================================================+
+| sequential | seek once to the start frame, then decode straight through; the frames in    |
+|            | between strides are skipped with grab() (decoded, but never retrieved)       |
++------------+------------------------------------------------------------------------------+
+| seek       | seek to every stride frame; each seek restarts decoding at the preceding     |
+|            | keyframe, so this only pays off for sparse strides                           |
++------------+------------------------------------------------------------------------------+
+| auto       | (default) choose one of the above from the stride and the GOP size           |
++------------+------------------------------------------------------------------------------+
+
+With inter-coded movies, a seek has to decode on average half a GOP (group of pictures) worth of frames before it reaches the requested frame, so decoding straight through is cheaper whenever the stride is not larger than the GOP size.
+
+.. code-block:: python
+
+	capture = cv2.VideoCapture('Psycho.mov')
+	for frame_idx, frame in FrameSource(capture, start_frame=0, end_frame=2400, stride=6):
+		...
+
+Decoding and analysis can overlap: with a prefetch depth greater than zero, frames are decoded ahead of the analysis in a background thread (OpenCV releases the GIL while decoding) and handed off through a bounded queue. Use open_frame_source to get either kind of source:
+
+.. code-block:: python
+
+	frames = open_frame_source(capture, 0, 2400, stride=6, prefetch=8)
+	for frame_idx, frame in frames:
+		...
+
+Frames can be downscaled once, as they are decoded, before any of the analysis kernels see them (with area interpolation, which averages the source pixels instead of dropping them). Use analysis_frame_size to get the analysis frame size for an analysis_scale factor and/or a maximum frame dimension, and pass it to the source:
+
+.. code-block:: python
+
+	size = analysis_frame_size(1920, 1080, scale=0.5)
+	frames = open_frame_source(capture, 0, 2400, stride=6, size=size)
+
+Analyses of motion need more than one frame per stride. With a window greater than one, the source yields window consecutive frames, starting at every stride frame, and skips the rest of the stride as before (OpticalFlow uses this for its flow_window):
+
+.. code-block:: python
+
+	frames = open_frame_source(capture, 0, 2400, stride=6, window=2)	# frames 0, 1, 6, 7, 12, 13, ...
+
+A single film can also be split into contiguous shards of strides that are analyzed in separate processes (see split_frame_range and run_shards). Each shard opens its own capture and seeks once.
+
+"""
+__version__ = '1.0'
+__author__ = 'Thomas Stoll'
+__copyright__ = "Copyright (C) 2012  Michael Casey, Thomas Stoll, Dartmouth College, All Rights Reserved"
+__license__ = "gpl 2.0 or higher"
+__email__ = 'thomas.m.stoll@dartmouth.edu'
+
+import sys, threading, Queue, multiprocessing
+try:
+	import cv2
+	import cv2.cv as cv
+	HAVE_CV = True
+except ImportError:
+	HAVE_CV = False
+import numpy as np
+
+FRAME_ACCESS_MODES = ['auto', 'sequential', 'seek']
+_END_OF_FRAMES = None
+
+
+def choose_frame_access(stride, gop_size, access='auto'):
+	"""
+	Pick a frame acquisition strategy. Returns 'sequential' or 'seek'. An explicit access mode is returned unchanged; 'auto' seeks only when the stride is larger than the GOP size (for intra-only codecs, use gop_size=1).
+	"""
+	if access not in FRAME_ACCESS_MODES:
+		raise ValueError("Unknown frame access mode: %s" % access)
+	if access != 'auto':
+		return access
+	if stride > max(gop_size, 1):
+		return 'seek'
+	return 'sequential'
+
+
+def analysis_frame_size(frame_width, frame_height, scale=1.0, max_dim=0):
+	"""
+	Size (width, height) at which frames of the given size are analyzed: scaled by scale, and further down so that neither dimension exceeds max_dim (if max_dim > 0). Frames are never scaled up.
+	"""
+	factor = min(float(scale), 1.0)
+	if max_dim > 0 and (max(frame_width, frame_height) * factor) > max_dim:
+		factor = float(max_dim) / max(frame_width, frame_height)
+	return (max(int(round(frame_width * factor)), 1), max(int(round(frame_height * factor)), 1))
+
+
+def resize_frame(frame, size):
+	"""
+	Downscale a frame to size (width, height) with area interpolation; frames that already have that size are returned as they are.
+	"""
+	if size is None or (frame.shape[1], frame.shape[0]) == tuple(size):
+		return frame
+	return cv2.resize(frame, tuple(size), interpolation=cv2.INTER_AREA)
+
+
+class FrameSource(object):
+	"""
+	Iterable over (frame_idx, frame) tuples for the frames start_frame, start_frame + stride, ... up to (but not including) end_frame; with a window greater than one, for the window consecutive frames that start at each of those (window is capped at stride). If size (width, height) is given, every frame is resized to it as soon as it is decoded.
+
+	Iteration stops early if a frame cannot be decoded; in that case the frame_error attribute is set to True.
+	"""
+	def __init__(self, capture, start_frame=0, end_frame=-1, stride=1, access='auto', gop_size=12, size=None, window=1):
+		self.capture = capture
+		self.start_frame = int(start_frame)
+		self.end_frame = int(end_frame)
+		self.stride = max(int(stride), 1)
+		self.window = min(max(int(window), 1), self.stride)
+		self.access = choose_frame_access(self.stride, gop_size, access)
+		self.size = size
+		self.frame_error = False
+
+	def __iter__(self):
+		if self.access == 'seek':
+			return self._seek_frames()
+		else:
+			return self._sequential_frames()
+
+	def _sequential_frames(self):
+		"""
+		Seek once, then read the window of frames at the start of every stride and grab() past the rest.
+		"""
+		self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, self.start_frame)
+		frame_idx = self.start_frame
+		while frame_idx < self.end_frame:
+			reads = min(self.window, self.end_frame - frame_idx)
+			for offset in range(reads):
+				ret, frame = self.capture.read()
+				if frame is None:
+					self.frame_error = True
+					return
+				yield (frame_idx + offset), resize_frame(frame, self.size)
+			for skip in range(min(self.stride, self.end_frame - frame_idx) - reads):
+				if not self.capture.grab():
+					self.frame_error = True
+					return
+			frame_idx += self.stride
+
+	def _seek_frames(self):
+		"""
+		Seek to every stride frame (and read the rest of its window from there).
+		"""
+		for frame_idx in xrange(self.start_frame, self.end_frame, self.stride):
+			self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, frame_idx)
+			for offset in range(min(self.window, self.end_frame - frame_idx)):
+				ret, frame = self.capture.read()
+				if frame is None:
+					self.frame_error = True
+					return
+				yield (frame_idx + offset), resize_frame(frame, self.size)
+
+
+class PrefetchingFrameSource(object):
+	"""
+	Decode-ahead wrapper around a FrameSource. A background thread decodes up to depth frames ahead of the consumer and hands off (frame_idx, frame) tuples through a bounded queue. The thread shuts down when the source is exhausted (end_frame or a decode error), when an exception is raised while decoding (it is re-raised in the consuming thread), or when the consumer stops iterating early.
+	"""
+	def __init__(self, source, depth=8):
+		self.source = source
+		self.depth = max(int(depth), 1)
+		self.access = source.access
+		self._queue = None
+		self._thread = None
+		self._stop = threading.Event()
+		self._exc_info = None
+
+	@property
+	def frame_error(self):
+		return self.source.frame_error
+
+	def __iter__(self):
+		self._queue = Queue.Queue(maxsize=self.depth)
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._produce, name='action-frame-prefetch')
+		self._thread.daemon = True
+		self._thread.start()
+		try:
+			while True:
+				item = self._queue.get()
+				if item is _END_OF_FRAMES:
+					break
+				yield item
+			if self._exc_info is not None:
+				raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+		finally:
+			self.close()
+
+	def _put(self, item):
+		"""
+		Blocking put that gives up once the consumer has asked us to stop. Returns False in that case.
+		"""
+		while not self._stop.is_set():
+			try:
+				self._queue.put(item, timeout=0.1)
+				return True
+			except Queue.Full:
+				pass
+		return False
+
+	def _produce(self):
+		try:
+			for item in self.source:
+				if not self._put(item):
+					return
+		except Exception:
+			self._exc_info = sys.exc_info()
+		finally:
+			self._put(_END_OF_FRAMES)
+
+	def close(self):
+		"""
+		Stop the decoding thread and drop any frames still in the queue.
+		"""
+		self._stop.set()
+		if self._queue is not None:
+			while True:
+				try:
+					self._queue.get_nowait()
+				except Queue.Empty:
+					break
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+
+
+def open_frame_source(capture, start_frame=0, end_frame=-1, stride=1, access='auto', gop_size=12, prefetch=0, size=None, window=1):
+	"""
+	Return a FrameSource for the capture, wrapped in a PrefetchingFrameSource if prefetch (the number of frames to decode ahead) is greater than zero. With prefetching, frames are also resized (see size) in the background thread.
+	"""
+	source = FrameSource(capture, start_frame, end_frame, stride, access, gop_size, size, window)
+	if prefetch > 0:
+		return PrefetchingFrameSource(source, prefetch)
+	return source
+
+
+def blank_frames(start_frame, end_frame, stride, shape):
+	"""
+	Stand-in for a FrameSource when only the data file is present (playback without a movie): yields the same indices as a FrameSource, each with an empty (black) frame.
+	"""
+	frame = np.zeros(shape, np.uint8)
+	for frame_idx in xrange(int(start_frame), int(end_frame), max(int(stride), 1)):
+		frame[:] = 0
+		yield frame_idx, frame
+
+
+def split_frame_range(start_frame, end_frame, stride, shards):
+	"""
+	Split the strides in [start_frame, end_frame) into (at most) shards contiguous ranges of nearly equal length. Returns a list of (shard_start_frame, shard_end_frame) tuples; every boundary falls on a stride frame.
+	"""
+	stride = max(int(stride), 1)
+	shards = max(int(shards), 1)
+	num_strides = (int(end_frame) - int(start_frame) + stride - 1) // stride
+	bounds = [min(int(start_frame) + (stride * ((num_strides * k) // shards)), int(end_frame)) for k in range(shards + 1)]
+	return [(bounds[k], bounds[k+1]) for k in range(shards) if bounds[k+1] > bounds[k]]
+
+
+def run_shards(target, shard_args):
+	"""
+	Run target(*args) in a separate process for every args tuple in shard_args, and wait for all of them. The processes are forked, so target may be a bound method. Returns the list of indices of the shards that failed.
+	"""
+	procs = [multiprocessing.Process(target=target, args=args) for args in shard_args]
+	for proc in procs:
+		proc.start()
+	for proc in procs:
+		proc.join()
+	return [n for n, proc in enumerate(procs) if proc.exitcode != 0]
@@ -0,0 +1,209 @@
+# metadata.py - per-title movie metadata, read once and shared by the analyzers
+# Bregman:ACTION - Cinematic information retrieval toolkit
+
+"""
+Part of Bregman:ACTION - Cinematic information retrieval toolkit
+
+Overview
+========
+
+Every title has a JSON sidecar file (Psycho/Psycho.json) with the metadata of its movie: frame rate, frame count, frame size, aspect ratio and length, plus the layouts of the data files the analyzers have written (grid divisions, bins, the stride the data was analyzed at). The sidecar is written once, the first time a title is used with its movie present; this is the only time the movie is opened for its metadata.
+
+All of the ACTION analyzers (ColorFeaturesLAB, PhaseCorrelation, OpticalFlow, OpticalFlowTVL1) get the metadata of a title through movie_metadata, which parses the sidecar once per process and hands out the same MovieMetadata object to every analyzer of that title until the sidecar file changes (its modification time or size), or until the metadata is rewritten through this module:
+
+.. code-block:: python
+
+	meta = movie_metadata('/Volumes/ACTION/Psycho/Psycho.json', '/Volumes/ACTION/Psycho/Psycho.mov', 'Psycho')
+	print meta.fps, meta.frames, meta.width, meta.height, meta.aspect
+	print meta.layout('.color_lab')
+
+Sidecars written by older versions of ACTION have no frame size (and a wrong aspect ratio); they are rewritten once, from the movie, if the movie is present.
+
+The shape of a data file (number of analysis frames by the shape of one record) is likewise read once per data file, from its header (or, for headerless files, computed from the file size), and cached until the file changes; see data_file_shape.
+
+"""
+__version__ = '1.0'
+__author__ = 'Thomas Stoll'
+__copyright__ = "Copyright (C) 2012  Michael Casey, Thomas Stoll, Dartmouth College, All Rights Reserved"
+__license__ = "gpl 2.0 or higher"
+__email__ = 'thomas.m.stoll@dartmouth.edu'
+
+import os, json, threading
+try:
+	import cv2
+	import cv2.cv as cv
+	HAVE_CV = True
+except ImportError:
+	HAVE_CV = False
+import numpy as np
+from featurestore import read_feature_header
+
+# json_path -> (file stamp, MovieMetadata)
+_titles = {}
+# (data_path, record shape) -> (file stamp, data file shape)
+_data_shapes = {}
+_lock = threading.RLock()
+
+
+class MovieMetadata(object):
+	"""
+	Metadata of one title, as recorded in its JSON sidecar: title, fps, frames (frame count), width, height, aspect (width / height), length (in seconds), and layouts (per data extension, the layout of the data file the analyzer wrote). Values that are missing from the sidecar are None. Other keys of the sidecar can be read with metadata[key] or metadata.get(key).
+
+	MovieMetadata objects are shared between analyzers; treat them as read-only (use record_layout to change the layouts).
+	"""
+	def __init__(self, json_path, record):
+		self.json_path = json_path
+		self.record = record
+		self.title = record.get('title')
+		self.fps = record.get('fps')
+		self.frames = record.get('frames')
+		self.width = record.get('width')
+		self.height = record.get('height')
+		self.aspect = record.get('aspect')
+		self.length = record.get('length')
+		self.layouts = record.get('layouts', {})
+
+	def __getitem__(self, key):
+		return self.record[key]
+
+	def get(self, key, default=None):
+		return self.record.get(key, default)
+
+	def layout(self, data_extension):
+		"""
+		Layout recorded for the data file with the given extension (a copy; empty if none was recorded).
+		"""
+		return dict(self.layouts.get(data_extension, {}))
+
+	def analyzed_stride(self, data_extension):
+		"""
+		The stride the data file with the given extension was analyzed at, or None if it was not recorded.
+		"""
+		return self.layouts.get(data_extension, {}).get('stride')
+
+
+def movie_metadata(json_path, movie_path=None, title=None):
+	"""
+	Return the MovieMetadata of a title. The sidecar at json_path is parsed once and memoised until it changes on disk. If there is no sidecar yet (or it was written by an older version, without the frame size), it is written from the movie at movie_path first; in that case only, the movie is opened. Raises an IOError if neither the sidecar nor the movie is there.
+	"""
+	with _lock:
+		stamp = _file_stamp(json_path)
+		cached = _titles.get(json_path)
+		if stamp is not None and cached is not None and cached[0] == stamp:
+			return cached[1]
+		record = _read_json(json_path) if stamp is not None else None
+		have_mov = movie_path is not None and os.path.exists(movie_path)
+		if record is None or ('width' not in record and have_mov):
+			if not have_mov:
+				raise IOError("No metadata for %s: both the JSON file and the movie file are missing." % json_path)
+			return write_movie_metadata(json_path, movie_path, title)
+		meta = MovieMetadata(json_path, record)
+		_titles[json_path] = (stamp, meta)
+		return meta
+
+
+def write_movie_metadata(json_path, movie_path, title=None):
+	"""
+	Read the metadata of the movie at movie_path (frame rate, frame count and frame size) with OpenCV and write the sidecar at json_path, keeping the layouts already recorded there. Returns the new MovieMetadata.
+	"""
+	capture = cv2.VideoCapture(movie_path)
+	fps = capture.get(cv.CV_CAP_PROP_FPS)
+	frames = capture.get(cv.CV_CAP_PROP_FRAME_COUNT)
+	width = int(capture.get(cv.CV_CAP_PROP_FRAME_WIDTH))
+	height = int(capture.get(cv.CV_CAP_PROP_FRAME_HEIGHT))
+	capture.release()
+
+	with _lock:
+		record = _read_json(json_path) or {}
+		record.update({
+			'title' : title or record.get('title'),
+			'fps' : fps,
+			'frames' : frames,
+			'width' : width,
+			'height' : height,
+			'aspect' : (float(width) / height) if height > 0 else 0.,
+			'length' : (float(frames) / fps) if fps > 0 else 0.
+		})
+		record.setdefault('layouts', {})
+		return _write_json(json_path, record)
+
+
+def record_layout(json_path, data_extension, layout):
+	"""
+	Record (update) the layout of a data file in the sidecar, under 'layouts' and the data extension. Returns the new MovieMetadata.
+	"""
+	with _lock:
+		record = _read_json(json_path) or {}
+		layouts = record.setdefault('layouts', {})
+		layouts.setdefault(data_extension, {}).update(layout)
+		return _write_json(json_path, record)
+
+
+def data_file_shape(data_path, record_shape):
+	"""
+	Shape of a data file whose rows (analysis frames) have the shape record_shape: (rows,) + record_shape, as recorded in its header, or, for a headerless float32 file, with rows computed from the file size. Memoised until the file changes on disk. Returns None if the file does not exist; raises a ValueError if the header does not match record_shape.
+	"""
+	record_shape = tuple(int(dim) for dim in record_shape)
+	key = (data_path, record_shape)
+	with _lock:
+		stamp = _file_stamp(data_path)
+		if stamp is None:
+			return None
+		cached = _data_shapes.get(key)
+		if cached is not None and cached[0] == stamp:
+			return cached[1]
+		header = read_feature_header(data_path)
+		if header is None:
+			shape = (stamp[1] // (int(np.prod(record_shape)) * np.dtype('float32').itemsize),) + record_shape
+		elif header.record_shape == record_shape:
+			shape = header.shape
+		else:
+			raise ValueError("Record shape of %s is %s, not %s." % (data_path, header.record_shape, record_shape))
+		_data_shapes[key] = (stamp, shape)
+		return shape
+
+
+def forget_metadata(json_path=None):
+	"""
+	Drop the memoised metadata of one title (or of all titles, and all data file shapes, if json_path is None).
+	"""
+	with _lock:
+		if json_path is None:
+			_titles.clear()
+			_data_shapes.clear()
+		else:
+			_titles.pop(json_path, None)
+
+
+def _file_stamp(path):
+	"""
+	(modification time, size) of a file, or None if it does not exist.
+	"""
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return (stat.st_mtime, stat.st_size)
+
+
+def _read_json(path):
+	if not os.path.exists(path):
+		return None
+	try:
+		with open(path, 'r') as f:
+			return json.load(f)
+	except ValueError:
+		return None
+
+
+def _write_json(json_path, record):
+	"""
+	Write the sidecar atomically (tmp + rename) and memoise the new record under the new file stamp.
+	"""
+	tmp_path = json_path + '.tmp'
+	with open(tmp_path, 'w') as f:
+		f.write(json.dumps(record))
+	os.rename(tmp_path, json_path)
+	meta = MovieMetadata(json_path, record)
+	_titles[json_path] = (_file_stamp(json_path), meta)
+	return meta
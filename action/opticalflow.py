@@ -9,7 +9,7 @@ Overview
 
 Use the OpticalFlow class to generate analysis data of general motion on screen. A histogram of angular data is gathered. There are 64 bins for screen location and 8 bins for vectors' angles. 
 
-OpticalFlow analyzes all 24 frames for every second of each film. Users may later access the data with a skip parameter so that the amount of data is reduced, as it is in color_features...
+By default, OpticalFlow analyzes all 24 frames for every second of each film. Users may later access the data with a skip parameter so that the amount of data is reduced, as it is in color_features... Users who only ever read the data at a lower rate can analyze at that rate instead (see Advanced Use).
 
 OpticalFlow's central analysis algorithm is adapted from the lk_track example from the Python sample code provided with OpenCV.
 
@@ -55,6 +55,9 @@ The full list of settable parameters, with default values and explanations:
 | stride          | 1               | number of video frames to that comprise one        |
 |                 |                 | analysis frame, skips stride - 1 frames            |
 +-----------------+-----------------+----------------------------------------------------+
+| flow_window     | 0               | number of frame steps tracked at the start of each |
+|                 |                 | stride (see Advanced Use); 0: track every frame    |
++-----------------+-----------------+----------------------------------------------------+
 | threshold       | 0.0             | (empirical) threshold for histogram values; set to |
 |                 |                 | a positive number to remove extremely low values   |
 +-----------------+-----------------+----------------------------------------------------+
@@ -64,6 +67,42 @@ The full list of settable parameters, with default values and explanations:
 +-----------------+-----------------+----------------------------------------------------+
 | theta_divs      | 8               | number of divisions of angle data                  |
 +-----------------+-----------------+----------------------------------------------------+
+| frame_access    | auto            | 'sequential', 'seek' or 'auto' (see framesource);  |
+|                 |                 | continuous tracking reads every frame (sequential) |
++-----------------+-----------------+----------------------------------------------------+
+| gop_size        | 12              | keyframe interval of the movie                     |
++-----------------+-----------------+----------------------------------------------------+
+| prefetch        | 8               | number of frames decoded ahead in a background     |
+|                 |                 | thread; 0 decodes in the analysis thread           |
++-----------------+-----------------+----------------------------------------------------+
+| buffer_frames   | 64              | number of analysis frames buffered in RAM and      |
+|                 |                 | written to the data file in one slice              |
++-----------------+-----------------+----------------------------------------------------+
+| flush_frames    | 0               | flush the data file to disk every flush_frames     |
+|                 |                 | analysis frames (0: never)                         |
++-----------------+-----------------+----------------------------------------------------+
+| flush_secs      | 60.0            | flush the data file to disk every flush_secs       |
+|                 |                 | seconds (0: never; both 0: only at the end)        |
++-----------------+-----------------+----------------------------------------------------+
+| storage_dtype   | 'float32'       | 'float32', 'float16', 'uint16' or 'uint8': how the |
+|                 |                 | data file stores the values (see featurestore)     |
++-----------------+-----------------+----------------------------------------------------+
+| storage_range   | None            | range of the values for uint8/uint16 storage       |
+|                 |                 | (required for them; values outside are clipped)    |
++-----------------+-----------------+----------------------------------------------------+
+| chunk_frames    | 0               | compress the data file at the end of the analysis, |
+|                 |                 | in chunks of this many analysis frames (0: never;  |
+|                 |                 | see featurestore)                                  |
++-----------------+-----------------+----------------------------------------------------+
+| chunk_codec     | 'zlib'          | 'zlib', 'bz2', 'lzma' or 'blosc' (if installed)    |
++-----------------+-----------------+----------------------------------------------------+
+| sparse_storage  | False           | store only the non-zero bins (CSR, see             |
+|                 |                 | featurestore); the data file then grows with the   |
+|                 |                 | amount of motion, not with the length of the film  |
++-----------------+-----------------+----------------------------------------------------+
+| resume          | False           | continue an interrupted analysis after its last    |
+|                 |                 | committed stride (see featurestore)                |
++-----------------+-----------------+----------------------------------------------------+
 | verbose         | True            | useful for debugging                               |
 +-----------------+-----------------+----------------------------------------------------+
 | display         | True            | launch display screen during analysis              |
@@ -88,6 +127,19 @@ The full list of settable parameters, with default values and explanations:
 +-----------------+-----------------+                                                    |
 | trackDepth      | 9               |                                                    |
 +-----------------+-----------------+----------------------------------------------------+
+| flow_backend    | lk              | 'lk': Lucas-Kanade tracks of corners (above);      |
+|                 |                 | 'farneback' or 'dis': dense flow (see DenseFlow)   |
++-----------------+-----------------+----------------------------------------------------+
+| dense_max_dim   | 320             | dense flow is computed on frames downscaled so that|
+|                 |                 | no side is longer (0: full size)                   |
++-----------------+-----------------+----------------------------------------------------+
+| dense_min_      | 1.0             | dense flow vectors up to this long (full-resolution|
+| magnitude       |                 | pixels per frame) count zero                       |
++-----------------+-----------------+----------------------------------------------------+
+| farneback_params| {}              | overrides for cv2.calcOpticalFlowFarneback         |
++-----------------+-----------------+----------------------------------------------------+
+| dis_preset      | medium          | 'ultrafast', 'fast' or 'medium' (OpenCV 3.4+)      |
++-----------------+-----------------+----------------------------------------------------+
 
 Upon creation of an OpticalFlow object, parameter keywords can be passed explicitly as formal arguments or as a keyword argument parameter dict:, e.g.:
 
@@ -156,7 +208,24 @@ There is a default stride time of 1 frames (so, actually, no striding), unless o
 
 	oflow = OpticalFlow('Psycho', stride=6)
 	
-*Very important*: It does not make sense to skip frames when analyzing, only when accessing. Also, since optical flow is based on comparisons between consecutive frames (in our case we are limiting ourselves to first-order differences) we are comparing *all* frames in the movie, even though we then 'stride' forward to the next analysis frame upon access.  Note that choosing 'stride' values that are not factors of 24 will result in analysis rates that do not fit neatly into one second periods.
+Only one histogram is written per stride, but since optical flow is based on comparisons between consecutive frames (in our case we are limiting ourselves to first-order differences) we are, by default, still tracking through *all* frames in the movie. Note that choosing 'stride' values that are not factors of 24 will result in analysis rates that do not fit neatly into one second periods.
+
+To cut the analysis time as well, set flow_window: then only the first flow_window + 1 frames of every stride are read and compared. Corners are detected on the stride frame and tracked through the flow_window frames after it; the histogram of the stride is made from the accumulated motion of those tracks (with a dense flow_backend, the histograms of the flow_window consecutive frame pairs are added up). The rest of the stride is skipped (or not decoded at all, with 'seek' frame access). flow_window is capped at stride - 1:
+
+.. code-block:: python
+
+	oflow = OpticalFlow('Psycho', stride=6, flow_window=2)	# 4 histograms per second, each from 3 consecutive frames
+	oflow.analyze_movie()
+
+The stride is recorded with the data file's layout in the title's JSON file. The accessors take access_stride in video frames (at 24 frames per second) whatever the analysis stride was, so for data analyzed at stride=6, access_stride=6 returns every record of the data file, and the results have the same shape as those of an analysis at stride=1.
+
+Most histograms are almost all zeros: only the bins of the cells with corners that moved more than 5 pixels are filled, and frames without tracks are written as zeros. With sparse_storage, only the non-zero bins are stored (see the Sparse storage section of featurestore), so the data file, and the reads of a segment, scale with the amount of motion in the film. The accessors work on sparse data files as before, densifying only the window they read; sparse_opticalflow_features_for_segment returns the raw histograms of a segment as a scipy.sparse matrix instead:
+
+.. code-block:: python
+
+	oflow = OpticalFlow('Psycho', sparse_storage=True)
+	oflow.analyze_movie()
+	X = oflow.sparse_opticalflow_features_for_segment(Segment(60, 600), access_stride=6)	# [2400, 512] CSR matrix
 
 """
 
@@ -168,25 +237,196 @@ __email__ = 'thomas.m.stoll@dartmouth.edu'
 
 
 import sys, time, os, math, glob
+from actionlog import *
+_log = get_logger(__name__)
 # import the necessary things for OpenCV
 try:
 	import cv2
 	import cv2.cv as cv
 	HAVE_CV = True
 except ImportError:
-	print 'WARNING: Access only, use of methods other than *_opticalflow_features_for_segment, etc. will cause errors! Install OpenCV to perform analysis and display movies/data.'
+	_log.warning('Access only, use of methods other than *_opticalflow_features_for_segment, etc. will cause errors! Install OpenCV to perform analysis and display movies/data.')
 	HAVE_CV = False
 import numpy as np
+from scipy import sparse
 import json
 from segment import *
 from actiondata import *
+from framesource import *
+from featurestore import *
+from metadata import *
+from featurecache import *
+from regions import *
 ad = ActionData()
 av = ActionView()
 
 QPI = math.pi / 4.0
 
 
-class OpticalFlow:
+def motion_histogram(x, y, dx, dy, grid_width, grid_height, grid_divs_x=8, grid_divs_y=8, theta_divs=8, min_magnitude=5.0, cells=None):
+	"""
+	Magnitude-weighted histogram of the motion vectors (dx, dy) that start at the positions (x, y), with one bin per grid cell and direction: [CELLS (grid_divs_x * grid_divs_y, row by row) * DIRECTIONS (theta_divs)]. The direction bins cover (-pi, pi] in equal steps. Vectors of min_magnitude pixels or less count zero; vectors that start outside the grid are dropped. Computed in one bincount; the bins are the same as those of np.histogram(bins, num_bins, (0, num_bins)).
+	
+	Both backends of OpticalFlow use this function: the tracks of the Lucas-Kanade tracker, and the flow fields of the dense backends, which pass the (precomputed) cell of every vector as cells instead of the positions and the grid size.
+	"""
+	num_bins = grid_divs_x * grid_divs_y * theta_divs
+	mags = np.sqrt((dx * dx) + (dy * dy))
+	weighted = np.where(mags > min_magnitude, mags, 0.0)
+	theta_vals = np.floor_divide(np.arctan2(dy, dx) + math.pi, ((2.0 * math.pi) / theta_divs))
+	if cells is None:
+		cells = (np.floor(y / grid_height) * grid_divs_x) + np.floor(x / grid_width)
+	combo_bins = (cells * theta_divs) + theta_vals
+	# as with np.histogram, a value on the right edge falls into the last bin
+	inside = (combo_bins >= 0) & (combo_bins <= num_bins)
+	bins = np.minimum(combo_bins[inside], (num_bins - 1)).astype(np.intp)
+	return np.bincount(bins, weights=weighted[inside], minlength=num_bins).astype('float32')
+
+
+class TrackBuffer(object):
+	"""
+	Lucas-Kanade point tracks, kept in a preallocated ring buffer: points[slot, position] holds the (x, y) points of up to capacity tracks of at most track_length points each. All live tracks advance together, one point per frame, so a single head position (where the newest point of every track is) serves all of them; lengths counts the points of each track and valid marks the slots in use. When more tracks are alive than there are slots, the buffer doubles.
+	"""
+	def __init__(self, track_length=10, capacity=256):
+		self.track_length = max(int(track_length), 1)
+		capacity = max(int(capacity), 1)
+		self.points = np.zeros((capacity, self.track_length, 2), dtype='float32')
+		self.lengths = np.zeros(capacity, dtype=np.intp)
+		self.valid = np.zeros(capacity, dtype=bool)
+		self.head = 0
+	
+	def __len__(self):
+		return int(np.count_nonzero(self.valid))
+	
+	def slots(self):
+		"""
+		Slots of the live tracks.
+		"""
+		return np.flatnonzero(self.valid)
+	
+	def heads(self, slots=None):
+		"""
+		Newest point of each live track (or of the tracks in slots): [TRACKS, 2].
+		"""
+		if slots is None:
+			slots = self.slots()
+		return self.points[slots, self.head]
+	
+	def advance(self, slots, new_points, keep):
+		"""
+		Append new_points ([len(slots), 2]) to the tracks in slots, dropping the oldest point of tracks that are full, and end the tracks for which keep is False.
+		"""
+		self.valid[slots[~keep]] = False
+		kept = slots[keep]
+		self.head = (self.head + 1) % self.track_length
+		self.points[kept, self.head] = new_points[keep]
+		self.lengths[kept] = np.minimum(self.lengths[kept] + 1, self.track_length)
+	
+	def add(self, new_points):
+		"""
+		Start a new track at each of new_points ([N, 2]).
+		"""
+		free = np.flatnonzero(~self.valid)
+		if len(free) < len(new_points):
+			self._grow(len(self) + len(new_points))
+			free = np.flatnonzero(~self.valid)
+		slots = free[:len(new_points)]
+		self.points[slots, self.head] = new_points
+		self.lengths[slots] = 1
+		self.valid[slots] = True
+	
+	def clear(self):
+		"""
+		End all tracks.
+		"""
+		self.valid[:] = False
+		self.lengths[:] = 0
+	
+	def displacements(self, depth):
+		"""
+		For every live track, the point depth steps after its oldest one (or its newest point, if the track is shorter) and its oldest point: two [TRACKS, 2] arrays.
+		"""
+		slots = self.slots()
+		lengths = self.lengths[slots]
+		oldest = (self.head - lengths + 1) % self.track_length
+		later = (oldest + np.minimum(lengths - 1, depth)) % self.track_length
+		return self.points[slots, later], self.points[slots, oldest]
+	
+	def polylines(self):
+		"""
+		The live tracks as int32 point lists (oldest point first), for drawing.
+		"""
+		lines = []
+		for slot in self.slots():
+			positions = (self.head - self.lengths[slot] + 1 + np.arange(self.lengths[slot])) % self.track_length
+			lines.append(np.int32(self.points[slot, positions]))
+		return lines
+	
+	def _grow(self, needed):
+		capacity = self.points.shape[0]
+		while capacity < needed:
+			capacity *= 2
+		extra = capacity - self.points.shape[0]
+		self.points = np.concatenate((self.points, np.zeros(((extra,) + self.points.shape[1:]), dtype='float32')))
+		self.lengths = np.concatenate((self.lengths, np.zeros(extra, dtype=np.intp)))
+		self.valid = np.concatenate((self.valid, np.zeros(extra, dtype=bool)))
+
+
+class DenseFlow(object):
+	"""
+	Dense optical flow backend: computes the flow field between two grayscale frames with Farneback's algorithm ('farneback') or DIS optical flow ('dis', OpenCV 3.4 or later) and reduces it to a motion histogram (see motion_histogram) over the whole field in one pass.
+	
+	The flow is computed on copies of the frames that are downscaled (with area interpolation) so that neither side is longer than max_dim pixels (0: full size); the vectors are scaled back to full-resolution pixels before min_magnitude is applied. The grid cell of every pixel of the downscaled frame is computed once per frame size.
+	"""
+	def __init__(self, method='farneback', grid_divs_x=8, grid_divs_y=8, theta_divs=8, max_dim=320, min_magnitude=1.0, farneback_params=None, dis_preset='medium'):
+		if method not in ['farneback', 'dis']:
+			raise ValueError("Unknown dense flow method: %s" % method)
+		self.method = method
+		self.grid_divs_x = grid_divs_x
+		self.grid_divs_y = grid_divs_y
+		self.theta_divs = theta_divs
+		self.max_dim = max_dim
+		self.min_magnitude = min_magnitude
+		self.farneback_params = dict({'pyr_scale' : 0.5, 'levels' : 3, 'winsize' : 15, 'iterations' : 3, 'poly_n' : 5, 'poly_sigma' : 1.2, 'flags' : 0}, **(farneback_params or {}))
+		self.dis = None
+		if method == 'dis':
+			if not hasattr(cv2, 'DISOpticalFlow_create'):
+				raise ValueError("DIS optical flow needs OpenCV 3.4 or later; use the 'farneback' backend instead.")
+			presets = {'ultrafast' : 0, 'fast' : 1, 'medium' : 2}
+			self.dis = cv2.DISOpticalFlow_create(presets.get(dis_preset, dis_preset))
+		self.size = None
+		self.scale = 1.0
+		self.cells = None
+	
+	def prepare(self, frame_gray):
+		"""
+		Downscaled copy of a grayscale frame, as the flow is computed on it.
+		"""
+		if self.size is None:
+			height, width = frame_gray.shape[:2]
+			self.size = analysis_frame_size(width, height, 1.0, self.max_dim)
+			self.scale = float(self.size[0]) / width
+			cols = (np.arange(self.size[0]) * self.grid_divs_x) // self.size[0]
+			rows = (np.arange(self.size[1]) * self.grid_divs_y) // self.size[1]
+			self.cells = ((rows[:, np.newaxis] * self.grid_divs_x) + cols[np.newaxis, :]).astype('float32').reshape(-1)
+		return resize_frame(frame_gray, self.size)
+	
+	def flow(self, prev_small, small):
+		"""
+		Flow field ([HEIGHT, WIDTH, 2], in downscaled pixels) from one prepared frame to the next.
+		"""
+		if self.dis is not None:
+			return self.dis.calc(prev_small, small, None)
+		return cv2.calcOpticalFlowFarneback(prev_small, small, flow=None, **self.farneback_params)
+	
+	def histogram(self, prev_small, small):
+		"""
+		Motion histogram ([CELLS * DIRECTIONS]) of the flow from one prepared frame to the next.
+		"""
+		field = self.flow(prev_small, small).reshape(-1, 2) / self.scale
+		return motion_histogram(None, None, field[:,0], field[:,1], None, None, self.grid_divs_x, self.grid_divs_y, self.theta_divs, self.min_magnitude, cells=self.cells)
+
+
+class OpticalFlow(object):
 	"""
 	Optical flow analysis of consecutive frames (see note above on stride parameter) using a Lucas-Kanade optical flow algorithm operating tracked features (corner detector) of monochrome image data.
 	
@@ -211,17 +451,17 @@ class OpticalFlow:
 		ap = self.analysis_params
 		
 		if filename is None:
-			print 'File name missing!'
+			_log.error('File name missing!')
 			return
 		else:
 			self.movie_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + ap['movie_extension']))
 			self.data_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + ap['data_extension']))
 			self.json_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + '.json'))
-			print self.json_path
+			_log.debug('JSON file: %s', self.json_path)
 			self.filename = filename
 		
 		# additional OpticalFlow-specific parameters and data structures...
-		self.tracks = []
+		self.tracks = TrackBuffer(ap['trackLength'], (4 * ap['maxCorners']))
 		self.frame_idx = 0
 		
 		self.lk_params = dict( winSize = ap['winSize'],
@@ -233,20 +473,44 @@ class OpticalFlow:
 								minDistance = ap['minDistance'],
 								blockSize = ap['blockSize'])
 		
-		# self.determine_movie_length() no need
- 		if (os.path.exists(self.json_path) != True):
- 			self._write_metadata_to_json()
-		ap['afps'] = self._read_json_value('fps')
-		
-		# try to naively get some data and store in a class var
-		if os.path.exists(self.data_path):
-			self.default_opticalflow_features_for_segment()	
+		# metadata and default features are loaded lazily (see _load_metadata and X)
+		self._afps = None
+		self._X = None
+	
+	def _load_metadata(self):
+		"""
+		Set the access frame rate (afps) from the title's metadata (see metadata). Done on first use, and not at construction time, since the metadata may have to be read from the movie; later calls only check that the JSON file has not changed. If neither the JSON file nor the movie is there, but the data file is, afps comes from the data file's header instead (and stays at the afps parameter for a headerless file), so that the features can be read without the movie.
+		"""
+		if os.path.exists(self.json_path) or (os.path.exists(self.movie_path) and HAVE_CV) or not os.path.exists(self.data_path):
+			self._afps = self.metadata().fps
+		else:
+			header = read_feature_header(self.data_path)
+			if header is None or header.fps <= 0:
+				return
+			self._afps = header.fps
+		self.analysis_params['afps'] = self._afps
+	
+	def _get_X(self):
+		if self._X is None and os.path.exists(self.data_path):
+			self.default_opticalflow_features_for_segment()
+		return self._X
+	
+	def _set_X(self, X):
+		self._X = X
+	
+	def _del_X(self):
+		self._X = None
+	
+	X = property(_get_X, _set_X, _del_X, doc="Default features of the title (see default_opticalflow_features_for_segment), loaded from the data file on first access and cached. Accessor functions replace them with the features they return; del oflow.X releases them.")
 	
 	def _check_opticalflow_params(self, analysis_params=None):
 		"""
-		Simple mechanism to read in default parameters while substituting custom parameters.
+		Simple mechanism to read in default parameters while substituting custom parameters. The custom parameters are merged into the current ones (those passed to the constructor and to earlier calls), so that a call like analyze_movie only overrides the parameters it passes; missing ones are filled in from the defaults.
 		"""
-		self.analysis_params = analysis_params if analysis_params is not None else self.analysis_params
+		if not hasattr(self, 'analysis_params'):
+			self.analysis_params = {}
+		if analysis_params is not None:
+			self.analysis_params.update(analysis_params)
 		dofp = self.default_opticalflow_params()
 		for k in dofp.keys():
 			self.analysis_params[k] = self.analysis_params.get(k, dofp[k])
@@ -267,6 +531,19 @@ class OpticalFlow:
 			'offset' : 0,						# time offset (in seconds) into film
 			'duration' : -1,					# duration (in seconds) of segment, -1 maps to full duration of media
 			'stride' : 1,						# stride is set to 1
+			'flow_window' : 0,					# track only this many frame steps at the start of every stride (0: track through every frame)
+			'frame_access' : 'auto',			# 'auto', 'sequential' or 'seek' (see framesource); continuous tracking (flow_window 0) reads every frame
+			'gop_size' : 12,					# keyframe interval of the movie files, used by 'auto' frame access
+			'prefetch' : 8,						# number of frames to decode ahead in a background thread, 0 to decode in the analysis thread
+			'buffer_frames' : 64,				# number of analysis frames buffered in RAM before they are written to the data file
+			'flush_frames' : 0,					# flush the data file every flush_frames analysis frames (0: never)
+			'flush_secs' : 60.0,				# flush the data file every flush_secs seconds (0: never; with both 0, only at the end)
+			'storage_dtype' : 'float32',		# 'float32', 'float16', 'uint16' or 'uint8' (see featurestore)
+			'storage_range' : None,				# [low, high] of the values, for uint16 and uint8 storage
+			'chunk_frames' : 0,					# compress the data file in chunks of this many analysis frames when the analysis is complete (0: never)
+			'chunk_codec' : 'zlib',				# 'zlib', 'bz2', 'lzma' or 'blosc' (if installed)
+			'sparse_storage' : False,			# store only the non-zero bins of the histograms (CSR; see featurestore)
+			'resume' : False,					# continue an interrupted analysis run from its progress record
 			'winSize' : (15, 15),				# @ full resolution, must be odd & square
 			'maxLevel' : 2,						# how many Pyramids (downsampling stages)
 			'criteria' : (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
@@ -276,6 +553,11 @@ class OpticalFlow:
 			'blockSize' : 7,
 			'trackLength' : 10,
 			'trackDepth' : 9,
+			'flow_backend' : 'lk',				# 'lk' (tracked corners), or dense flow: 'farneback' or 'dis' (OpenCV 3.4 or later)
+			'dense_max_dim' : 320,				# dense flow is computed on frames downscaled to at most this many pixels on a side (0: full size)
+			'dense_min_magnitude' : 1.0,		# dense flow vectors up to this long (in full-resolution pixels per frame) count zero
+			'farneback_params' : {},			# overrides for cv2.calcOpticalFlowFarneback (pyr_scale, levels, winsize, iterations, poly_n, poly_sigma, flags)
+			'dis_preset' : 'medium',			# 'ultrafast', 'fast' or 'medium'
 			'verbose' : False,			# useful for debugging
 			'display' : True,			# Launch display screen
 			'hist_shrink_factor' : 0.5,	# (adjustable) ratio for size of histogram window
@@ -287,33 +569,31 @@ class OpticalFlow:
 		}
 		return analysis_params
 	
+	def metadata(self):
+		"""
+		The title's MovieMetadata (fps, frames, width, height, aspect, length and data layouts; see the metadata module). Read from the title's JSON file once and shared with the other analyzers of the title; the movie is only opened if the JSON file does not exist yet.
+		"""
+		return movie_metadata(self.json_path, self.movie_path, self.filename)
+	
 	def _write_metadata_to_json(self):
 		"""
+		(Re)write the title's JSON file from the movie, keeping the data layouts recorded there.
 		"""
-		title = self.filename
-		capture = cv2.VideoCapture(self.movie_path)
-		fps = capture.get(cv.CV_CAP_PROP_FPS)
-		aspect = capture.get(cv.CV_CAP_PROP_FRAME_WIDTH / cv.CV_CAP_PROP_FRAME_HEIGHT)
-		frames = capture.get(cv.CV_CAP_PROP_FRAME_COUNT)
-		length = float(frames) / float(fps)
-		
-		
-		movdict = {'title':title, 'fps':fps, 'aspect': aspect,'frames': frames, 'length':length}
-		fp = file(self.json_path, 'w')
-		fp.write(json.dumps(movdict))
-		fp.close()
-		del capture
+		write_movie_metadata(self.json_path, self.movie_path, self.filename)
 		return 1
 	
 	def _read_json_value(self, key='fps'):
-		"""
-		"""
-		jsonfile = open(self.json_path)
-		jsondata = json.load(jsonfile)
-		return jsondata[key]
+		return self.metadata()[key]
 	
 # NOTE THAT THERE IS NO <<FULL>> ACCESS FUNCTION.
 
+	def _region_selector(self, name):
+		"""
+		The named region selector (see regions) compiled for the analysis grid (grid_divs_x by grid_divs_y).
+		"""
+		ap = self.analysis_params
+		return region_selector(name, ap['grid_divs_x'], ap['grid_divs_y'])
+	
 	def gridded_opticalflow_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
 		"""
 		Return the gridded histograms (all 64 bins) in the following order:
@@ -334,7 +614,8 @@ class OpticalFlow:
 			opticalflow_features_for_segment(...)[1].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._opticalflow_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration).reshape(-1, 512)[0:-1:access_stride]
+		selector = self._region_selector('gridded')
+		self.X = self._cached_segment_features('gridded', segment.time_span.start_time, segment.time_span.duration, access_stride, lambda res, step: selector.select(self._cell_histograms(res), step, drop_last=True))
 		return self.X
 	
 	def center_quad_opticalflow_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
@@ -355,8 +636,8 @@ class OpticalFlow:
 			opticalflow_features_for_segment(...)[1][:,[18..21,26..29,34..37,42..45,..],...].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		cq_array = range((18*8),(22*8))+range((26*8),(30*8))+range((34*8),(38*8))+range((42*8),(46*8))
-		self.X = self._opticalflow_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[:,cq_array,...].reshape(-1, 128)[0:-1:access_stride]
+		selector = self._region_selector('center_quad')
+		self.X = self._cached_segment_features('center_quad', segment.time_span.start_time, segment.time_span.duration, access_stride, lambda res, step: selector.select(self._cell_histograms(res), step, drop_last=True))
 		return self.X
 
 	def middle_band_opticalflow_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
@@ -377,7 +658,8 @@ class OpticalFlow:
 			opticalflow_features_for_segment(...)[1][:,16:47,...].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._opticalflow_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[:,(16*8):(48*8),...].reshape(-1, 256)[0:-1:access_stride]
+		selector = self._region_selector('middle_band')
+		self.X = self._cached_segment_features('middle_band', int(segment.time_span.start_time), int(segment.time_span.duration), access_stride, lambda res, step: selector.select(self._cell_histograms(res), step, drop_last=True))
 		return self.X
 	
 	def plus_band_opticalflow_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
@@ -400,10 +682,30 @@ class OpticalFlow:
 			opticalflow_features_for_segment(...)[1][:,[2..5,10..13,16..47,50..53,58..61],...].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		plus_array = range((2*8),(6*8))+range((10*8),(14*8))+range((16*8),(48*8))+range((50*8),(54*8))+range((58*8),(62*8))
-		return self._opticalflow_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[:,plus_array,...].reshape(-1, 384)[0:-1:access_stride]
+		selector = self._region_selector('plus_band')
+		self.X = self._cached_segment_features('plus_band', segment.time_span.start_time, segment.time_span.duration, access_stride, lambda res, step: selector.select(self._cell_histograms(res), step, drop_last=True))
+		return self.X
 
 	
+	def sparse_opticalflow_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
+		"""
+		Return the raw histograms ([FRAMES, 512]) of a segment, every access_stride-th video frame but the last one (the same rows as the other accessors), as a scipy.sparse CSR matrix. Data files written with sparse_storage are read without densifying them (only the entries of the segment are read), unless the data has to be resampled to 24 frames per second (see ActionData.interpolate_time_window); other data files are read and converted.
+		"""
+		ap = self._check_opticalflow_params()
+		step = self._record_stride(access_stride)
+		onset_frame, dur_frames = self._segment_frames(segment.time_span.start_time, segment.time_span.duration)
+		if not os.path.exists(self.data_path):
+			_log.error('Optical flow analysis file does not exist for this film (%s). Sorry.', self.filename)
+			return None
+		mapped = map_feature_file(self.data_path, ((ap['grid_divs_x'] * ap['grid_divs_y'] * ap['theta_divs']),))
+		if isinstance(mapped, SparseFeatures) and not ad.resamples(len(mapped), ap['afps']):
+			window = mapped.csr(onset_frame, (onset_frame + dur_frames))
+			self.X = window[0:(window.shape[0] - 1):step]
+		else:
+			window = self._opticalflow_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)
+			self.X = sparse.csr_matrix(np.asarray(window[0:-1:step], dtype='float32').reshape(-1, mapped.shape[1]))
+		return self.X
+
 # 	def opticalflow_for_segment(self, segment=Segment(0, -1)):
 # 		"""
 # 		This is the interface for grabbing analysis data for segments of the whole film. Uses Segment objects from Bregman/ACTION!
@@ -429,6 +731,51 @@ class OpticalFlow:
 		"""
 		return getattr(self,func)(segment)
 	
+	def _cell_histograms(self, data):
+		"""
+		View of a window of optical flow data ([FRAMES, 512]) as [FRAMES, CELLS (64), DIRECTIONS (8)].
+		"""
+		return data.reshape(data.shape[0], -1, self.analysis_params['theta_divs'])
+	
+	def _analyzed_stride(self):
+		"""
+		The stride the data file was analyzed at, as recorded with its layout in the title's JSON file; the stride parameter if none was recorded.
+		"""
+		ap = self.analysis_params
+		return self.metadata().analyzed_stride(ap['data_extension']) or ap['stride']
+	
+	def _record_stride(self, access_stride):
+		"""
+		An access stride in video frames (at 24 frames per second) as a step in records of the data file.
+		"""
+		return max((int(access_stride) // self._analyzed_stride()), 1)
+	
+	def _segment_frames(self, onset_s=0, duration_s=-1):
+		"""
+		Onset and duration of a segment (in seconds; a negative duration means the whole movie) in records of the data file (24 frames per second divided by the analysis stride), as used by _opticalflow_features_for_segment_from_onset_with_duration.
+		"""
+		self._load_metadata()
+		ap = self.analysis_params
+		frames_per_astride = (24.0 / self._analyzed_stride()) # 24.0, not ap['fps']
+		onset_frame = int(onset_s * frames_per_astride)
+		if duration_s < 0:
+			dur_frames = int(self.determine_movie_length() * frames_per_astride * (ap['afps'] / ap['fps']))
+		else:
+			dur_frames = int(duration_s * frames_per_astride * (ap['afps'] / ap['fps']))
+		return onset_frame, dur_frames
+	
+	def _cached_segment_features(self, selector, onset_s, duration_s, access_stride, select):
+		"""
+		Apply select to the window that _opticalflow_features_for_segment_from_onset_with_duration returns for the segment; select(window, step) is expected to return every step-th record of the window but the last one, where step is access_stride (in video frames) divided by the analysis stride (see _record_stride). The result is served from the feature cache (see featurecache) when it is enabled, keyed by the title's data file, the selector name, the analysis stride and the step.
+		"""
+		step = self._record_stride(access_stride)
+		load = lambda: select(self._opticalflow_features_for_segment_from_onset_with_duration(onset_s, duration_s), step)
+		if feature_cache() is None:
+			return load()
+		onset_frame, dur_frames = self._segment_frames(onset_s, duration_s)
+		key = (data_file_key(self.data_path), selector, self._analyzed_stride(), step)
+		return cached_features(key, onset_frame, (onset_frame + dur_frames - 1), step, load)
+	
 	def _opticalflow_features_for_segment_from_onset_with_duration(self, onset_s=0, duration_s=-1):
 		"""
 		This is the interface for grabbing analysis data based on onsets and durations, translating seconds into frames.
@@ -441,27 +788,20 @@ class OpticalFlow:
 		
 		"""
 		ap = self._check_opticalflow_params()
-		frames_per_astride = (24.0 / ap['stride']) # 24.0, not ap['fps']
-		
-		onset_frame = int(onset_s * frames_per_astride)
-		if duration_s < 0:
-			dur_frames = int(self.determine_movie_length() * frames_per_astride * (ap['afps'] / ap['fps']))
-		else:
-			dur_frames = int(duration_s * frames_per_astride * (ap['afps'] / ap['fps']))
+		onset_frame, dur_frames = self._segment_frames(onset_s, duration_s)
 		
-		print 'df: ', dur_frames
+		_log.debug('df: %s', dur_frames)
 		try:
 			if os.path.exists(self.data_path):
-				mapped = np.memmap(self.data_path, dtype='float32', mode='r') #, offset=onset_frame, shape=(dur_frames,512))
+				mapped = map_feature_file(self.data_path, ((ap['grid_divs_x'] * ap['grid_divs_y'] * ap['theta_divs']),))
 			else:
-				print "Optical flow analysis file does not exist for this film (", self.filename, "). Sorry."
+				_log.error('Optical flow analysis file does not exist for this film (%s). Sorry.', self.filename)
 				return None
 		except IOError:
-			print "Attempting to access data file/mem map that does not exist!"
+			_log.error('Attempting to access data file/mem map that does not exist!')
 			return None
-		mapped = mapped.reshape((-1,512))
-		mapped = ad.interpolate_time(mapped, ap['afps'])
-		return mapped[onset_frame:(onset_frame+dur_frames),:]
+		# slice first, then resample only the requested window (a view of the memmap if afps == 24)
+		return ad.interpolate_time_window(mapped, ap['afps'], onset_frame, (onset_frame+dur_frames))
 
 
 	def determine_movie_length(self, **kwargs):
@@ -473,22 +813,20 @@ class OpticalFlow:
 		ap = self.analysis_params
 		strides_per_second = float(ap['fps'] / ap['stride'])
 	
-		if os.path.exists(self.movie_path) and HAVE_CV:
-			capture = cv2.VideoCapture(self.movie_path)
-			dur_total_seconds = capture.get(cv.CV_CAP_PROP_FRAME_COUNT) / ap['afps']
-			print "mov total secs: ", dur_total_seconds
+		if os.path.exists(self.json_path) or (os.path.exists(self.movie_path) and HAVE_CV):
+			# the frame count comes from the title's metadata; the movie is only opened if the JSON file is missing
+			self._load_metadata()
+			dur_total_seconds = self.metadata().frames / ap['afps']
+			_log.debug('mov total secs: %s', dur_total_seconds)
 		elif os.path.exists(self.data_path):
-			dsize = os.path.getsize(self.data_path)
-			# since we are reading raw color analysis data that always has the same size on disc!
-			# the constant had better be correct!
-			print "dsize: ", dsize
-			dur_total_aframes = dsize / float((ap['grid_divs_x'] * ap['grid_divs_y'] * ap['theta_divs']) * 4) # REGIONS * CHANNELS * BINS * BYTES
-			print 'dtaf: ', dur_total_aframes
+			self._load_metadata()	# afps from the data file's header (see _load_metadata)
+			dur_total_aframes = data_file_shape(self.data_path, ((ap['grid_divs_x'] * ap['grid_divs_y'] * ap['theta_divs']),))[0]
+			_log.debug('dtaf: %s', dur_total_aframes)
 			dur_total_seconds = (dur_total_aframes / strides_per_second) * (ap['fps'] / ap['afps'])
-			print "total secs: ", dur_total_seconds
+			_log.debug('total secs: %s', dur_total_seconds)
 		else:
 			dur_total_seconds = -1
-			print "Cannot determine movie duration. Both the movie and data files are missing!"
+			_log.error('Cannot determine movie duration. Both the movie and data files are missing!')
 		self.analysis_params['duration'] = dur_total_seconds
 		return dur_total_seconds
 
@@ -511,6 +849,7 @@ class OpticalFlow:
 		
 		"""
 		ap = self._check_opticalflow_params(kwargs)
+		self._load_metadata()
 		offset_s = float(offset) / (ap['fps'] / ap['stride'])
 		dur_s = float(duration) / (ap['fps'] / ap['stride'])
 		
@@ -529,16 +868,17 @@ class OpticalFlow:
 # 		self._process_movie(movie_file, data_file, mode='playback', display=True, offset=offset, duration=duration)
 		self._playback_movie(mode='playback', display=True, offset=offset, duration=duration)
 	
-	def analyze_movie(self, offset=0, duration=-1, showrawvectors=False):
+	def analyze_movie(self, offset=0, duration=-1, showrawvectors=False, resume=False):
 		"""
 		Analyze the movie without displaying on screen. Equivalent to:
 		
 		::
 		
-			_process_movie(offset=0, duration=-1)
+			_process_movie(offset=0, duration=-1, resume=False)
 		
+		With resume=True, an interrupted run (see featurestore.ProgressRecord) is continued after its last committed stride, provided that it was made with the same parameters from the same movie file; otherwise the analysis starts over. Tracking starts afresh at the resumed stride, so the first few histograms after it are based on shorter tracks than in an uninterrupted run.
 		"""
-		self._process_movie(mode='analyze', display=False, offset=offset, duration=duration)
+		self._process_movie(mode='analyze', display=False, offset=offset, duration=duration, resume=resume)
 
 	def analyze_movie_with_display(self, offset=0, duration=-1, showrawvectors=False):
 		"""
@@ -562,10 +902,11 @@ class OpticalFlow:
 # 			return
 
 		if (self.movie_path is None) or (self.data_path is None):
-			print "ERROR: Must supply both a movie and a data path!"
+			_log.error('Must supply both a movie and a data path!')
 			return
 				
 		ap = self._check_opticalflow_params(kwargs)
+		self._load_metadata()
 		verbose = ap['verbose']
 				
 		self.capture = cv2.VideoCapture(self.movie_path)
@@ -601,34 +942,41 @@ class OpticalFlow:
 		dur_frames = dur_strides * stride_frames
 				
 		if verbose:
-			print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
-			print 'FRAMES: ', total_frame_count
-			print 'DUR TOTAL: ', dur_total_secs
-			print "OFFSET (SECONDS): ", offset_secs
-			print "OFFSET (STRIDES): ", offset_strides
-			print "OFFSET (FRAMES): ", offset_frames
-			print "DUR (SECONDS): ", dur_secs
-			print 'DUR (STRIDES): ', dur_strides
-			print 'DUR (FRAMES): ', dur_frames
-			print "FPS: ", fps
-			print "stride_frames: ", stride_frames
-		self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, offset_frames)
-		self.frame_idx = offset_frames
+			_log.info('FRAMES: %s', total_frame_count)
+			_log.info('DUR TOTAL: %s', dur_total_secs)
+			_log.info('OFFSET (SECONDS): %s', offset_secs)
+			_log.info('OFFSET (STRIDES): %s', offset_strides)
+			_log.info('OFFSET (FRAMES): %s', offset_frames)
+			_log.info('DUR (SECONDS): %s', dur_secs)
+			_log.info('DUR (STRIDES): %s', dur_strides)
+			_log.info('DUR (FRAMES): %s', dur_frames)
+			_log.info('FPS: %s', fps)
+			_log.info('stride_frames: %s', stride_frames)
 		end_frame = offset_frames + dur_frames
 		
-		# set up memmap		
+		# dense flow backend (set up first, so that an unknown or unavailable backend fails before the data file is touched)
+		dense = None
+		if ap['flow_backend'] != 'lk':
+			dense = DenseFlow(ap['flow_backend'], grid_x_divs, grid_y_divs, theta_divs, ap['dense_max_dim'], ap['dense_min_magnitude'], ap['farneback_params'], ap['dis_preset'])
+		
+		# set up memmap (and, for analysis, the progress record)
+		start_stride = 0
 		if ap['mode'] == 'playback' and ap['display'] == True:
-			print 'PLAYBACK!'
-			fp = np.memmap(self.data_path, dtype='float32', mode='r', shape=((offset_strides+dur_strides),(grid_x_divs * grid_y_divs * theta_divs)))
+			_log.debug('PLAYBACK!')
+			fp = map_feature_file(self.data_path, ((grid_x_divs * grid_y_divs * theta_divs),))
 		else:
-			print 'ANALYZE!'
-			fp = np.memmap(self.data_path, dtype='float32', mode='w+', shape=(dur_strides,(grid_x_divs * grid_y_divs * theta_divs)))
-		
-		print 'dur. strides: ', dur_strides
+			_log.debug('ANALYZE!')
+			shape = (dur_strides,(grid_x_divs * grid_y_divs * theta_divs))
+			progress = ProgressRecord(progress_path(self.data_path), ap, self.movie_path, shape)
+			fp, start_stride = open_feature_file(self.data_path, shape, progress, resume=ap['resume'], header=feature_header(shape, ap, self.metadata()))
+			if progress.complete:
+				_log.info('Analysis already complete: %s', self.data_path)
+				return
+			if start_stride > 0: _log.info('resuming at stride: %s', start_stride)
+			record_layout(self.json_path, ap['data_extension'], {'grid_divs_x' : grid_x_divs, 'grid_divs_y' : grid_y_divs, 'theta_divs' : theta_divs, 'stride' : ap['stride'], 'flow_backend' : ap['flow_backend'], 'flow_window' : min(ap['flow_window'], (stride_frames - 1))})
+		
+		_log.debug('dur. strides: %s', dur_strides)
 		
-		self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, offset_frames)
-		self.frame_idx = offset_frames
-		end_frame = offset_frames + dur_frames
 		tdepth = ap['trackDepth']
 		
 		if ap['display']:
@@ -638,97 +986,103 @@ class OpticalFlow:
 			THETAS_Y = [0, int(-16*ROOT2), -32, int(-16*ROOT2), 0, int(16*ROOT2), 32, int(16*ROOT2)]
 			THETAS = [[pair[0],pair[1]] for pair in zip(THETAS_X, THETAS_Y)]
 
-		while self.frame_idx < end_frame:
-		
-			fd = self.frame_idx - offset_strides
-			if verbose:
-				print 'fr. idx: ', self.frame_idx / float(end_frame), ' (/ ', end_frame, ')'
+		# continuous tracking needs every frame: decode straight through, histograms are written on stride frames;
+		# with a flow window (analysis only), read the first flow_window + 1 frames of every stride and write at the end of the window
+		flow_window = min(ap['flow_window'], (stride_frames - 1)) if ap['mode'] == 'analyze' else 0
+		self.tracks = tracks = TrackBuffer(max(ap['trackLength'], (flow_window + 1)), (4 * ap['maxCorners']))
+		prev_small, motion = None, None
+		if flow_window > 0:
+			frames = open_frame_source(self.capture, offset_frames + (start_stride * stride_frames), end_frame, stride_frames, ap['frame_access'], ap['gop_size'], ap['prefetch'], window=(flow_window + 1))
+		else:
+			# when resuming, start one frame early: the flow of the first stride frame needs the frame before it
+			frames = open_frame_source(self.capture, max(offset_frames, (offset_frames + (start_stride * stride_frames) - 1)), end_frame, 1, ap['frame_access'], ap['gop_size'], ap['prefetch'])
+		if ap['mode'] == 'analyze':
+			writer = feature_writer(fp, ap, progress)
+		reporter = ProgressReporter(_log, dur_strides, os.path.basename(self.data_path), 'strides', start=start_stride)
+		aborted = False
+
+		for self.frame_idx, frame in frames:
+		
+			fd = (self.frame_idx - offset_frames) / stride_frames
+			phase = (self.frame_idx - offset_frames) % stride_frames
+			reporter.update(fd + 1)
 			
-			ret, frame = self.capture.read()
 			frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 # 			if ap['display'] is True:
 # 				vis = frame.copy()
 			
-			# process moving points
-			if len(self.tracks) > 0:
-				img0, img1 = self.prev_gray, frame_gray
-				p0 = np.float32([tr[-1] for tr in self.tracks]).reshape(-1, 1, 2)
-				p1, st, err = cv2.calcOpticalFlowPyrLK(img0, img1, p0, None, **self.lk_params)
-				p0r, st, err = cv2.calcOpticalFlowPyrLK(img1, img0, p1, None, **self.lk_params)
-
-				d = abs(p0-p0r).reshape(-1, 2).max(-1)
-				good = d < 20
-# 				print "good: ", good
-				new_tracks = []
-				for tr, (x, y), good_flag in zip(self.tracks, p1.reshape(-1, 2), good):
-					if not good_flag:
-						continue
-					tr.append((x, y))
-					if len(tr) > ap['trackLength']:
-						del tr[0]
-					new_tracks.append(tr)
-					#if showrawvectors and ap['display']:
-					cv2.circle(frame, (x, y), 2, (0, 255, 0), -1)
-				self.tracks = new_tracks
-
-				if self.frame_idx % ap['stride'] == 0:
+			if dense is not None and flow_window > 0:
+				# dense backends, windowed: add up the histograms of the frame pairs in the window
+				small = dense.prepare(frame_gray)
+				if phase == 0:
+					motion = np.zeros((grid_x_divs * grid_y_divs * theta_divs), dtype='float32')
+				elif prev_small is not None:
+					motion += dense.histogram(prev_small, small)
+				if phase == flow_window:
+					writer.write(fd, motion)
+				prev_small = small
+			elif dense is not None:
+				# dense backends: one flow field per stride frame, from the frame before it
+				if (self.frame_idx % stride_frames) == 0 or ((self.frame_idx + 1) % stride_frames) == 0:
+					small = dense.prepare(frame_gray)
+				else:
+					small = None
+				if ap['mode'] == 'analyze' and (self.frame_idx % stride_frames) == 0 and prev_small is not None:
+					writer.write(fd, dense.histogram(prev_small, small))
+				prev_small = small
+			else:
+				# a flow window starts with fresh tracks on its first frame
+				if flow_window > 0 and phase == 0:
+					tracks.clear()
+				
+				# process moving points
+				if len(tracks) > 0:
+					img0, img1 = self.prev_gray, frame_gray
+					slots = tracks.slots()
+					p0 = tracks.heads(slots).reshape(-1, 1, 2)
+					p1, st, err = cv2.calcOpticalFlowPyrLK(img0, img1, p0, None, **self.lk_params)
+					p0r, st, err = cv2.calcOpticalFlowPyrLK(img1, img0, p1, None, **self.lk_params)
+
+					# forward-backward check: keep the tracks that come back to (within 20 pixels of) where they started
+					good = abs(p0-p0r).reshape(-1, 2).max(-1) < 20
+					tracks.advance(slots, p1.reshape(-1, 2), good)
+					if ap['display']:
+						for x, y in tracks.heads():
+							cv2.circle(frame, (x, y), 2, (0, 255, 0), -1)
+
+					# histograms are only computed (and written) in analysis mode; playback reads them from the data file
+					if ap['mode'] == 'analyze' and ((phase == flow_window) if flow_window > 0 else (self.frame_idx % ap['stride'] == 0)):
 					
-					tracks_now = [np.int32(tr) for tr in self.tracks]
-
-					#if showrawvectors and ap['display']:
-					cv2.polylines(frame, tracks_now, isClosed=False, color=(0, 255, 0))
-										
-					try:
-						seq = tracks_now[0]
-						track_vectors = np.append( tracks_now[0][ min(len(seq)-1, tdepth) ], seq[0])
-
-						for n, tr in enumerate(tracks_now[1:]):
-							track_vectors = np.append(track_vectors, np.append(tr[ min(len(tr)-1, tdepth) ], (tr[0])))
-
-						# track_vectors is variable-length, up to max-number-of-corners
-						track_vectors = np.reshape(np.array(track_vectors, dtype='float32'), (-1,4))
-												
-						xdelta = track_vectors[:,2] - track_vectors[:,0]
-						ydelta = track_vectors[:,3] - track_vectors[:,1]
-						thetas = np.arctan2(ydelta, xdelta)
- 						mags = np.sqrt(np.add(np.power(xdelta, 2.0), np.power(ydelta, 2.0)))
-						xbin = np.floor(track_vectors[:,0] / grid_width)
-						ybin = np.floor(track_vectors[:,1] / grid_height)
-												
-						# filter out vectors less than 1 pixel!
-						weighted = np.where(mags > 5, mags, 0.0)
-# 						print weighted.shape
-						theta_vals = np.floor_divide(np.add(thetas, math.pi), QPI)
-
-						combo_bins = ((np.add((ybin * grid_x_divs), xbin) * theta_divs) + theta_vals) #  8 = num. of bins for theta!!!
-												
-						# calc. histo or write all zeros
-						if combo_bins.shape[0] > 0:
-							bins_histo, bin_edges = np.histogram(combo_bins, (grid_x_divs * grid_y_divs * theta_divs), (0., 512.), weights=weighted)
-							fp[fd] = bins_histo
+						if ap['display']:
+							cv2.polylines(frame, tracks.polylines(), isClosed=False, color=(0, 255, 0))
+					
+						# one vector per track, from its point tdepth (or, windowed, flow_window) steps along (in whole pixels) back to its oldest point
+						starts, ends = tracks.displacements(flow_window if flow_window > 0 else tdepth)
+						starts, ends = np.float32(np.int32(starts)), np.float32(np.int32(ends))
+						if starts.shape[0] > 0:
+							writer.write(fd, motion_histogram(starts[:,0], starts[:,1], (ends[:,0] - starts[:,0]), (ends[:,1] - starts[:,1]), grid_width, grid_height, grid_x_divs, grid_y_divs, theta_divs))
 						else:
-	 						if verbose: print 'Zero! frame: ', fd
-							fp[fd] = np.zeros(512, dtype='float32') # 16*8=128 --- 64*8=512
-					except IndexError:						
- 						if verbose: print 'Index Error! frame: ', fd
-						fp[fd] = np.zeros(512, dtype='float32') # 16*8=128 --- 64*8=512					
-
-			# perform edge detection
-			if self.frame_idx % 24 == 0:
+							if verbose: _log.info('Zero! frame: %s', fd)
+							writer.write(fd, np.zeros(512, dtype='float32')) # 16*8=128 --- 64*8=512
+
+				# perform edge detection (windowed: on the first frame of every window)
+				if (phase == 0) if flow_window > 0 else (self.frame_idx % 24 == 0):
 				
-				mask = np.zeros_like(frame_gray)
-				mask[:] = 255
-				for x, y in [np.float32(tr[-1]) for tr in self.tracks]:
+					mask = np.zeros_like(frame_gray)
+					mask[:] = 255
 					if ap['display']:
-						cv2.circle(mask, (x, y), 5, 0, -1)
-				p = cv2.goodFeaturesToTrack(frame_gray, mask = mask, **self.feature_params)
-				if p is not None:
-					for x, y in np.float32(p).reshape(-1, 2):
-						self.tracks.append([(x, y)])
+						for x, y in tracks.heads():
+							cv2.circle(mask, (x, y), 5, 0, -1)
+					p = cv2.goodFeaturesToTrack(frame_gray, mask = mask, **self.feature_params)
+					if p is not None:
+						tracks.add(np.float32(p).reshape(-1, 2))
 			
 			if ap['display']:
-				# visualize frame's histograms
-				currframe = fp[self.frame_idx,:512]
+				# visualize frame's histograms (rows still in the write buffer are read back from it)
+				if ap['mode'] == 'analyze':
+					currframe = writer[fd][:512]
+				else:
+					currframe = fp[offset_strides + fd,:512]
 				framemin = currframe[:512].min()
 				framemax = currframe[:512].max()
 				framerange = framemax - framemin
@@ -746,15 +1100,23 @@ class OpticalFlow:
 				#### SHOW
 				cv.ShowImage('Image', cv.fromarray(frame))
 			
-			fp.flush()
-			self.frame_idx += 1
 			self.prev_gray = frame_gray
 			
 			if ap['display'] is True: 
 				ch = 0xFF & cv.WaitKey (int(1000 / ap['afps']))
 				if ch == 27:
+					aborted = True
 					break
 		
+		if frames.frame_error:
+			_log.error('Frame error! Exiting...')
+		
+		if ap['mode'] == 'analyze':
+			writer.close(complete=(not aborted and not frames.frame_error))
+		reporter.finish()
+		del fp
+		if ap['mode'] == 'analyze' and not aborted and not frames.frame_error:
+			finish_feature_file(self.data_path, ap)
 		if ap['display'] is True:
 			cv2.destroyAllWindows()
 
@@ -776,21 +1138,22 @@ class OpticalFlow:
 		
 		"""
 		if not HAVE_CV:
-			print "WARNING: You must install OpenCV in order to analyze or view!"
+			_log.warning('You must install OpenCV in order to analyze or view!')
 			return
 		
 		if (self.movie_path is None) and (self.data_path is None):
-			print "Both movie path and data path are missing! Please supply at least one."
+			_log.error('Both movie path and data path are missing! Please supply at least one.')
 			return None
 		
 		have_mov = os.path.exists(self.movie_path)
 		have_data = os.path.exists(self.data_path)
 		
 		if (have_mov is False) and (have_data is False):
-			print "Both movie file and data file are missing! Please supply at least one."
+			_log.error('Both movie file and data file are missing! Please supply at least one.')
 			return None
 		
  		ap = self._check_opticalflow_params(kwargs)
+		self._load_metadata()
 		ap = self.analysis_params
 		verbose = ap['verbose']
 		
@@ -800,8 +1163,7 @@ class OpticalFlow:
 			frame_height = int(self.capture.get(cv.CV_CAP_PROP_FRAME_HEIGHT))
 		else:
 			frame_width = 800
-			frame_height = int(float(frame_width) * self._read_json_value('aspect'))
-			print self._read_json_value('aspect')
+			frame_height = int(frame_width / self.metadata().aspect)
 		
 		fps = ap['fps']
 		grid_x_divs = ap['grid_divs_x']
@@ -812,14 +1174,13 @@ class OpticalFlow:
 		grid_height = int(frame_height/float(grid_y_divs))
 		grid_size = (grid_width, grid_height)
 		
-		print frame_width
-		print frame_height
+		_log.debug('frame size: %s x %s', frame_width, frame_height)
 		
 		centers_x = range((frame_width/16),frame_width,(frame_width/8))
 		centers_y = range((frame_height/16),frame_height,(frame_height/8))
 		
 		if verbose:
-			print fps, ' | ', frame_size, ' | ', grid_size
+			_log.info('fps, frame size, grid size: %s | %s | %s', fps, frame_size, grid_size)
 				
 		# container for prev. frame's grayscale subframes
 		prev_sub_grays = []								
@@ -829,14 +1190,14 @@ class OpticalFlow:
 		else:
 			offset_secs = 0
 		
-		print "%%% ", ap['duration']
+		_log.debug('duration: %s', ap['duration'])
 		
 		if ap['duration'] > 0:
 			dur_secs = ap['duration']
 		elif ap['duration'] < 0:
 			ap['duration'] = self.determine_movie_length()
 		else:
-			print "Duration cannot be 0."
+			_log.error('Duration cannot be 0.')
 			return
 		dur_secs = ap['duration']
 		
@@ -855,23 +1216,22 @@ class OpticalFlow:
 		dur_frames = dur_strides * stride_frames
 		
 		if verbose:
-			print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
-			print 'DUR TOTAL: ', dur_total_secs
-			print "OFFSET (SECONDS): ", offset_secs
-			print "OFFSET (STRIDES): ", offset_strides
-			print "OFFSET (FRAMES): ", offset_frames
-			print "DUR (SECONDS): ", dur_secs
-			print 'DUR (STRIDES): ', dur_strides
-			print 'DUR (FRAMES): ', dur_frames
-			print 'XDIVS: ', grid_x_divs
-			print 'YDIVS: ', grid_y_divs
-			print "FPS: ", fps
-			print "stride_frames: ", stride_frames
+			_log.info('DUR TOTAL: %s', ap['duration'])
+			_log.info('OFFSET (SECONDS): %s', offset_secs)
+			_log.info('OFFSET (STRIDES): %s', offset_strides)
+			_log.info('OFFSET (FRAMES): %s', offset_frames)
+			_log.info('DUR (SECONDS): %s', dur_secs)
+			_log.info('DUR (STRIDES): %s', dur_strides)
+			_log.info('DUR (FRAMES): %s', dur_frames)
+			_log.info('XDIVS: %s', grid_x_divs)
+			_log.info('YDIVS: %s', grid_y_divs)
+			_log.info('FPS: %s', fps)
+			_log.info('stride_frames: %s', stride_frames)
 		
 		# set up memmap
 		# mode should always be playback and dislay should always be true!!!
 		if ap['mode'] == 'playback' and ap['display'] == True and have_data:
-			fp = np.memmap(self.data_path, dtype='float32', mode='r', shape=((offset_strides + dur_strides),(grid_x_divs * grid_y_divs * theta_divs)))
+			fp = map_feature_file(self.data_path, ((grid_x_divs * grid_y_divs * theta_divs),))
 			cv2.namedWindow('Image', cv.CV_WINDOW_AUTOSIZE)
 			cv2.resizeWindow('Image', frame_width, frame_height)
 			ROOT2 = math.sqrt(2.0)
@@ -886,12 +1246,12 @@ class OpticalFlow:
 			self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, offset_frames)
 			ret, frame = self.capture.read()
 			if frame is None: 
-				print 'Frame error! Exiting...'
+				_log.error('Frame error! Exiting...')
 				return # no image captured... end the processing		
 					
 		else:
 			frame = np.empty((frame_width, frame_height), np.uint8)
-			print frame.shape
+			_log.debug('blank frame: %s', frame.shape)
 
 		self.frame_idx += 1
 		playing_flag = True
@@ -905,7 +1265,7 @@ class OpticalFlow:
 				# grab next frame
 				ret, frame = self.capture.read()
 				if frame is None: 
-					print 'Frame error! Exiting...'
+					_log.error('Frame error! Exiting...')
 					break # no image captured... end the processing
 			else:
 				frame[:] = 0
@@ -941,9 +1301,8 @@ class OpticalFlow:
 				
 				#### SHOW
 				cv.ShowImage('Image', cv.fromarray(frame))
-				fp.flush()
 	
-				print self.frame_idx, ':: ', (float(self.frame_idx - offset_frames) / dur_frames)
+				_log.debug('frame %s :: %s', self.frame_idx, (float(self.frame_idx - offset_frames) / dur_frames))
 				
 			# check p_state				
 			if p_state == 1: # rew. 10 sec.
@@ -966,9 +1325,7 @@ class OpticalFlow:
 			# handle key events
 			k = cv.WaitKey (int(1000 / ap['afps']))
 			if verbose is True:
-				print '>>>>>>>>>>>>>>>>>>'
-				print k % 0x100
-				print p_state
+				_log.info('key: %s, state: %s', (k % 0x100), p_state)
 			
 			if k % 0x100 == 27:
 				# user has press the ESC key, so exit
@@ -177,22 +177,28 @@ __email__ = 'thomas.m.stoll@dartmouth.edu'
 
 
 import sys, time, os
+from actionlog import *
+_log = get_logger(__name__)
 # import the necessary things for OpenCV
 try:
 	import cv2
 	import cv2.cv as cv
 	HAVE_CV = True
 except ImportError:
-	print 'WARNING: Access only, use of methods other than *_tvl1_features_for_segment, etc. will cause errors! Install OpenCV to perform analysis and display movies/data.'
+	_log.warning('Access only, use of methods other than *_tvl1_features_for_segment, etc. will cause errors! Install OpenCV to perform analysis and display movies/data.')
 	HAVE_CV = False
 import numpy as np
 import json, math
 from segment import *
 from actiondata import *
+from featurestore import *
+from metadata import *
+from featurecache import *
+from regions import *
 ad = ActionData()
 av = ActionView()
 
-class OpticalFlowTVL1:
+class OpticalFlowTVL1(object):
 	"""
 	Optical Flow (TVL1) analysis of frame and 4-by-4 grid of subframes.
 	
@@ -216,31 +222,53 @@ class OpticalFlowTVL1:
 		ap = self.analysis_params
 		
 		if filename is None:
-			print 'File name missing!'
+			_log.error('File name missing!')
 			return
 		else:
 			self.movie_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + ap['movie_extension']))
 			self.data_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + ap['data_extension']))
 			self.json_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + '.json'))
-			print self.json_path
+			_log.debug('JSON file: %s', self.json_path)
 			self.filename = filename
 		
-		# self.determine_movie_length() no need
-# 		if ! exists(self.json_path):
-# 			self._write_metadata_to_json()
-		ap['afps'] = self._read_json_value('fps')
-		
-		# try to naively get some data and store in a class var
-		if os.path.exists(self.data_path):
-			self.default_tvl1_features_for_segment()
+		# metadata and default features are loaded lazily (see _load_metadata and X)
+		self._afps = None
+		self._X = None
+	
+	def _load_metadata(self):
+		"""
+		Set the access frame rate (afps) from the title's metadata (see metadata). Done on first use, and not at construction time, since the metadata may have to be read from the movie; later calls only check that the JSON file has not changed. If neither the JSON file nor the movie is there, but the data file is, afps comes from the data file's header instead (and stays at the afps parameter for a headerless file), so that the features can be read without the movie.
+		"""
+		if os.path.exists(self.json_path) or (os.path.exists(self.movie_path) and HAVE_CV) or not os.path.exists(self.data_path):
+			self._afps = self.metadata().fps
 		else:
-			self.X = None
+			header = read_feature_header(self.data_path)
+			if header is None or header.fps <= 0:
+				return
+			self._afps = header.fps
+		self.analysis_params['afps'] = self._afps
+	
+	def _get_X(self):
+		if self._X is None and os.path.exists(self.data_path):
+			self.default_tvl1_features_for_segment()
+		return self._X
+	
+	def _set_X(self, X):
+		self._X = X
+	
+	def _del_X(self):
+		self._X = None
+	
+	X = property(_get_X, _set_X, _del_X, doc="Default features of the title (see default_tvl1_features_for_segment), loaded from the data file on first access and cached. Accessor functions replace them with the features they return; del tvl1.X releases them.")
 	
 	def _check_tvl1_params(self, analysis_params=None):
 		"""
-		Simple mechanism to read in default parameters while substituting custom parameters.
+		Simple mechanism to read in default parameters while substituting custom parameters. The custom parameters are merged into the current ones (those passed to the constructor and to earlier calls), so that a call like analyze_movie only overrides the parameters it passes; missing ones are filled in from the defaults.
 		"""
-		self.analysis_params = analysis_params if analysis_params is not None else self.analysis_params
+		if not hasattr(self, 'analysis_params'):
+			self.analysis_params = {}
+		if analysis_params is not None:
+			self.analysis_params.update(analysis_params)
 		dcfp = self.default_tvl1_params()
 		for k in dcfp.keys():
 			self.analysis_params[k] = self.analysis_params.get(k, dcfp[k])
@@ -271,27 +299,34 @@ class OpticalFlowTVL1:
 		}
 		return analysis_params
 	
+	def metadata(self):
+		"""
+		The title's MovieMetadata (fps, frames, width, height, aspect, length and data layouts; see the metadata module). Read from the title's JSON file once and shared with the other analyzers of the title; the movie is only opened if the JSON file does not exist yet.
+		"""
+		return movie_metadata(self.json_path, self.movie_path, self.filename)
+	
 	def _write_metadata_to_json(self):
 		"""
+		(Re)write the title's JSON file from the movie, keeping the data layouts recorded there.
 		"""
-		title = self.filename
-		capture = cv2.VideoCapture(self.movie_path)
-		fps = capture.get(cv.CV_CAP_PROP_FPS)
-		aspect = capture.get(cv.CV_CAP_PROP_FRAME_WIDTH / cv.CV_CAP_PROP_FRAME_HEIGHT)
-		frames = capture.get(cv.CV_CAP_PROP_FRAME_COUNT)
-		length = frames / fps
-		movdict = {'title':title, 'fps':fps, 'aspect': aspect,'frames': frames, 'length':length}
-		fp = file(self.json_path, 'w')
-		fp.write(json.dumps(movdict))
-		fp.close()
-		del capture
+		write_movie_metadata(self.json_path, self.movie_path, self.filename)
 		return 1
 	
 	def _read_json_value(self, key='fps'):
-# 		fp = file(self.json_path, 'r')
-		jsonfile = open(self.json_path)
-		jsondata = json.load(jsonfile)
-		return jsondata[key]
+		return self.metadata()[key]
+	
+	def _region_selector(self, name):
+		"""
+		The named region selector (see regions) compiled for the analysis grid (grid_divs_x by grid_divs_y).
+		"""
+		ap = self.analysis_params
+		return region_selector(name, ap['grid_divs_x'], ap['grid_divs_y'])
+	
+	def _cell_flows(self, grid):
+		"""
+		View of the gridded part of a window of tvl1 data ([FRAMES, 128]) as [FRAMES, CELLS (64), 2].
+		"""
+		return grid.reshape(grid.shape[0], -1, 2)
 	
 	def all_tvl1_features_for_segment(self, segment=Segment(0, -1)):
 		"""
@@ -319,7 +354,7 @@ class OpticalFlowTVL1:
 			all_tvl1_features_for_segment(...)[0].reshape((segment.time_span.duration*4), -1)		
 
 		"""
-		self.X = self._tvl1_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[0].reshape(-1, 16)
+		self.X = self._cached_segment_features('full', segment.time_span.start_time, segment.time_span.duration, lambda res: res[0].reshape(-1, 16))
 		return self.X
 	
 	def gridded_tvl1_features_for_segment(self, segment=Segment(0, -1)):
@@ -338,7 +373,8 @@ class OpticalFlowTVL1:
 			all_tvl1_features_for_segment(...)[1].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._tvl1_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1].reshape(-1, 128)
+		selector = self._region_selector('gridded')
+		self.X = self._cached_segment_features('gridded', int(segment.time_span.start_time), int(segment.time_span.duration), lambda res: selector.select(self._cell_flows(res[1])))
 		return self.X
 
 	def center_quad_tvl1_features_for_segment(self, segment=Segment(0, -1)):
@@ -354,10 +390,11 @@ class OpticalFlowTVL1:
 		Equivalent to:
 		::
 		
-			all_tvl1_features_for_segment(...)[1][:,[5,6,9,10],...].reshape((segment.time_span.duration*4), -1)
+			all_tvl1_features_for_segment(...)[1].reshape(-1, 64, 2)[:,[18..21,26..29,34..37,42..45],:].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._tvl1_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1][ range((18*2),(22*2))+range((26*2),(30*2))+range((34*2),(38*2))+range((52*2),(56*2)) ].reshape(-1, 32)
+		selector = self._region_selector('center_quad')
+		self.X = self._cached_segment_features('center_quad', int(segment.time_span.start_time), int(segment.time_span.duration), lambda res: selector.select(self._cell_flows(res[1])))
 		return self.X
 
 	def middle_band_tvl1_features_for_segment(self, segment=Segment(0, -1)):
@@ -373,10 +410,11 @@ class OpticalFlowTVL1:
 		Equivalent to:
 		::
 		
-			all_tvl1_features_for_segment(...)[1][:,::2][,16:48].reshape((segment.time_span.duration*4), -1)
+			all_tvl1_features_for_segment(...)[1][:,(16*2):(48*2)].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._tvl1_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1][:,(16*2):(48*2)].reshape(-1, 64)
+		selector = self._region_selector('middle_band')
+		self.X = self._cached_segment_features('middle_band', int(segment.time_span.start_time), int(segment.time_span.duration), lambda res: selector.select(self._cell_flows(res[1])))
 		return self.X
 	
 	def plus_band_tvl1_features_for_segment(self, segment=Segment(0, -1)):
@@ -392,11 +430,11 @@ class OpticalFlowTVL1:
 		Equivalent to:
 		::
 		
-				all_tvl1_features_for_segment(...)[1][:,range(2,6)+range(10,14)+range(16,48)+range(50,54)+range(58,62)].reshape(-1, 576)
+			all_tvl1_features_for_segment(...)[1].reshape(-1, 64, 2)[:,[2..5,10..13,16..47,50..53,58..61],:].reshape(-1, 96)
 		
 		"""
-		
-		self.X = self._tvl1_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1][:,range((2*2),(6*2))+range((10*2),(14*2))+range((16*2),(48*2))+range((50*2),(54*2))+range((58*2),(62*2))].reshape(-1, 96)
+		selector = self._region_selector('plus_band')
+		self.X = self._cached_segment_features('plus_band', int(segment.time_span.start_time), int(segment.time_span.duration), lambda res: selector.select(self._cell_flows(res[1])))
 		return self.X
 	
 	def default_tvl1_features_for_segment(self, func='middle_band_tvl1_features_for_segment', segment=Segment(0, -1)):
@@ -405,6 +443,31 @@ class OpticalFlowTVL1:
 		"""
 		return getattr(self,func)(segment)
 
+	def _segment_frames(self, onset_s=0, duration_s=60):
+		"""
+		Onset and duration of a segment (in seconds; a negative duration means the whole movie) in analysis frames at 24 frames per second, as used by _tvl1_features_for_segment_from_onset_with_duration.
+		"""
+		self._load_metadata()
+		ap = self.analysis_params
+		frames_per_astride = (24.0 / ap['stride']) # 24.0 == ap['fps']
+		onset_frame = int(onset_s * frames_per_astride)
+		if duration_s < 0:
+			dur_frames = int(self.determine_movie_length() * frames_per_astride * (ap['afps'] / ap['fps'])) # convert back to aframes
+		else:
+			dur_frames = int(duration_s * frames_per_astride * (ap['afps'] / ap['fps']))
+		return onset_frame, dur_frames
+	
+	def _cached_segment_features(self, selector, onset_s, duration_s, select):
+		"""
+		Apply select to the (full-frame, grid) tuple that _tvl1_features_for_segment_from_onset_with_duration returns for the segment; the result is served from the feature cache (see featurecache) when it is enabled, keyed by the title's data file, the selector name and the stride.
+		"""
+		load = lambda: select(self._tvl1_features_for_segment_from_onset_with_duration(onset_s, duration_s))
+		if feature_cache() is None:
+			return load()
+		onset_frame, dur_frames = self._segment_frames(onset_s, duration_s)
+		key = (data_file_key(self.data_path), selector, self.analysis_params['stride'])
+		return cached_features(key, onset_frame, (onset_frame + dur_frames), 1, load)
+
 	def _tvl1_features_for_segment_from_onset_with_duration(self, onset_s=0, duration_s=60):
 		"""
 		This will be the interface for grabbing analysis data based on onsets and durations, translating seconds into frames.
@@ -416,24 +479,14 @@ class OpticalFlowTVL1:
 		
 		"""
 		ap = self.analysis_params
-		frames_per_astride = (24.0 / ap['stride']) # 24.0 == ap['fps']
-
-		print ap['fps']
-		print ap['stride']
-		print duration_s
-
-		onset_frame = int(onset_s * frames_per_astride)
-		if duration_s < 0:
-			dur_frames = self.determine_movie_length() * frames_per_astride * (ap['afps'] / ap['fps']) # convert back to aframes
-		else:
-			dur_frames = duration_s * frames_per_astride * (ap['afps'] / ap['fps'])
+		onset_frame, dur_frames = self._segment_frames(onset_s, duration_s)
 		
 		# memmap
-		print dur_frames
-		mapped = np.memmap(self.data_path, dtype='float32', mode='r') #, offset=onset_frame, shape=(dur_frames,(128+16)))
-		mapped = mapped.reshape((-1,144))
-		mapped = ad.interpolate_time(mapped, ap['afps'])
-		return (mapped[(onset_frame+dur_frames),:16], mapped[onset:(onset_frame+dur_frames),16:])
+		_log.debug('df: %s', dur_frames)
+		mapped = map_feature_file(self.data_path, ((8*8*2)+16,))
+		# slice first, then resample only the requested window (a view of the memmap if afps == 24)
+		mapped = ad.interpolate_time_window(mapped, ap['afps'], onset_frame, (onset_frame+dur_frames))
+		return (mapped[:,:16], mapped[:,16:])
 		
 	
 # 	def playback_movie_frame_by_frame(self, offset=None, duration=None):
@@ -465,22 +518,20 @@ class OpticalFlowTVL1:
 		ap = self.analysis_params
 		strides_per_second = (ap['fps'] / ap['stride'])
 	
-		if os.path.exists(self.movie_path) and HAVE_CV:
-			capture = cv2.VideoCapture(self.movie_path)
-			dur_total_seconds = int(capture.get(cv.CV_CAP_PROP_FRAME_COUNT) / ap['fps'])
-			print "mov total secs: ", dur_total_seconds
+		if os.path.exists(self.json_path) or (os.path.exists(self.movie_path) and HAVE_CV):
+			# the frame count comes from the title's metadata; the movie is only opened if the JSON file is missing
+			self._load_metadata()
+			dur_total_seconds = int(self.metadata().frames / ap['fps'])
+			_log.debug('mov total secs: %s', dur_total_seconds)
 		elif os.path.exists(self.data_path):
-			dsize = os.path.getsize(self.data_path)
-			print "dsize: ", dsize
-			# since we are reading raw tvl1 analysis data that always has the same size on disc!
-			# the constant had better be correct!
-			dur_total_aframes = dsize / float(((ap['grid_divs_x'] * ap['grid_divs_y'] * 2) + 16) * 4) # REGIONS * CHANNELS + 16 * BYTES
-			print 'dtaf: ', dur_total_aframes
+			self._load_metadata()	# afps from the data file's header (see _load_metadata)
+			dur_total_aframes = data_file_shape(self.data_path, (((ap['grid_divs_x'] * ap['grid_divs_y'] * 2) + 16),))[0]
+			_log.debug('dtaf: %s', dur_total_aframes)
 			dur_total_seconds = (dur_total_aframes / strides_per_second) * (ap['fps'] / ap['afps'])
-			print "total secs: ", dur_total_seconds
+			_log.debug('total secs: %s', dur_total_seconds)
 		else:
 			dur_total_seconds = -1
-			print "Cannot determine movie duration. Both the movie and data files are missing!"
+			_log.error('Cannot determine movie duration. Both the movie and data files are missing!')
 		self.analysis_params['duration'] = dur_total_seconds
 		return dur_total_seconds
 		
@@ -504,21 +555,22 @@ class OpticalFlowTVL1:
 		
 		"""
 		if not HAVE_CV:
-			print "WARNING: You must install OpenCV in order to analyze or view!"
+			_log.warning('You must install OpenCV in order to analyze or view!')
 			return
 		
 		if (self.movie_path is None) and (self.data_path is None):
-			print "Both movie path and data path are missing! Please supply at least one."
+			_log.error('Both movie path and data path are missing! Please supply at least one.')
 			return None
 		
 		have_mov = os.path.exists(self.movie_path)
 		have_data = os.path.exists(self.data_path)
 		
 		if (have_mov is False) and (have_data is False):
-			print "Both movie file and data file are missing! Please supply at least one."
+			_log.error('Both movie file and data file are missing! Please supply at least one.')
 			return None
 		
  		ap = self._check_tvl1_params(kwargs)
+		self._load_metadata()
 		ap = self.analysis_params
 		verbose = ap['verbose']
 
@@ -552,14 +604,14 @@ class OpticalFlowTVL1:
 		else:
 			offset_secs = 0
 		
-		print "%%% ", ap['duration']
+		_log.debug('duration: %s', ap['duration'])
 		
 		if ap['duration'] > 0:
 			dur_secs = ap['duration']
 		elif ap['duration'] < 0:
 			ap['duration'] = self.determine_movie_length()
 		else:
-			print "Duration cannot be 0."
+			_log.error('Duration cannot be 0.')
 			return
 		dur_secs = ap['duration']
 		
@@ -578,22 +630,21 @@ class OpticalFlowTVL1:
 		dur_frames = dur_strides * stride_frames
 		
 		if verbose:
-			print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
-			print "OFFSET (SECONDS): ", offset_secs
-			print "OFFSET (STRIDES): ", offset_strides
-			print "OFFSET (FRAMES): ", offset_frames
-			print "DUR (SECONDS): ", dur_secs
-			print 'DUR (STRIDES): ', dur_strides
-			print 'DUR (FRAMES): ', dur_frames
-			print 'XDIVS: ', grid_x_divs
-			print 'YDIVS: ', grid_y_divs
-			print "FPS: ", fps
-			print "stride_frames: ", stride_frames
+			_log.info('OFFSET (SECONDS): %s', offset_secs)
+			_log.info('OFFSET (STRIDES): %s', offset_strides)
+			_log.info('OFFSET (FRAMES): %s', offset_frames)
+			_log.info('DUR (SECONDS): %s', dur_secs)
+			_log.info('DUR (STRIDES): %s', dur_strides)
+			_log.info('DUR (FRAMES): %s', dur_frames)
+			_log.info('XDIVS: %s', grid_x_divs)
+			_log.info('YDIVS: %s', grid_y_divs)
+			_log.info('FPS: %s', fps)
+			_log.info('stride_frames: %s', stride_frames)
 		
 		# set up memmap
 		# mode should always be playback and dislay should always be true!!!
 		if ap['mode'] == 'playback' and ap['display'] == True and have_data:
-			fp = np.memmap(self.data_path, dtype='float32', mode='r', shape=((offset_strides + dur_strides),((8*8*2)+16)))
+			fp = map_feature_file(self.data_path, ((8*8*2)+16,))
 			if have_mov:
 				cv2.namedWindow('Image', cv.CV_WINDOW_AUTOSIZE)
 				cv2.resizeWindow('Image', frame_width, frame_height)
@@ -607,7 +658,7 @@ class OpticalFlowTVL1:
 			self.capture.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, offset_frames)
 			ret, frame = self.capture.read()
 			if frame is None: 
-				print 'Frame error! Exiting...'
+				_log.error('Frame error! Exiting...')
 				return # no image captured... end the processing		
 					
 # 		else:
@@ -628,7 +679,7 @@ class OpticalFlowTVL1:
 				# grab next frame
 				ret, frame = self.capture.read()
 				if frame is None: 
-					print 'Frame error! Exiting...'
+					_log.error('Frame error! Exiting...')
 					break # no image captured... end the processing
 			
 			# display stage (gridded)
@@ -650,9 +701,8 @@ class OpticalFlowTVL1:
 			if have_mov:
 				cv.ShowImage('Image', cv.fromarray(frame))
 			cv.ShowImage('Histo', cv.fromarray(histimg))
-			fp.flush()
 
-			print self.frame_idx, ':: ', (float(self.frame_idx - offset_frames) / dur_frames)
+			_log.debug('frame %s :: %s', self.frame_idx, (float(self.frame_idx - offset_frames) / dur_frames))
 				
 			# check p_state				
 			if p_state == 1: # rew. 10 sec.
@@ -675,9 +725,7 @@ class OpticalFlowTVL1:
 			# handle key events
 			k = cv.WaitKey (int(1000 / ap['afps']))
 			if verbose is True:
-				print '>>>>>>>>>>>>>>>>>>'
-				print k % 0x100
-				print p_state
+				_log.info('key: %s, state: %s', (k % 0x100), p_state)
 			
 			if k % 0x100 == 27:
 				# user has press the ESC key, so exit
@@ -718,17 +766,9 @@ class OpticalFlowTVL1:
 		"""
 		Display helper function. Make a bank of three bars for the histogram. (16 in total.)
 		"""
- 		print (h_img, pts,  val, hist_height, hoffset)
 		# the 0.95 scalar is there so that there are gaps between the histograms in the grid view!
 # 		print (int(pts[0][0] + hoffset), int(pts[0][1] + int(voffset)))
 # 		print (int(pts[1][0] + hoffset), int(pts[1][1] + int(voffset) - int(val*hist_height)))
-		print pts[0][0]
-		print hoffset
-		print pts[0][1]
-		print int(voffset)
-		print pts[1][0]
-		print val
-		print hist_height
 
 		cv.Rectangle (h_img,
 				(int(pts[0][0] + hoffset), int(pts[0][1] + int(voffset) + int((1.0 - val)*hist_height*0.95))),
@@ -56,6 +56,58 @@ The full list of settable parameters, with default values and explanations:
 +------------------------+-----------------+----------------------------------------------------+
 | grid_divs_y            | 8               | number of divisions along y axis                   |
 +------------------------+-----------------+----------------------------------------------------+
+| frame_access           | auto            | 'sequential' (decode through, grab() between       |
+|                        |                 | strides), 'seek' (seek to every stride) or 'auto'  |
++------------------------+-----------------+----------------------------------------------------+
+| gop_size               | 12              | keyframe interval of the movie; 'auto' frame access|
+|                        |                 | seeks only when stride > gop_size                  |
++------------------------+-----------------+----------------------------------------------------+
+| prefetch               | 8               | number of frames decoded ahead in a background     |
+|                        |                 | thread; 0 decodes in the analysis thread           |
++------------------------+-----------------+----------------------------------------------------+
+| workers                | 1               | number of processes analyzing contiguous shards of |
+|                        |                 | the film (analysis without display only)           |
++------------------------+-----------------+----------------------------------------------------+
+| analysis_scale         | 1.0             | factor by which frames are downscaled (with area   |
+|                        |                 | interpolation) before they are analyzed            |
++------------------------+-----------------+----------------------------------------------------+
+| analysis_max_dim       | 0               | downscale frames further so that neither dimension |
+|                        |                 | exceeds this many pixels (0: no limit)             |
++------------------------+-----------------+----------------------------------------------------+
+| record_channels        | 3               | values stored per cell: 2 (shifts, thresholded),   |
+|                        |                 | 3 (raw shifts, peak response) or 4 (raw shifts,    |
+|                        |                 | peak response, peak sharpness); see Confidence     |
++------------------------+-----------------+----------------------------------------------------+
+| frame_threshold        | 0.01            | full-frame shifts with a peak response up to this  |
+|                        |                 | are zeroed                                         |
++------------------------+-----------------+----------------------------------------------------+
+| cell_threshold         | 0.7             | grid cell shifts with a peak response up to this   |
+|                        |                 | are zeroed                                         |
++------------------------+-----------------+----------------------------------------------------+
+| buffer_frames          | 64              | number of analysis frames buffered in RAM and      |
+|                        |                 | written to the data file in one slice              |
++------------------------+-----------------+----------------------------------------------------+
+| flush_frames           | 0               | flush the data file to disk every flush_frames     |
+|                        |                 | analysis frames (0: never)                         |
++------------------------+-----------------+----------------------------------------------------+
+| flush_secs             | 60.0            | flush the data file to disk every flush_secs       |
+|                        |                 | seconds (0: never; both 0: only at the end)        |
++------------------------+-----------------+----------------------------------------------------+
+| storage_dtype          | 'float32'       | 'float32', 'float16', 'uint16' or 'uint8': how the |
+|                        |                 | data file stores the values (see featurestore)     |
++------------------------+-----------------+----------------------------------------------------+
+| storage_range          | None            | range of the values for uint8/uint16 storage       |
+|                        |                 | (required for them; values outside are clipped)    |
++------------------------+-----------------+----------------------------------------------------+
+| chunk_frames           | 0               | compress the data file at the end of the analysis, |
+|                        |                 | in chunks of this many analysis frames (0: never;  |
+|                        |                 | see featurestore)                                  |
++------------------------+-----------------+----------------------------------------------------+
+| chunk_codec            | 'zlib'          | 'zlib', 'bz2', 'lzma' or 'blosc' (if installed)    |
++------------------------+-----------------+----------------------------------------------------+
+| resume                 | False           | continue an interrupted analysis after its last    |
+|                        |                 | committed stride (see featurestore)                |
++------------------------+-----------------+----------------------------------------------------+
 | verbose                | False           | useful for debugging                               |
 +------------------------+-----------------+----------------------------------------------------+
 | display                | True            | launch display screen during analysis              |
@@ -97,6 +149,20 @@ This also works, so you can define your own file locations:
 	pcorr = PhaseCorrelation('Psycho', action_dir='~/somewhere')
 	pcorr.analyze_movie()
 
+To split a long film into four contiguous shards that are analyzed in parallel processes:
+
+.. code-block:: python
+
+	pcorr = PhaseCorrelation('Psycho')
+	pcorr.analyze_movie(workers=4)
+
+To analyze 1080p sources at no more than 640 pixels in either dimension, which is several times faster; see scripts/benchmark_analysis_scale.py for how far the features drift from full resolution:
+
+.. code-block:: python
+
+	pcorr = PhaseCorrelation('Psycho', analysis_max_dim=640)
+	pcorr.analyze_movie()
+
 To screen (the video only) of your film as it is analyzed:
 
 .. code-block:: python
@@ -151,6 +217,21 @@ There is a default stride time of 6 frames (or 24 / 6 = 4 analyzed frames per se
 
 Note that choosing 'stride' values that are not factors of 24 will result in analysis rates that do not fit neatly into one second periods.
 
+Confidence
+==========
+
+Each shift comes with the response of its correlation peak (and the sharpness of the peak; see phase_correlation_peaks). Shifts with weak peaks are unreliable, and the accessors zero out the shifts whose response is not above cell_threshold (frame_threshold for the full frame). By default, the data file stores the raw shifts along with the response, so the thresholds are applied when the data is read and can be tuned without analyzing the film again. The sharpness is stored as well if the film is analyzed with record_channels=4 (a third more data):
+
+.. code-block:: python
+
+	pcorr = PhaseCorrelation('Psycho', cell_threshold=0.5)
+	data = pcorr.middle_band_phasecorr_features_for_segment(Segment(60, 600))
+	response, sharpness = pcorr.phasecorr_confidence_for_segment(Segment(60, 600))	# sharpness: None, unless analyzed with record_channels=4
+
+Data files analyzed with record_channels=2, and those of earlier versions, hold only the shifts, thresholded at analysis time with the thresholds of the analysis. The number of channels is recorded with the data file's layout in the title's JSON file.
+
+The correlations are computed by a GridPhaseCorrelator, which transforms all grid cells of a frame in one batched FFT and keeps the spectra of every frame for its correlation with the next one, instead of calling cv2.phaseCorrelateRes 65 times per frame; see phase_correlation_peaks for how its results relate to those of OpenCV.
+
 Playback
 ========
 
@@ -174,23 +255,139 @@ __email__ = 'thomas.m.stoll@dartmouth.edu'
 
 
 import sys, time, os
+from actionlog import *
+_log = get_logger(__name__)
 # import the necessary things for OpenCV
 try:
 	import cv2
 	import cv2.cv as cv
 	HAVE_CV = True
 except ImportError:
-	print 'WARNING: Access only, use of methods other than *_phasecorr_features_for_segment, etc. will cause errors! Install OpenCV to perform analysis and display movies/data.'
+	_log.warning('Access only, use of methods other than *_phasecorr_features_for_segment, etc. will cause errors! Install OpenCV to perform analysis and display movies/data.')
 	HAVE_CV = False
 import numpy as np
 import json
 from segment import *
 from actiondata import *
+from framesource import *
+from featurestore import *
+from metadata import *
+from featurecache import *
+from regions import *
 ad = ActionData()
 av = ActionView()
 
 
-class PhaseCorrelation:
+def hanning_window(width, height):
+	"""
+	Two-dimensional Hanning window [HEIGHT, WIDTH], the same as cv2.createHanningWindow((width, height), cv2.CV_32FC1): the square root of the outer product of the one-dimensional windows.
+	"""
+	return np.sqrt(np.outer(np.hanning(height), np.hanning(width))).astype('float32')
+
+
+def phase_correlation_peaks(prev_spectra, spectra, shape):
+	"""
+	Phase correlation of a batch of images with the images before them, from their spectra (np.fft.rfft2 of the windowed images: [N, HEIGHT, WIDTH / 2 + 1]; shape is (HEIGHT, WIDTH)). Returns the shifts ([N, 2], (x, y) in pixels), the peak responses ([N]) and the peak sharpness ([N]). Shifts and responses are computed as cv2.phaseCorrelateRes computes them: the normalized cross-power spectrum is transformed back (all images in one batched inverse transform), the peak of every correlation surface is located, and the shift is the centroid of the 5 by 5 neighbourhood of the peak (clipped at the borders of the surface), weighted by the surface values, whose sum is the response. The sharpness is the share of the response in the peak pixel itself: close to 1 for a clean integer shift, lower for peaks that are smeared out (sub-pixel, blurred or ambiguous motion).
+	
+	Unlike cv2.phaseCorrelateRes, the images are not padded to an optimal transform size, and the zero shift of an odd-sized surface is at its middle pixel; this makes shifts of odd-sized images exact.
+	"""
+	height, width = shape
+	cross = prev_spectra * np.conj(spectra)
+	magnitude = np.abs(cross)
+	cross /= np.where(magnitude > 0.0, magnitude, 1.0)
+	surfaces = np.fft.fftshift(np.fft.irfft2(cross, s=shape), axes=(-2, -1))
+	num = surfaces.shape[0]
+	peak_y, peak_x = np.divmod(surfaces.reshape(num, -1).argmax(1), width)
+	offsets = np.arange(-2, 3)
+	rows, cols = peak_y[:, np.newaxis] + offsets, peak_x[:, np.newaxis] + offsets
+	inside = ((rows >= 0) & (rows < height))[:, :, np.newaxis] & ((cols >= 0) & (cols < width))[:, np.newaxis, :]
+	weights = surfaces[np.arange(num)[:, np.newaxis, np.newaxis], np.clip(rows, 0, height - 1)[:, :, np.newaxis], np.clip(cols, 0, width - 1)[:, np.newaxis, :]] * inside
+	responses = weights.sum(axis=(1, 2))
+	total = responses + np.finfo(np.float64).eps
+	centroid_x = (weights.sum(axis=1) * cols).sum(axis=1) / total
+	centroid_y = (weights.sum(axis=2) * rows).sum(axis=1) / total
+	shifts = np.column_stack(((width // 2) - centroid_x, (height // 2) - centroid_y))
+	sharpness = weights[:, 2, 2] / total
+	return shifts, responses, sharpness
+
+
+def threshold_shifts(records, frame_threshold=0.01, cell_threshold=0.7):
+	"""
+	The shifts of phase correlation records ([..., CELLS + 1, CHANNELS], full frame last), with every shift whose peak response is not above cell_threshold (frame_threshold for the full frame) set to zero: [..., CELLS + 1, 2]. Records with only the two shift channels were thresholded at analysis time and are returned as they are.
+	"""
+	if records.shape[-1] <= 2:
+		return records
+	thresholds = np.empty(records.shape[-2], dtype=np.float32)
+	thresholds[:-1] = cell_threshold
+	thresholds[-1] = frame_threshold
+	return np.where((np.abs(records[..., 2]) > thresholds)[..., np.newaxis], records[..., :2], 0.0).astype(np.float32)
+
+
+class GridPhaseCorrelator(object):
+	"""
+	Batched phase correlation of a frame and its grid cells with the previous frame. The grayscale frame is cut into a [CELLS, HEIGHT, WIDTH] stack of cells (row by row), the Hanning windows are precomputed and applied to the whole stack at once, and all cell spectra are computed in one batched np.fft.rfft2. The spectra of a frame are kept and reused when the next frame is correlated with it, so every frame is transformed only once (cv2.phaseCorrelateRes transforms both of its images every time).
+	
+	::
+	
+		correlator = GridPhaseCorrelator((640, 360), 8, 8)
+		prev_spectra = correlator.spectra(prev_frame)
+		spectra = correlator.spectra(frame)
+		record = correlator.correlate(prev_spectra, spectra)	# [65, 2]
+	
+	A record holds the shifts of the cells, normalized by the cell size, followed by the shift of the whole frame, normalized by the frame size: [CELLS + 1, channels]. With two channels, only the shifts are kept, and those whose peak response is not above cell_threshold (frame_threshold for the whole frame) are set to zero, as in the data files of earlier versions. With three channels, the shifts are kept as they are, and the peak response follows them; with four, the peak sharpness follows the response (see phase_correlation_peaks), so that the shifts can be thresholded later (see threshold_shifts).
+	"""
+	def __init__(self, frame_size, grid_divs_x=8, grid_divs_y=8, frame_threshold=0.01, cell_threshold=0.7, channels=2):
+		self.frame_width, self.frame_height = frame_size
+		self.grid_divs_x = grid_divs_x
+		self.grid_divs_y = grid_divs_y
+		self.grid_width = int(self.frame_width / grid_divs_x)
+		self.grid_height = int(self.frame_height / grid_divs_y)
+		self.frame_threshold = frame_threshold
+		self.cell_threshold = cell_threshold
+		self.channels = channels
+		self.frame_window = hanning_window(self.frame_width, self.frame_height)
+		self.cell_window = hanning_window(self.grid_width, self.grid_height)
+	
+	def gray(self, frame):
+		"""
+		Floating-point grayscale version of a (BGR) frame.
+		"""
+		if frame.ndim == 3:
+			frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+		return np.float32(frame)
+	
+	def cells(self, frame_gray):
+		"""
+		The grid cells of a grayscale frame as a [CELLS, HEIGHT, WIDTH] stack (a copy); pixels beyond the last full row or column of cells are left out.
+		"""
+		gw, gh = self.grid_width, self.grid_height
+		cropped = frame_gray[:(self.grid_divs_y * gh), :(self.grid_divs_x * gw)]
+		return cropped.reshape(self.grid_divs_y, gh, self.grid_divs_x, gw).swapaxes(1, 2).reshape(-1, gh, gw)
+	
+	def spectra(self, frame):
+		"""
+		The spectra of a (BGR or grayscale) frame: ([1, HEIGHT, WIDTH / 2 + 1] for the frame, [CELLS, ...] for its cells).
+		"""
+		frame_gray = self.gray(frame)
+		return (np.fft.rfft2((frame_gray * self.frame_window)[np.newaxis]), np.fft.rfft2(self.cells(frame_gray) * self.cell_window))
+	
+	def correlate(self, prev_spectra, spectra):
+		"""
+		Record ([CELLS + 1, channels]) of the shifts from the frame of prev_spectra to the frame of spectra.
+		"""
+		record = np.zeros(((self.grid_divs_x * self.grid_divs_y) + 1, 4), dtype=np.float32)
+		shifts, responses, sharpness = phase_correlation_peaks(prev_spectra[0], spectra[0], (self.frame_height, self.frame_width))
+		record[-1, :2] = shifts[0] / [self.frame_width, self.frame_height]
+		record[-1, 2], record[-1, 3] = responses[0], sharpness[0]
+		shifts, responses, sharpness = phase_correlation_peaks(prev_spectra[1], spectra[1], (self.grid_height, self.grid_width))
+		record[:-1, :2] = shifts / [self.grid_width, self.grid_height]
+		record[:-1, 2], record[:-1, 3] = responses, sharpness
+		if self.channels <= 2:
+			return threshold_shifts(record, self.frame_threshold, self.cell_threshold)
+		return record[:, :self.channels]
+
+
+class PhaseCorrelation(object):
 	"""
 	Phase correlation of frame and 8-by-8 grid of subframes.
 	
@@ -214,31 +411,53 @@ class PhaseCorrelation:
 		ap = self.analysis_params
 		
 		if filename is None:
-			print 'File name missing!'
+			_log.error('File name missing!')
 			return
 		else:
 			self.movie_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + ap['movie_extension']))
 			self.data_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + ap['data_extension']))
 			self.json_path = os.path.join(os.path.expanduser(ap['action_dir']), filename, (filename + '.json'))
-			print self.json_path
+			_log.debug('JSON file: %s', self.json_path)
 			self.filename = filename
 
-		# self.determine_movie_length() no need
- 		if (os.path.exists(self.json_path) != True):
- 			self._write_metadata_to_json()
-		ap['afps'] = self._read_json_value('fps')
-
-		# try to naively get some data and store in a class var
-		if os.path.exists(self.data_path):
-			self.default_phasecorr_features_for_segment()
+		# metadata and default features are loaded lazily (see _load_metadata and X)
+		self._afps = None
+		self._X = None
+	
+	def _load_metadata(self):
+		"""
+		Set the access frame rate (afps) from the title's metadata (see metadata). Done on first use, and not at construction time, since the metadata may have to be read from the movie; later calls only check that the JSON file has not changed. If neither the JSON file nor the movie is there, but the data file is, afps comes from the data file's header instead (and stays at the afps parameter for a headerless file), so that the features can be read without the movie.
+		"""
+		if os.path.exists(self.json_path) or (os.path.exists(self.movie_path) and HAVE_CV) or not os.path.exists(self.data_path):
+			self._afps = self.metadata().fps
 		else:
-			self.X = None
+			header = read_feature_header(self.data_path)
+			if header is None or header.fps <= 0:
+				return
+			self._afps = header.fps
+		self.analysis_params['afps'] = self._afps
+	
+	def _get_X(self):
+		if self._X is None and os.path.exists(self.data_path):
+			self.default_phasecorr_features_for_segment()
+		return self._X
+	
+	def _set_X(self, X):
+		self._X = X
+	
+	def _del_X(self):
+		self._X = None
+	
+	X = property(_get_X, _set_X, _del_X, doc="Default features of the title (see default_phasecorr_features_for_segment), loaded from the data file on first access and cached. Accessor functions replace them with the features they return; del pcorr.X releases them.")
 	
 	def _check_pcorr_params(self, analysis_params=None):
 		"""
-		Simple mechanism to read in default parameters while substituting custom parameters.
+		Simple mechanism to read in default parameters while substituting custom parameters. The custom parameters are merged into the current ones (those passed to the constructor and to earlier calls), so that a call like analyze_movie only overrides the parameters it passes; missing ones are filled in from the defaults.
 		"""
-		self.analysis_params = analysis_params if analysis_params is not None else self.analysis_params
+		if not hasattr(self, 'analysis_params'):
+			self.analysis_params = {}
+		if analysis_params is not None:
+			self.analysis_params.update(analysis_params)
 		dpcp = self.default_phasecorr_params()
 		for k in dpcp.keys():
 			self.analysis_params[k] = self.analysis_params.get(k, dpcp[k])
@@ -258,8 +477,23 @@ class PhaseCorrelation:
 			'offset' : 0,				# time offset in seconds
 			'duration' : -1,			# time duration in seconds, -1 (default) maps to full duration of media
 			'stride' : 1,				# number of frames to that comprise one analysis point, skips stride - 1 frames
-			'grid_divs_x' : 8,
-			'grid_divs_y' : 8,
+			'frame_access' : 'auto',	# 'auto', 'sequential' (decode straight through, grab() between strides) or 'seek' (seek every stride)
+			'gop_size' : 12,			# keyframe interval of the movie files, used by 'auto' frame access (1 for intra-only codecs)
+			'prefetch' : 8,				# number of frames to decode ahead in a background thread, 0 to decode in the analysis thread
+			'workers' : 1,				# number of processes (contiguous shards of the film) for analysis without display
+			'analysis_scale' : 1.0,		# downscale frames by this factor (area interpolation) before analysis
+			'analysis_max_dim' : 0,		# downscale frames so that neither dimension exceeds this (0: no limit)
+			'record_channels' : 3,		# values per cell in the data file: 2 (thresholded shifts), 3 (raw shifts, peak response) or 4 (raw shifts, peak response, peak sharpness)
+			'frame_threshold' : 0.01,	# full-frame shifts with a peak response up to this are zeroed (at access time, unless record_channels is 2)
+			'cell_threshold' : 0.7,		# same for the grid cells
+			'buffer_frames' : 64,		# number of analysis frames buffered in RAM before they are written to the data file
+			'flush_frames' : 0,			# flush the data file every flush_frames analysis frames (0: never)
+			'flush_secs' : 60.0,		# flush the data file every flush_secs seconds (0: never; with both 0, only at the end)
+			'storage_dtype' : 'float32',	# 'float32', 'float16', 'uint16' or 'uint8' (see featurestore)
+			'storage_range' : None,	# [low, high] of the values, for uint16 and uint8 storage
+			'chunk_frames' : 0,			# compress the data file in chunks of this many analysis frames when the analysis is complete (0: never)
+			'chunk_codec' : 'zlib',		# 'zlib', 'bz2', 'lzma' or 'blosc' (if installed)
+			'resume' : False,			# continue an interrupted analysis run from its progress record
 			'verbose' : False,			# useful for debugging
 			'display' : True,			# Launch display screen
 			'viz_shrink_factor' : 0.5,	# (adjustable) ratio for size of histogram window
@@ -270,31 +504,43 @@ class PhaseCorrelation:
 		}
 		return analysis_params
 
+	def metadata(self):
+		"""
+		The title's MovieMetadata (fps, frames, width, height, aspect, length and data layouts; see the metadata module). Read from the title's JSON file once and shared with the other analyzers of the title; the movie is only opened if the JSON file does not exist yet.
+		"""
+		return movie_metadata(self.json_path, self.movie_path, self.filename)
+	
 	def _write_metadata_to_json(self):
 		"""
+		(Re)write the title's JSON file from the movie, keeping the data layouts recorded there.
 		"""
-		title = self.filename
-		capture = cv2.VideoCapture(self.movie_path)
-		fps = capture.get(cv.CV_CAP_PROP_FPS)
-		aspect = capture.get(cv.CV_CAP_PROP_FRAME_WIDTH / cv.CV_CAP_PROP_FRAME_HEIGHT)
-		frames = capture.get(cv.CV_CAP_PROP_FRAME_COUNT)
-		length = float(frames) / float(fps)
-		
-		
-		movdict = {'title':title, 'fps':fps, 'aspect': aspect,'frames': frames, 'length':length}
-		fp = file(self.json_path, 'w')
-		fp.write(json.dumps(movdict))
-		fp.close()
-		del capture
+		write_movie_metadata(self.json_path, self.movie_path, self.filename)
 		return 1
 	
 	def _read_json_value(self, key='fps'):
-# 		fp = file(self.json_path, 'r')
-		jsonfile = open(self.json_path)
-		jsondata = json.load(jsonfile)
-		return jsondata[key]
+		return self.metadata()[key]
 
 
+	def _correlator(self, frame_size):
+		"""
+		A GridPhaseCorrelator for frames of frame_size (width, height), set up from the analysis parameters.
+		"""
+		ap = self.analysis_params
+		return GridPhaseCorrelator(frame_size, ap['grid_divs_x'], ap['grid_divs_y'], ap['frame_threshold'], ap['cell_threshold'], ap['record_channels'])
+	
+	def _record_channels(self):
+		"""
+		Number of values per cell in the data file, as recorded with its layout in the title's JSON file (2 for data files that have no record of it).
+		"""
+		return self.metadata().layout(self.analysis_params['data_extension']).get('channels', 2)
+	
+	def _region_selector(self, name):
+		"""
+		The named region selector (see regions) compiled for the analysis grid (grid_divs_x by grid_divs_y).
+		"""
+		ap = self.analysis_params
+		return region_selector(name, ap['grid_divs_x'], ap['grid_divs_y'])
+	
 	def all_phasecorr_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
 		"""
 		This will be the interface for grabbing analysis data for segments of the whole film. Uses Segment objects from ACTION!
@@ -311,8 +557,8 @@ class PhaseCorrelation:
 			>>> (1440, 768)
 		
 		"""
-		res = self._phasecorr_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[0:-1:access_stride]
-		return (res[0].reshape(-1, 2), res[1].reshape(-1, 128))
+		res = self._phasecorr_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)
+		return (res[0][::access_stride].reshape(-1, 2), self._region_selector('gridded').select(res[1], access_stride))
 	
 	def full_phasecorr_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
 		"""
@@ -322,7 +568,7 @@ class PhaseCorrelation:
 			phasecorr_features_for_segment(...)[0].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._phasecorr_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[0].reshape(-1, 2)[0:-1:access_stride, :]
+		self.X = self._cached_segment_features('full', segment.time_span.start_time, segment.time_span.duration, access_stride, lambda res: res[0][0:-1:access_stride].reshape(-1, 2), drop_last=True)
 		return self.X
 	
 	def gridded_phasecorr_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
@@ -345,7 +591,8 @@ class PhaseCorrelation:
 			phasecorr_features_for_segment(...)[1].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._phasecorr_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[1].reshape(-1, 128)[::access_stride,:]
+		selector = self._region_selector('gridded')
+		self.X = self._cached_segment_features('gridded', segment.time_span.start_time, segment.time_span.duration, access_stride, lambda res: selector.select(res[1], access_stride))
 		return self.X
 	
 	def center_quad_phasecorr_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
@@ -366,8 +613,8 @@ class PhaseCorrelation:
 			phasecorr_features_for_segment(...)[1][:,[18..21,26..29,34..37,42..45,..],...].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		cq_array = range(18,22)+range(26,30)+range(34,38)+range(42,46)
-		self.X = self._phasecorr_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[1][:,cq_array,...].reshape(-1, 32)[::access_stride,:]
+		selector = self._region_selector('center_quad')
+		self.X = self._cached_segment_features('center_quad', segment.time_span.start_time, segment.time_span.duration, access_stride, lambda res: selector.select(res[1], access_stride))
 		return self.X
 
 	def middle_band_phasecorr_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
@@ -388,7 +635,8 @@ class PhaseCorrelation:
 			phasecorr_features_for_segment(...)[1][:,16:47,...].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		self.X = self._phasecorr_features_for_segment_from_onset_with_duration(int(segment.time_span.start_time), int(segment.time_span.duration))[1][:,16:48,...].reshape(-1, 64)[::access_stride,:]
+		selector = self._region_selector('middle_band')
+		self.X = self._cached_segment_features('middle_band', int(segment.time_span.start_time), int(segment.time_span.duration), access_stride, lambda res: selector.select(res[1], access_stride))
 		return self.X
 	
 	def plus_band_phasecorr_features_for_segment(self, segment=Segment(0, -1), access_stride=6):
@@ -411,9 +659,27 @@ class PhaseCorrelation:
 			phasecorr_features_for_segment(...)[1][:,[2..5,10..13,16..47,50..53,58..61],...].reshape((segment.time_span.duration*4), -1)
 		
 		"""
-		plus_array = range(2,6)+range(10,14)+range(16,48)+range(50,54)+range(58,62)
-		return self._phasecorr_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration)[1][:,plus_array,...].reshape(-1, 96)[::access_stride,-1]
+		selector = self._region_selector('plus_band')
+		self.X = self._cached_segment_features('plus_band', segment.time_span.start_time, segment.time_span.duration, access_stride, lambda res: selector.select(res[1], access_stride))
+		return self.X
 
+	def phasecorr_confidence_for_segment(self, segment=Segment(0, -1), access_stride=6):
+		"""
+		Return the peak responses and the peak sharpness of the full frame and the grid cells, unthresholded: ([NUMBER OF FRAMES, 1 + CELLS (64)], [NUMBER OF FRAMES, 1 + CELLS (64)]), with the full frame first. The sharpness is None if the data file has no sharpness channel; both are None for data files with only the (thresholded) shifts.
+		
+		::
+		
+			response, sharpness = pcorr.phasecorr_confidence_for_segment(Segment(60, 600))
+			reliable = response[:,1:] > 0.5
+		
+		"""
+		full, grid = self._phasecorr_features_for_segment_from_onset_with_duration(segment.time_span.start_time, segment.time_span.duration, raw=True)
+		channels = full.shape[-1]
+		if channels <= 2:
+			return None, None
+		confidence = np.concatenate((full[::access_stride, np.newaxis, 2:], grid[::access_stride, :, 2:]), axis=1)
+		return confidence[:,:,0], (confidence[:,:,1] if channels > 3 else None)
+	
 	def default_phasecorr_features_for_segment(self, func='middle_band_phasecorr_features_for_segment', segment=Segment(0, -1), access_stride=6):
 		"""
 		DYNAMIC ACCESS FUNCTION
@@ -421,36 +687,57 @@ class PhaseCorrelation:
 		return getattr(self,func)(segment, access_stride)
 
 
-	def _phasecorr_features_for_segment_from_onset_with_duration(self, onset_s=0, duration_s=-1):
+	def _segment_frames(self, onset_s=0, duration_s=-1):
 		"""
-		This will be the interface for grabbing analysis data based on onsets and durations, translating seconds into frames.
-		Takes a file name or complete path of a data file, an onset time in seconds, and a duration in seconds.
-		Returns a tuple of memory-mapped arrays...
+		Onset and duration of a segment (in seconds; a negative duration means the whole movie) in analysis frames at 24 frames per second, as used by _phasecorr_features_for_segment_from_onset_with_duration.
 		"""
+		self._load_metadata()
 		ap = self.analysis_params
 		frames_per_astride = (24.0 / ap['stride']) # 24.0, not ap['fps']
-
-		print ap['fps']
-		print ap['stride']
-		print duration_s
-		
 		onset_frame = int(onset_s * frames_per_astride)
 		if duration_s < 0:
 			dur_frames = int(self.determine_movie_length() * frames_per_astride * (ap['afps'] / ap['fps']))
 		else:
 			dur_frames = int(duration_s * frames_per_astride * (ap['afps'] / ap['fps']))
+		return onset_frame, dur_frames
+	
+	def _cached_segment_features(self, selector, onset_s, duration_s, access_stride, select, drop_last=False):
+		"""
+		Apply select to the (full-frame, grid) tuple that _phasecorr_features_for_segment_from_onset_with_duration returns for the segment; select is expected to return every access_stride-th frame of the window (all but the last frame of the window, if drop_last). The result is served from the feature cache (see featurecache) when it is enabled, keyed by the title's data file, the selector name, the stride, the access stride and the thresholds.
+		"""
+		load = lambda: select(self._phasecorr_features_for_segment_from_onset_with_duration(onset_s, duration_s))
+		if feature_cache() is None:
+			return load()
+		onset_frame, dur_frames = self._segment_frames(onset_s, duration_s)
+		end_frame = (onset_frame + dur_frames - 1) if drop_last else (onset_frame + dur_frames)
+		key = (data_file_key(self.data_path), selector, self.analysis_params['stride'], access_stride, self.analysis_params['frame_threshold'], self.analysis_params['cell_threshold'])
+		return cached_features(key, onset_frame, end_frame, access_stride, load)
+
+
+	def _phasecorr_features_for_segment_from_onset_with_duration(self, onset_s=0, duration_s=-1, raw=False):
+		"""
+		This will be the interface for grabbing analysis data based on onsets and durations, translating seconds into frames.
+		Takes a file name or complete path of a data file, an onset time in seconds, and a duration in seconds.
+		Returns a tuple of memory-mapped arrays...
 		
-		print 'df: ', dur_frames
+		The shifts are thresholded (see threshold_shifts, frame_threshold and cell_threshold) and returned without the other channels, unless raw is True.
+		"""
+		ap = self.analysis_params
+		onset_frame, dur_frames = self._segment_frames(onset_s, duration_s)
+		
+		_log.debug('df: %s', dur_frames)
 		# print "data path: ", self.data_path
 		try:
-			mapped = np.memmap(self.data_path, dtype='float32', mode='r')
+			mapped = map_feature_file(self.data_path, (65, self._record_channels()))
 		except IOError:
-			print "Attempting to access data file/mem map that does not exist!"
+			_log.error('Attempting to access data file/mem map that does not exist!')
 			return None
-		print mapped.shape
-		mapped = mapped.reshape((-1,65,2))
-		mapped = ad.interpolate_time(mapped, ap['afps'])
-		return mapped[onset_frame:(onset_frame+dur_frames),64,:], mapped[onset_frame:(onset_frame+dur_frames),:64,:]
+		_log.debug('mapped: %s', mapped.shape)
+		# slice first, then resample only the requested window (a view of the memmap if afps == 24)
+		mapped = ad.interpolate_time_window(mapped, ap['afps'], onset_frame, (onset_frame+dur_frames))
+		if not raw:
+			mapped = threshold_shifts(mapped, ap['frame_threshold'], ap['cell_threshold'])
+		return mapped[:,64,:], mapped[:,:64,:]
 
 
 	def playback_movie_frame_by_frame(self, offset=0, duration=-1):
@@ -481,34 +768,35 @@ class PhaseCorrelation:
 		ap = self.analysis_params
 		strides_per_second = float(ap['fps'] / ap['stride'])
 		
-		if os.path.exists(self.movie_path) and HAVE_CV:
-	 		self.capture = cv2.VideoCapture(self.movie_path)
-			dur_total_seconds = self.capture.get(cv.CV_CAP_PROP_FRAME_COUNT) / ap['afps']
-			print "mov total secs: ", dur_total_seconds
+		if os.path.exists(self.json_path) or (os.path.exists(self.movie_path) and HAVE_CV):
+			# the frame count comes from the title's metadata; the movie is only opened if the JSON file is missing
+			self._load_metadata()
+			dur_total_seconds = self.metadata().frames / ap['afps']
+			_log.debug('mov total secs: %s', dur_total_seconds)
 		elif os.path.exists(self.data_path):
-			dsize = os.path.getsize(self.data_path)
-			# since we are reading raw color analysis data that always has the same size on disc!
-			# the constant had better be correct!
-			print "dsize: ", dsize
-			dur_total_aframes = dsize / float(((ap['grid_divs_x'] * ap['grid_divs_y'])+1) * 2 * 4) # REGIONS * CHANNELS * BINS * BYTES
-			print 'dtaf: ', dur_total_aframes
+			self._load_metadata()	# afps from the data file's header (see _load_metadata)
+			dur_total_aframes = data_file_shape(self.data_path, (((ap['grid_divs_x'] * ap['grid_divs_y']) + 1), self._record_channels()))[0]
+			_log.debug('dtaf: %s', dur_total_aframes)
 			dur_total_seconds = (dur_total_aframes / strides_per_second) * (ap['fps'] / ap['afps'])
-			print "total secs: ", dur_total_seconds
+			_log.debug('total secs: %s', dur_total_seconds)
 		else:
 			dur_total_seconds = -1
-			print "Cannot determine movie duration. Both the movie and data files are missing!"
+			_log.error('Cannot determine movie duration. Both the movie and data files are missing!')
 		self.analysis_params['duration'] = dur_total_seconds			
 		return dur_total_seconds
 
-	def analyze_movie(self):
+	def analyze_movie(self, workers=1, resume=False):
 		"""
 		Analyze the movie without displaying on screen. Equivalent to:
 		::
 		
-			_process_movie(movie_file='Psycho.mov', data_file='Psycho.color_lab', offset=0, duration=-1, stride=6, display=False)
+			_process_movie(movie_file='Psycho.mov', data_file='Psycho.color_lab', offset=0, duration=-1, stride=6, display=False, workers=1, resume=False)
+		
+		With workers > 1, the film is split into that many contiguous shards of strides, which are analyzed in parallel processes, each writing its own slice of the data file. Every shard also decodes the frame just before its first frame, so that the frame-to-frame correlations at the shard boundaries are the same as in a serial run.
 		
+		With resume=True, an interrupted run (see featurestore.ProgressRecord) is continued after its last committed stride, provided that it was made with the same parameters from the same movie file; otherwise the analysis starts over. As with the shards, the stride before the first uncommitted one is decoded again to seed the correlation.
 		"""
-		self._process_movie(mode='analyze', display=False)
+		self._process_movie(mode='analyze', display=False, workers=workers, resume=resume)
 
 	def analyze_movie_with_display(self):
 		"""
@@ -528,32 +816,35 @@ class PhaseCorrelation:
 		"""
 
 		ap = self._check_pcorr_params(kwargs)
+		self._load_metadata()
 		verbose = ap['verbose']
 
 		if not HAVE_CV:
-			print "WARNING: You must install OpenCV in order to analyze or view!"
+			_log.warning('You must install OpenCV in order to analyze or view!')
 			return
 		
 		if (self.movie_path is None) and (self.data_path is None) and ap['mode'] is 'analysis':
-			print "ERROR: Must supply both a movie and a data path for analysis!"
+			_log.error('Must supply both a movie and a data path for analysis!')
 			return
 		
 		have_mov = os.path.exists(self.movie_path)
 		have_data = os.path.exists(self.data_path)
 		
 		if (have_mov is False) and (have_data is False):
-			print "Both movie file and data file are missing! Please supply at least one."
+			_log.error('Both movie file and data file are missing! Please supply at least one.')
 			return None
 		
-		print ap
+		_log.debug('analysis params: %s', ap)
 
 		if have_mov:
 	 		self.capture = cv2.VideoCapture(self.movie_path)
 			frame_width = int(self.capture.get(cv.CV_CAP_PROP_FRAME_WIDTH))
 			frame_height = int(self.capture.get(cv.CV_CAP_PROP_FRAME_HEIGHT))
+			# frames are downscaled once, as they are decoded, to the analysis frame size
+			frame_width, frame_height = analysis_frame_size(frame_width, frame_height, ap['analysis_scale'], ap['analysis_max_dim'])
 		else:
 			frame_width = 640
-			frame_height = int(frame_width / self._read_json_value('aspect'))
+			frame_height = int(frame_width / self.metadata().aspect)
 		
 		fps = ap['fps']
 		grid_x_divs = ap['grid_divs_x']
@@ -567,32 +858,27 @@ class PhaseCorrelation:
 		centers_y = range((frame_height/16),frame_height,(frame_height/8))
 		
 		if verbose:
-			print fps, ' | ', frame_size, ' | ', grid_size
+			_log.info('fps, frame size, grid size: %s | %s | %s', fps, frame_size, grid_size)
 		
-		# container for prev. frame's grayscale subframes
-		prev_sub_grays = []								
-
 		if ap['offset'] > 0:
 			offset_secs = ap['offset']
 		else:
 			offset_secs = 0
 		
-		print "%%% ", ap['duration']
+		_log.debug('duration: %s', ap['duration'])
 		
 		if ap['duration'] > 0:
 			dur_secs = ap['duration']
 		elif ap['duration'] < 0:
 			ap['duration'] = self.determine_movie_length()
 		else:
-			print "Duration cannot be 0."
+			_log.error('Duration cannot be 0.')
 			return
 		dur_secs = ap['duration']
 		
 		stride_frames = ap['stride']
 		stride_hop = stride_frames - 1
 
-		print "1. ", ap['duration']
-		print "2. ", dur_secs
 		
 		# check offset first, then compress duration, if needed
 		offset_secs = min(max(offset_secs, 0), ap['duration'])
@@ -603,137 +889,167 @@ class PhaseCorrelation:
 		dur_frames = dur_strides * stride_frames
 		
 		if verbose:
-			print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
-			print 'DUR TOTAL: ', dur_total_secs
-			print "OFFSET (SECONDS): ", offset_secs
-			print "OFFSET (STRIDES): ", offset_strides
-			print "OFFSET (FRAMES): ", offset_frames
-			print "DUR (SECONDS): ", dur_secs
-			print 'DUR (STRIDES): ', dur_strides
-			print 'DUR (FRAMES): ', dur_frames
-			print 'XDIVS: ', grid_x_divs
-			print 'YDIVS: ', grid_y_divs
-			print "FPS: ", fps
-			print "stride_frames: ", stride_frames
-		
-		# set up memmap
+			_log.info('DUR TOTAL: %s', ap['duration'])
+			_log.info('OFFSET (SECONDS): %s', offset_secs)
+			_log.info('OFFSET (STRIDES): %s', offset_strides)
+			_log.info('OFFSET (FRAMES): %s', offset_frames)
+			_log.info('DUR (SECONDS): %s', dur_secs)
+			_log.info('DUR (STRIDES): %s', dur_strides)
+			_log.info('DUR (FRAMES): %s', dur_frames)
+			_log.info('XDIVS: %s', grid_x_divs)
+			_log.info('YDIVS: %s', grid_y_divs)
+			_log.info('FPS: %s', fps)
+			_log.info('stride_frames: %s', stride_frames)
+		
+		# set up memmap (and, for analysis, the progress record)
+		start_stride = 0
 		if ap['mode'] == 'playback' and ap['display'] == True:
-			fp = np.memmap(self.data_path, dtype='float32', mode='r', shape=((offset_strides + dur_strides),(64+1),2))
+			fp = map_feature_file(self.data_path, ((64+1), self._record_channels()))
 		else:
-			fp = np.memmap(self.data_path, dtype='float32', mode='w+', shape=(dur_strides,(64+1),2))
+			shape = (dur_strides,(64+1),ap['record_channels'])
+			progress = ProgressRecord(progress_path(self.data_path), ap, self.movie_path, shape)
+			fp, start_stride = open_feature_file(self.data_path, shape, progress, resume=ap['resume'], header=feature_header(shape, ap, self.metadata()))
+			if progress.complete:
+				_log.info('Analysis already complete: %s', self.data_path)
+				return
+			if verbose and start_stride > 0: _log.info('resuming at stride: %s', start_stride)
+			record_layout(self.json_path, ap['data_extension'], {'grid_divs_x' : grid_x_divs, 'grid_divs_y' : grid_y_divs, 'stride' : ap['stride'], 'channels' : ap['record_channels']})
+		
+		# temporal sharding: hand the (preallocated) data file over to worker processes
+		if ap['mode'] == 'analyze' and ap['workers'] > 1 and not ap['display'] and have_mov:
+			del fp
+			self.capture.release()
+			shards = split_frame_range(offset_frames, offset_frames + dur_frames, stride_frames, ap['workers'])
+			if verbose: _log.info('shards: %s', shards)
+			failed = run_shards(self._analyze_shard, [(k, start, end, offset_frames, shape, frame_size) for k, (start, end) in enumerate(shards)])
+			if len(failed) > 0:
+				_log.error('Shard error! Failed shards: %s', [shards[n] for n in failed])
+			else:
+				progress.save(dur_strides, complete=True)
+				for k in range(len(shards)):
+					os.remove(progress_path(self.data_path, k))
+				finish_feature_file(self.data_path, ap)
+			return
 		
 		if ap['display']:
 			cv.NamedWindow('Image', cv.CV_WINDOW_AUTOSIZE)
 			cv.ResizeWindow('Image', frame_width, frame_height)
 		
-		self.frame_idx = offset_frames
 		end_frame = offset_frames + dur_frames
+		# when resuming, the stride before the first uncommitted one only seeds the correlation
+		seed_frame = offset_frames + (max(start_stride - 1, 0) * stride_frames)
 
 		if have_mov:
-			self.capture.set(cv.CV_CAP_PROP_POS_FRAMES, offset_frames)
-			ret, frame = self.capture.read()
-			if frame is None: 
-				print 'Frame error! Exiting...'
-				return # no image captured... end the processing		
-			frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-			prev_frame_gray = np.float32(frame_gray[:])
-		
-			fhann = cv2.createHanningWindow((frame_width,frame_height), cv2.CV_32FC1)
-			ghann = cv2.createHanningWindow((grid_width,grid_height), cv2.CV_32FC1)
-		
-			for row in range(grid_y_divs):
-				for col in range(grid_x_divs):
-					prev_sub_grays += [np.float32(frame_gray[(row*grid_height):((row+1)*grid_height), (col*grid_width):((col+1)*grid_width)])]
-		
+			correlator = self._correlator(frame_size)
+			frames = open_frame_source(self.capture, seed_frame, end_frame, stride_frames, ap['frame_access'], ap['gop_size'], ap['prefetch'], frame_size)
+			if verbose: _log.info('frame access: %s', frames.access)
+			if ap['mode'] == 'analyze':
+				writer = feature_writer(fp, ap, progress)
 		else:
-			frame = np.empty((frame_width, frame_height), np.uint8)
-			print frame.shape
-
-		self.frame_idx += 1
-		
-		print "<<< ", frame.mean()
-# 		cv.ShowImage('Image', cv.fromarray(frame))
-
-
+			frames = blank_frames(offset_frames, end_frame, stride_frames, (frame_height, frame_width, 3))
 
-		while self.frame_idx < end_frame:
+		reporter = ProgressReporter(_log, dur_strides, os.path.basename(self.data_path), 'strides', start=start_stride)
+		aborted = False
+		for self.frame_idx, frame in frames:
 			
-			if (self.frame_idx % 1000) == 0: print 'fr. idx: ', self.frame_idx, ' (', self.frame_idx / float(end_frame), ' | ', end_frame, ')'
-
+			# rows are relative to the offset in analysis mode, absolute in playback mode
+			curr_stride_frame = (self.frame_idx - offset_frames) / stride_frames
+			if ap['mode'] == 'playback':
+				curr_stride_frame += offset_strides
+			
+			# every frame is transformed once; its spectra are reused for the correlation with the next one
 			if have_mov:
-				# grab next frame
-				ret, frame = self.capture.read()
-				if frame is None: 
-					print 'Frame error! Exiting...'
-					break # no image captured... end the processing
-				frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-			else:
-				frame[:] = 0
+				spectra = correlator.spectra(frame)
+			
+			# the first frame only provides the previous frame for the first correlation
+			if self.frame_idx == seed_frame:
+				if have_mov:
+					prev_spectra = spectra
+				continue
 			
-			# display stage (full)
+			# access stage (full + gridded)
 			if ap['mode'] == 'playback' and ap['display']:
-				fret = fp[self.frame_idx][64]
-				# print fret
+				record = fp[curr_stride_frame]
 			elif have_mov:
-				fret, fres = cv2.phaseCorrelateRes(prev_frame_gray, np.float32(frame_gray[:]), fhann)
-				print fret
-				if abs(fres) > 0.01:
-					fp[self.frame_idx][64] = [(fret[0]/frame_width),(fret[1]/frame_height)]
-				else:
-					fp[self.frame_idx][64] = [0,0]
+				record = correlator.correlate(prev_spectra, spectra)
+				writer.write(curr_stride_frame, record)
+				reporter.update(curr_stride_frame + 1)
 			else:
 				return
 			
 			# display stage (gridded)
-			for row in range(grid_y_divs):
-				for col in range(grid_x_divs):
-					if ap['mode'] == 'playback' and ap['display']:
-						cell = ((row*8)+col)
-						gret = fp[self.frame_idx][cell]
-					elif have_mov:
-						sub_gray = np.float32(frame_gray[(row*grid_height):((row+1)*grid_height), (col*grid_width):((col+1)*grid_width)][:])
-						gret, gres = cv2.phaseCorrelateRes(prev_sub_grays[(row*grid_x_divs)+col], sub_gray, ghann)
-						prev_sub_grays[(row*grid_x_divs)+col] = sub_gray
-						if abs(gres) > 0.7: # WAS 0.01!!!!
-							fp[self.frame_idx][(row*grid_x_divs)+col] = [(gret[0]/grid_width),(gret[1]/grid_height)]
- 						else:
-							fp[self.frame_idx][(row*grid_x_divs)+col] = [0,0]
-					else:
-						return
-					
-					if ap['display'] and (gret[0] != 0 and gret[1] != 0):
-						print gret
-						print grid_size
-						print centers_x[col]
-						print centers_y[row]
-						xval = int(min((gret[0]*1000), grid_size[0])+centers_x[col])
-						yval = int(min((gret[1]*1000), grid_size[1])+centers_y[row])
-						# print ((centers_x[i], centers_y[j], xval, yval), False, (0,255,255))
-						print (centers_x[col], centers_y[row])	
-						print (xval, yval)
-						cv2.line(frame, (centers_x[col], centers_y[row]), (xval, yval), (255,255,255))
+			if ap['display']:
+				shifts = threshold_shifts(record, ap['frame_threshold'], ap['cell_threshold'])
+				for row in range(grid_y_divs):
+					for col in range(grid_x_divs):
+						gret = shifts[(row*grid_x_divs)+col]
+						
+						if (gret[0] != 0 and gret[1] != 0):
+							xval = int(min((gret[0]*1000), grid_size[0])+centers_x[col])
+							yval = int(min((gret[1]*1000), grid_size[1])+centers_y[row])
+							cv2.line(frame, (centers_x[col], centers_y[row]), (xval, yval), (255,255,255))
 				
 			#### SHOW
 			if ap['display'] and have_mov:
-				print "<<< ", frame.mean()
 				cv.ShowImage('Image', cv.fromarray(frame))
-			fp.flush()
 			
-			self.frame_idx += 1
 			if have_mov:
-				self.prev_gray = np.float32(frame_gray[:])
+				prev_spectra = spectra
 			
 			# handle events for abort
-			k = cv.WaitKey (int(1000 / ap['afps']))	
-			if k % 0x100 == 27:
-				# user has press the ESC key, so exit
+			if ap['display']:
+				k = cv.WaitKey (int(1000 / ap['afps']))	
+				if k % 0x100 == 27:
+					# user has press the ESC key, so exit
+					aborted = True
 					break
 		
+		if have_mov and frames.frame_error:
+			_log.error('Frame error! Exiting...')
+		
+		if ap['mode'] == 'analyze' and have_mov:
+			writer.close(complete=(not aborted and not frames.frame_error))
+			reporter.finish()
 		del fp
+		if ap['mode'] == 'analyze' and have_mov and not aborted and not frames.frame_error:
+			finish_feature_file(self.data_path, ap)
 		if ap['display']:
 			cv2.destroyAllWindows()
 	
 	
+	def _analyze_shard(self, shard, start_frame, end_frame, offset_frames, shape, frame_size):
+		"""
+		Worker function for sharded analysis (see analyze_movie). Opens its own capture and seeks once, to the stride frame just before start_frame (unless this is the first shard), which is decoded only to be correlated with start_frame. Writes the analysis frames in [start_frame, end_frame), scaled to frame_size (the analysis frame size of the parent), to their rows of the data file. Keeps its own progress record; when resuming, start_frame moves up to the first stride the shard has not committed yet. Exits with status 1 after a frame error (the shard is then incomplete).
+		"""
+		ap = self.analysis_params
+		stride_frames = ap['stride']
+		progress = ProgressRecord(progress_path(self.data_path, shard), dict(ap, shard=[start_frame, end_frame]), self.movie_path, shape)
+		if ap['resume'] and progress.load():
+			if progress.complete:
+				return
+			start_frame = max(start_frame, offset_frames + (progress.committed_strides * stride_frames))
+		else:
+			progress.save(0)
+		capture = cv2.VideoCapture(self.movie_path)
+		correlator = self._correlator(frame_size)
+		
+		fp = map_feature_file(self.data_path, shape[1:], mode='r+')
+		writer = feature_writer(fp, ap, progress)
+		frames = open_frame_source(capture, max(offset_frames, start_frame - stride_frames), end_frame, stride_frames, ap['frame_access'], ap['gop_size'], ap['prefetch'], frame_size)
+		prev_spectra = None
+		for frame_idx, frame in frames:
+			spectra = correlator.spectra(frame)
+			if prev_spectra is not None:
+				writer.write((frame_idx - offset_frames) / stride_frames, correlator.correlate(prev_spectra, spectra))
+			prev_spectra = spectra
+		writer.close(complete=(not frames.frame_error))
+		del fp
+		capture.release()
+		if frames.frame_error:
+			# a non-zero exit code makes run_shards report the shard as failed (it can be resumed)
+			_log.error('Frame error! Exiting shard %s', (start_frame, end_frame))
+			sys.exit(1)
+	
 	def _display_movie_frame_by_frame(self, **kwargs):
 		"""
 		Same as _process function's playback capabilities, but with interactive keyboard control.
@@ -752,21 +1068,22 @@ class PhaseCorrelation:
 		
 		"""
 		if not HAVE_CV:
-			print "WARNING: You must install OpenCV in order to analyze or view!"
+			_log.warning('You must install OpenCV in order to analyze or view!')
 			return
 		
 		if (self.movie_path is None) and (self.data_path is None):
-			print "Both movie path and data path are missing! Please supply at least one."
+			_log.error('Both movie path and data path are missing! Please supply at least one.')
 			return None
 		
 		have_mov = os.path.exists(self.movie_path)
 		have_data = os.path.exists(self.data_path)
 		
 		if (have_mov is False) and (have_data is False):
-			print "Both movie file and data file are missing! Please supply at least one."
+			_log.error('Both movie file and data file are missing! Please supply at least one.')
 			return None
 		
  		ap = self._check_pcorr_params(kwargs)
+		self._load_metadata()
 		ap = self.analysis_params
 		verbose = ap['verbose']
 		
@@ -776,8 +1093,7 @@ class PhaseCorrelation:
 			frame_height = int(self.capture.get(cv.CV_CAP_PROP_FRAME_HEIGHT))
 		else:
 			frame_width = 800
-			frame_height = int(float(frame_width) * self._read_json_value('aspect'))
-			print self._read_json_value('aspect')
+			frame_height = int(frame_width / self.metadata().aspect)
 		
 		fps = ap['fps']
 		grid_x_divs = ap['grid_divs_x']
@@ -787,14 +1103,13 @@ class PhaseCorrelation:
 		grid_height = int(frame_height/float(grid_y_divs))
 		grid_size = (grid_width, grid_height)
 		
-		print frame_width
-		print frame_height
+		_log.debug('frame size: %s x %s', frame_width, frame_height)
 		
 		centers_x = range((frame_width/16),frame_width,(frame_width/8))
 		centers_y = range((frame_height/16),frame_height,(frame_height/8))
 		
 		if verbose:
-			print fps, ' | ', frame_size, ' | ', grid_size
+			_log.info('fps, frame size, grid size: %s | %s | %s', fps, frame_size, grid_size)
 				
 		# container for prev. frame's grayscale subframes
 		prev_sub_grays = []								
@@ -804,14 +1119,14 @@ class PhaseCorrelation:
 		else:
 			offset_secs = 0
 		
-		print "%%% ", ap['duration']
+		_log.debug('duration: %s', ap['duration'])
 		
 		if ap['duration'] > 0:
 			dur_secs = ap['duration']
 		elif ap['duration'] < 0:
 			ap['duration'] = self.determine_movie_length()
 		else:
-			print "Duration cannot be 0."
+			_log.error('Duration cannot be 0.')
 			return
 		dur_secs = ap['duration']
 		
@@ -830,23 +1145,22 @@ class PhaseCorrelation:
 		dur_frames = dur_strides * stride_frames
 		
 		if verbose:
-			print '%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%'
-			print 'DUR TOTAL: ', dur_total_secs
-			print "OFFSET (SECONDS): ", offset_secs
-			print "OFFSET (STRIDES): ", offset_strides
-			print "OFFSET (FRAMES): ", offset_frames
-			print "DUR (SECONDS): ", dur_secs
-			print 'DUR (STRIDES): ', dur_strides
-			print 'DUR (FRAMES): ', dur_frames
-			print 'XDIVS: ', grid_x_divs
-			print 'YDIVS: ', grid_y_divs
-			print "FPS: ", fps
-			print "stride_frames: ", stride_frames
+			_log.info('DUR TOTAL: %s', ap['duration'])
+			_log.info('OFFSET (SECONDS): %s', offset_secs)
+			_log.info('OFFSET (STRIDES): %s', offset_strides)
+			_log.info('OFFSET (FRAMES): %s', offset_frames)
+			_log.info('DUR (SECONDS): %s', dur_secs)
+			_log.info('DUR (STRIDES): %s', dur_strides)
+			_log.info('DUR (FRAMES): %s', dur_frames)
+			_log.info('XDIVS: %s', grid_x_divs)
+			_log.info('YDIVS: %s', grid_y_divs)
+			_log.info('FPS: %s', fps)
+			_log.info('stride_frames: %s', stride_frames)
 		
 		# set up memmap
 		# mode should always be playback and dislay should always be true!!!
 		if ap['mode'] == 'playback' and ap['display'] == True and have_data:
-			fp = np.memmap(self.data_path, dtype='float32', mode='r', shape=((offset_strides + dur_strides),(64+1),2))
+			fp = map_feature_file(self.data_path, ((64+1), self._record_channels()))
 			cv2.namedWindow('Image', cv.CV_WINDOW_AUTOSIZE)
 			cv2.resizeWindow('Image', frame_width, frame_height)
 		
@@ -857,13 +1171,13 @@ class PhaseCorrelation:
 			self.capture.set(cv2.cv.CV_CAP_PROP_POS_FRAMES, offset_frames)
 			ret, frame = self.capture.read()
 			if frame is None: 
-				print 'Frame error! Exiting...'
+				_log.error('Frame error! Exiting...')
 				return # no image captured... end the processing		
 					
 		else:
 # 			frame = np.empty((frame_width, frame_height), np.uint8)
 			frame = np.zeros((int(frame_height), int(frame_width), 3), np.uint8)
-			print frame.shape
+			_log.debug('blank frame: %s', frame.shape)
 
 		self.frame_idx += 1
 		playing_flag = True
@@ -877,7 +1191,7 @@ class PhaseCorrelation:
 				# grab next frame
 				ret, frame = self.capture.read()
 				if frame is None: 
-					print 'Frame error! Exiting...'
+					_log.error('Frame error! Exiting...')
 					break # no image captured... end the processing
 			else:
 				frame[:] = 0
@@ -887,7 +1201,7 @@ class PhaseCorrelation:
 				for col in range(grid_x_divs):
 					if ap['mode'] == 'playback' and ap['display']:
 						cell = ((row*8)+col)
-						gret = fp[self.frame_idx][cell]
+						gret = threshold_shifts(fp[self.frame_idx], ap['frame_threshold'], ap['cell_threshold'])[cell]
 					else:
 						return
 					
@@ -904,9 +1218,8 @@ class PhaseCorrelation:
 						cv2.line(frame, (centers_x[col], centers_y[row]), (xval, yval), (255,255,255))
 				#### SHOW
 				cv.ShowImage('Image', cv.fromarray(frame))
-				fp.flush()
 	
-				print self.frame_idx, ':: ', (float(self.frame_idx - offset_frames) / dur_frames)
+				_log.debug('frame %s :: %s', self.frame_idx, (float(self.frame_idx - offset_frames) / dur_frames))
 				
 			# check p_state				
 			if p_state == 1: # rew. 10 sec.
@@ -929,9 +1242,7 @@ class PhaseCorrelation:
 			# handle key events
 			k = cv.WaitKey (int(1000 / ap['afps']))
 			if verbose is True:
-				print '>>>>>>>>>>>>>>>>>>'
-				print k % 0x100
-				print p_state
+				_log.info('key: %s, state: %s', (k % 0x100), p_state)
 			
 			if k % 0x100 == 27:
 				# user has press the ESC key, so exit
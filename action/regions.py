@@ -0,0 +1,137 @@
+# regions.py - named region selectors (bands and quads of grid cells) for the feature accessors
+# Bregman:ACTION - Cinematic information retrieval toolkit
+
+"""
+Part of Bregman:ACTION - Cinematic information retrieval toolkit
+
+Overview
+========
+
+The analyzers divide every frame into a grid of cells (4 by 4 for ColorFeaturesLAB, 8 by 8 for PhaseCorrelation, OpticalFlow and OpticalFlowTVL1) and store one record per cell. The accessors that return part of the grid (center_quad_*, middle_band_*, plus_band_*) select the cells through a named region selector:
+
++-------------+--------------------------------------------------------------+-----------------------+
+| name        | cells                                                        | 4 by 4 grid           |
++=============+==============================================================+=======================+
+| gridded     | all cells                                                    | 0 to 15               |
++-------------+--------------------------------------------------------------+-----------------------+
+| middle_band | the middle rows: all but the top and bottom quarter          | 4 to 11               |
++-------------+--------------------------------------------------------------+-----------------------+
+| center_quad | where the middle rows and the middle columns cross           | 5, 6, 9, 10           |
++-------------+--------------------------------------------------------------+-----------------------+
+| plus_band   | the middle rows and the middle columns (all but the corners) | 1, 2, 4 to 11, 13, 14 |
++-------------+--------------------------------------------------------------+-----------------------+
+
+A selector is declared once, as a function of the grid geometry, and compiled once per geometry: region_selector returns a RegionSelector with the cell indices as a slice whenever they are evenly spaced (so selecting them from a memory-mapped window costs no copy) and as an index array otherwise. Its select method takes every access_stride-th frame first and only then picks the cells, so that only the requested frames of the selected cells are ever copied:
+
+.. code-block:: python
+
+	middle = region_selector('middle_band', 8, 8)
+	X = middle.select(grid, access_stride=6)	# grid: [FRAMES, 64, 2] -> X: [FRAMES / 6, 64]
+
+More selectors can be added with register_region_selector.
+
+"""
+__version__ = '1.0'
+__author__ = 'Thomas Stoll'
+__copyright__ = "Copyright (C) 2012  Michael Casey, Thomas Stoll, Dartmouth College, All Rights Reserved"
+__license__ = "gpl 2.0 or higher"
+__email__ = 'thomas.m.stoll@dartmouth.edu'
+
+import threading
+import numpy as np
+
+
+def middle_divisions(n):
+	"""
+	Indices of the middle rows (or columns) of a grid with n divisions: all but the first and last quarter.
+	"""
+	return range((n // 4), (n - (n // 4)))
+
+
+def _gridded_cells(gx, gy):
+	return range(gx * gy)
+
+def _middle_band_cells(gx, gy):
+	return [(row * gx) + col for row in middle_divisions(gy) for col in range(gx)]
+
+def _center_quad_cells(gx, gy):
+	return [(row * gx) + col for row in middle_divisions(gy) for col in middle_divisions(gx)]
+
+def _plus_band_cells(gx, gy):
+	return [(row * gx) + col for row in range(gy) for col in range(gx) if (row in middle_divisions(gy)) or (col in middle_divisions(gx))]
+
+# name -> function of the grid geometry (grid_divs_x, grid_divs_y) that returns the (row by row) cell indices
+REGION_SELECTORS = {
+	'gridded' : _gridded_cells,
+	'middle_band' : _middle_band_cells,
+	'center_quad' : _center_quad_cells,
+	'plus_band' : _plus_band_cells
+}
+
+# (name, grid_divs_x, grid_divs_y) -> RegionSelector
+_compiled = {}
+_lock = threading.Lock()
+
+
+class RegionSelector(object):
+	"""
+	A named set of grid cells, compiled for one grid geometry. The cells attribute lists the cell indices (row by row); index is the equivalent slice if the cells are evenly spaced, otherwise an integer index array.
+	"""
+	def __init__(self, name, grid_divs_x, grid_divs_y, cells):
+		self.name = name
+		self.grid_divs_x = grid_divs_x
+		self.grid_divs_y = grid_divs_y
+		self.cells = sorted(cells)
+		self.index = _cell_index(self.cells)
+
+	def __len__(self):
+		return len(self.cells)
+
+	def select(self, grid, access_stride=1, drop_last=False):
+		"""
+		Select the cells from grid, an array (or memmap) of shape [FRAMES, CELLS, ...]. Takes every access_stride-th frame first (leaving out the last frame if drop_last), then the cells; returns a two-dimensional array [FRAMES / access_stride, len(cells) * values per cell].
+		"""
+		rows = grid[0:(-1 if drop_last else None):max(int(access_stride), 1)]
+		if isinstance(self.index, slice):
+			selected = rows[:, self.index]
+		else:
+			selected = np.take(rows, self.index, axis=1)
+		return selected.reshape(selected.shape[0], -1)
+
+
+def region_selector(name, grid_divs_x, grid_divs_y):
+	"""
+	The RegionSelector for a named selector (see REGION_SELECTORS) on a grid_divs_x by grid_divs_y grid; compiled on first use and memoised.
+	"""
+	key = (name, int(grid_divs_x), int(grid_divs_y))
+	with _lock:
+		selector = _compiled.get(key)
+		if selector is None:
+			if name not in REGION_SELECTORS:
+				raise ValueError("Unknown region selector: %s" % name)
+			selector = RegionSelector(name, key[1], key[2], REGION_SELECTORS[name](key[1], key[2]))
+			_compiled[key] = selector
+		return selector
+
+
+def register_region_selector(name, cells_func):
+	"""
+	Add (or replace) a named selector. cells_func(grid_divs_x, grid_divs_y) returns the indices of the selected cells, row by row.
+	"""
+	with _lock:
+		REGION_SELECTORS[name] = cells_func
+		for key in [key for key in _compiled if key[0] == name]:
+			del _compiled[key]
+
+
+def _cell_index(cells):
+	"""
+	A slice for evenly spaced cells, otherwise an index array.
+	"""
+	if len(cells) == 0:
+		return np.zeros(0, dtype=np.intp)
+	steps = set(np.diff(cells)) if len(cells) > 1 else set([1])
+	if len(steps) == 1 and min(steps) > 0:
+		step = int(steps.pop())
+		return slice(int(cells[0]), int(cells[-1]) + 1, step)
+	return np.array(cells, dtype=np.intp)
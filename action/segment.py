@@ -10,6 +10,8 @@ __email__ = 'thomas.m.stoll@dartmouth.edu'
 import numpy as np
 import pylab as P
 import scipy.signal
+from actionlog import *
+_log = get_logger(__name__)
 #import actiondata
 
 
@@ -101,8 +103,7 @@ class Segmentation(object):
         res = []
         for seg in self.time_spans:
             res += [seg.features]
-        print feature_len
-        print np.array(res).shape
+        _log.debug('features: %s, segments x features: %s', feature_len, np.array(res).shape)
         return np.reshape(np.array(res), (-1, feature_len))
 
 
@@ -142,7 +143,7 @@ class VideoSegmentor(Segmentor):
         elif self.cluster_algo is 'KM':
             self.assigns, self.num_clusters = self.ad.cluster_k_means(self.F.X, self.num_clusters)
         else:
-            print 'Error, valid choices are HC or KM'
+            _log.error('Valid choices are HC or KM')
             return None
         
         self.diffs = np.where(np.r_[1,np.diff(self.assigns),1])[0]
@@ -207,14 +208,13 @@ class VideoSegmentor(Segmentor):
         for i in range(0, self.F.determine_movie_length(), gran):
             # always concat
             try:
-                print counter
                 final_resegmented = np.append(np.atleast_2d(final_resegmented), np.atleast_2d(self.segmentation[counter].features), axis=0)
                 if self.segmentation[counter].time_span.start_time < i:
 		    	    ##
                     counter += 1
             except IndexError:
                 counter -= 1
-                print 'backing up: ', counter
+                _log.debug('backing up: %s', counter)
                 final_resegmented = np.append(np.atleast_2d(self.segmentation), np.atleast_2d(self.segmentation[counter].features), axis=0)
         ssm_resegmented = self.ad.calculate_self_similarity_matrix(final_resegmented)
         return final_resegmented, ssm_resegmented
@@ -1,6 +1,7 @@
 import glob, os, argparse
 import multiprocessing
 from action.suite import *
+from action.featurestore import analysis_incomplete
 
 ACTIONDIR = '/Volumes/ACTION'
 NUM_PROCS = 4 # This is how many processes we want
@@ -25,9 +26,9 @@ def actionAnalyzeAll(clist, plist, olist):
 
 def actionCFLabWorker(cfile):
 	cflab = ColorFeaturesLAB(cfile, action_dir=ACTIONDIR)
-	print 'analyzing colors: ', (hfile + '.mov'), ' ', (cfile + '.color_lab')
+	print 'analyzing colors: ', (cfile + '.mov'), ' ', (cfile + '.color_lab')
 	print 'action_dir=/Volumes/ACTION'
-	cflab.analyze_movie()
+	cflab.analyze_movie(resume=True)
 	print 'DONE analyzing color features: ', (cfile + '.mov'), ' ', (cfile + '.color_lab')
 	return 1
 
@@ -35,7 +36,7 @@ def actionPCorrWorker(pfile):
 	pcorr = PhaseCorrelation(pfile, action_dir=ACTIONDIR)
 	print 'analyzing phasecorr: ', (pfile + '.mov'), ' ', (pfile + '.phasecorr')
 	print 'action_dir=/Volumes/ACTION'
-	pcorr.analyze_movie()
+	pcorr.analyze_movie(resume=True)
 	print 'DONE analyzing phasecorr: ', (pfile + '.mov'), ' ', (pfile + '.phasecorr')
 	return 1
 
@@ -43,11 +44,12 @@ def actionOFlowWorker(ofile):
 	oflow = OpticalFlow(ofile, action_dir=ACTIONDIR)
 	print 'analyzing CFLab: ', (ofile + '.mov'), ' ', (ofile + '.opticalflow24')
 	print 'action_dir=/Volumes/ACTION'
-	oflow.analyze_movie()
+	oflow.analyze_movie(resume=True)
 	print 'DONE analyzing optical flow: ', (ofile + '.mov'), ' ', (ofile + '.opticalflow24')
 	return 1
 
 if __name__ == '__main__':
+	configure_logging()
 	parser = argparse.ArgumentParser()
 	parser.add_argument("actiondir")
 	parser.add_argument("numprocs")
@@ -65,12 +67,13 @@ if __name__ == '__main__':
 
 	os.chdir(ACTIONDIR)
 	names = [os.path.dirname(file) for file in glob.glob('*/*.mov')]
+	# data files whose progress record is not marked complete were interrupted: analyze (resume) them again
 	names_with_proper_cflab_exts = glob.glob('*/*.color_lab')
-	just_names_of_cflabs = [os.path.dirname(file) for file in names_with_proper_cflab_exts]
+	just_names_of_cflabs = [os.path.dirname(file) for file in names_with_proper_cflab_exts if not analysis_incomplete(file)]
 	names_with_proper_pcorr_exts = glob.glob('*/*.phasecorr')
-	just_names_of_pcorrs = [os.path.dirname(file) for file in names_with_proper_pcorr_exts]
+	just_names_of_pcorrs = [os.path.dirname(file) for file in names_with_proper_pcorr_exts if not analysis_incomplete(file)]
 	names_with_proper_oflow_exts = glob.glob('*/*.opticalflow24')
-	just_names_of_oflows = [os.path.dirname(file) for file in names_with_proper_oflow_exts]
+	just_names_of_oflows = [os.path.dirname(file) for file in names_with_proper_oflow_exts if not analysis_incomplete(file)]
 
 	cflabs_to_analyze = set(names).difference(set(just_names_of_cflabs))
 	pcorrs_to_analyze = set(names).difference(set(just_names_of_pcorrs))
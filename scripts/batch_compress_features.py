@@ -0,0 +1,45 @@
+import glob, os, time, argparse
+from action.featurestore import *
+
+# Compress the finished data files of every title in an ACTION directory in place, in chunks of analysis frames
+# (see the Compression section of action.featurestore). Files without a header, files that are already compressed,
+# sparse files and files of incomplete analysis runs are skipped.
+#
+# python batch_compress_features.py /Volumes/ACTION --extensions .opticalflow24 .phasecorr --chunk-frames 256 --codec zlib
+
+ACTIONDIR = '/Volumes/ACTION'
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("actiondir")
+	parser.add_argument("--extensions", nargs='+', default=['.opticalflow24'])
+	parser.add_argument("--chunk-frames", type=int, default=256)
+	parser.add_argument("--codec", default='zlib', choices=sorted(CODECS))
+	args = parser.parse_args()
+
+	if args.actiondir is not None:
+		ACTIONDIR = args.actiondir
+
+	os.chdir(ACTIONDIR)
+	total_before, total_after = 0, 0
+	for ext in args.extensions:
+		for data_path in sorted(glob.glob('*/*' + ext)):
+			if analysis_incomplete(data_path):
+				print 'incomplete, skipped: ', data_path
+				continue
+			try:
+				header = read_feature_header(data_path)
+			except ValueError, e:
+				print 'skipped: ', data_path, e
+				continue
+			if header is None or header.chunk_rows > 0 or header.sparse:
+				continue
+			before = os.path.getsize(data_path)
+			start = time.time()
+			compress_feature_file(data_path, args.chunk_frames, args.codec)
+			after = os.path.getsize(data_path)
+			total_before += before
+			total_after += after
+			print '%s: %i -> %i bytes (%.1f%%) in %.1f s' % (data_path, before, after, (100.0 * after / before), (time.time() - start))
+	if total_before > 0:
+		print 'total: %i -> %i bytes (%.1f%%)' % (total_before, total_after, (100.0 * total_after / total_before))
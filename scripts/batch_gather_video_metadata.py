@@ -5,6 +5,7 @@ from action.suite import *
 ACTIONDIR = '/Volumes/ACTION'
 
 if __name__ == '__main__':
+	configure_logging()
 	parser = argparse.ArgumentParser()
 	parser.add_argument("actiondir")
 	args = parser.parse_args()
@@ -23,6 +24,7 @@ if __name__ == '__main__':
 	# Call the mainfunction that sets up threading.
 	for name in names:
 		cfl = ColorFeaturesLAB(name, action_dir=ACTIONDIR)
-		cfl._write_metadata_to_json()
+		# writes the title's JSON file only if it is missing (or lacks the frame size)
+		cfl.metadata()
 		del cfl
 
@@ -58,6 +58,7 @@ def actionWorkerAudio(title):
 	return 1
 
 if __name__ == '__main__':
+	configure_logging()
 	parser = argparse.ArgumentParser()
 	parser.add_argument("actiondir")
 	parser.add_argument("proclimit")
@@ -88,6 +88,7 @@ def actionWorker(title):
 	return 1
 
 if __name__ == '__main__':
+	configure_logging()
 	parser = argparse.ArgumentParser()
 	parser.add_argument("actiondir")
 	parser.add_argument("proclimit")
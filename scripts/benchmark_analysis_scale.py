@@ -0,0 +1,79 @@
+import os, time, argparse
+import numpy as np
+import cv2
+import cv2.cv as cv
+from action.suite import *
+from action.framesource import *
+
+# Benchmark the downscaled-analysis mode (analysis_scale / analysis_max_dim) of ColorFeaturesLAB and PhaseCorrelation.
+# For a sample of analysis frames from one title, the color and phase-correlation kernels are run on the frames
+# at full resolution and at each scale; reports the time per frame (resize included) and how far the features
+# drift from the full-resolution ones.
+#
+# python benchmark_analysis_scale.py /Volumes/ACTION Psycho --scales 1.0 0.5 0.25 0.125 --frames 200
+
+ACTIONDIR = '/Volumes/ACTION'
+
+def sample_frames(movie_path, stride, num_frames, offset_secs, fps):
+	capture = cv2.VideoCapture(movie_path)
+	start_frame = int(offset_secs * fps)
+	frames = [frame.copy() for frame_idx, frame in FrameSource(capture, start_frame, start_frame + (stride * num_frames), stride)]
+	capture.release()
+	return frames
+
+def color_features(cfl, frames, size):
+	bin_lut, region_keys = cfl._kernel_tables(size[0], size[1])
+	records = []
+	start = time.time()
+	for frame in frames:
+		records.append(cfl._analyze_frame(resize_frame(frame, size), bin_lut, region_keys, thresh=cfl.analysis_params['threshold']))
+	return np.array(records), (time.time() - start) / len(frames)
+
+def phasecorr_features(pcorr, frames, size):
+	ap = pcorr.analysis_params
+	correlator = pcorr._correlator(size)
+	records = []
+	start = time.time()
+	prev_spectra = correlator.spectra(resize_frame(frames[0], size))
+	for frame in frames[1:]:
+		spectra = correlator.spectra(resize_frame(frame, size))
+		records.append(correlator.correlate(prev_spectra, spectra))
+		prev_spectra = spectra
+	return threshold_shifts(np.array(records), ap['frame_threshold'], ap['cell_threshold']), (time.time() - start) / (len(frames) - 1)
+
+if __name__ == '__main__':
+	configure_logging()
+	parser = argparse.ArgumentParser()
+	parser.add_argument("actiondir")
+	parser.add_argument("title")
+	parser.add_argument("--scales", type=float, nargs='+', default=[1.0, 0.5, 0.25, 0.125])
+	parser.add_argument("--frames", type=int, default=100)
+	parser.add_argument("--offset", type=float, default=60.0)
+	args = parser.parse_args()
+
+	if args.actiondir is not None:
+		ACTIONDIR = args.actiondir
+
+	cfl = ColorFeaturesLAB(args.title, action_dir=ACTIONDIR)
+	pcorr = PhaseCorrelation(args.title, action_dir=ACTIONDIR)
+	full_size = (cfl.metadata().width, cfl.metadata().height)
+
+	cfl_frames = sample_frames(cfl.movie_path, cfl.analysis_params['stride'], args.frames, args.offset, cfl.analysis_params['fps'])
+	pcorr_frames = sample_frames(pcorr.movie_path, pcorr.analysis_params['stride'], args.frames + 1, args.offset, pcorr.analysis_params['fps'])
+	print 'title: ', args.title, ' | full size: ', full_size, ' | frames: ', len(cfl_frames), ' (color), ', (len(pcorr_frames) - 1), ' (phasecorr)'
+
+	ref_color, ref_color_secs = color_features(cfl, cfl_frames, full_size)
+	ref_pcorr, ref_pcorr_secs = phasecorr_features(pcorr, pcorr_frames, full_size)
+
+	# color drift: L2 distance between (L2-normalized) histograms, per region and channel
+	# phasecorr drift: absolute difference of the normalized shifts; gating: share of cells where one side is zeroed out and the other is not
+	print ''
+	print '%8s %12s | %10s %8s %10s %10s | %10s %8s %10s %10s %10s' % ('scale', 'size', 'color ms', 'speedup', 'mean dist', 'max dist', 'pcorr ms', 'speedup', 'full diff', 'cell diff', 'gating')
+	for scale in args.scales:
+		size = analysis_frame_size(full_size[0], full_size[1], scale)
+		color, color_secs = color_features(cfl, cfl_frames, size)
+		pcorr_recs, pcorr_secs = phasecorr_features(pcorr, pcorr_frames, size)
+		color_dist = np.sqrt(np.sum(np.square(color - ref_color), axis=-1))
+		shift_diff = np.abs(pcorr_recs - ref_pcorr)
+		gated = (np.any(pcorr_recs != 0, axis=-1) != np.any(ref_pcorr != 0, axis=-1))
+		print '%8.3f %12s | %10.2f %8.2f %10.4f %10.4f | %10.2f %8.2f %10.5f %10.5f %10.3f' % (scale, ('%ix%i' % size), (color_secs * 1000.), (ref_color_secs / color_secs), color_dist.mean(), color_dist.max(), (pcorr_secs * 1000.), (ref_pcorr_secs / pcorr_secs), shift_diff[:,-1].mean(), shift_diff[:,:-1].mean(), gated[:,:-1].mean())